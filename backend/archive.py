@@ -0,0 +1,181 @@
+"""
+Folders streamed as ZIP archives.
+
+A worker thread walks the folder's subtree and writes the ZIP into a small
+bounded queue; the response drains that queue as the client reads, so
+memory stays constant and nothing touches a temp file. zipfile writes to
+the unseekable stream with data descriptors and switches to ZIP64 for
+large members. Formats that are already compressed are stored as-is. When
+the client disconnects the worker stops at its next write.
+"""
+
+import asyncio
+import logging
+import shutil
+import threading
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import quote
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from models import User, UserFile
+from config import ARCHIVE_MAX_CONCURRENT, ARCHIVE_COMPRESSLEVEL
+import file_operations
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+QUEUE_CHUNKS = 8
+PUT_POLL_SECONDS = 1.0
+
+STORED_SUFFIXES = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".ogg", ".flac", ".m4a", ".aac", ".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk", ".whl",
+}
+STORED_MIME_PREFIXES = ("image/", "audio/", "video/")
+
+# Archive workers currently running; a soft cap, checked before a response starts.
+_active = 0
+_active_lock = threading.Lock()
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """Write-only, unseekable file object that hands CHUNK_SIZE pieces to the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, cancelled: threading.Event):
+        self.loop = loop
+        self.queue = queue
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        if self.cancelled.is_set():
+            raise ArchiveCancelled()
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def _put(self, item):
+        # Blocks while the queue is full, which is what keeps memory bounded when the client reads slowly.
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while True:
+            try:
+                return future.result(PUT_POLL_SECONDS)
+            except TimeoutError:
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise ArchiveCancelled()
+
+
+def _is_stored(row) -> bool:
+    if Path(row.filename).suffix.lower() in STORED_SUFFIXES:
+        return True
+    return bool(row.mime_type) and row.mime_type.startswith(STORED_MIME_PREFIXES)
+
+def _zip_info(arcname: str, path: Path, row) -> Optional[zipfile.ZipInfo]:
+    try:
+        info = zipfile.ZipInfo.from_file(path, arcname)
+    except FileNotFoundError:
+        if not row.is_folder:
+            logger.warning("Skipping %s in archive: missing on disk", path)
+            return None
+        info = zipfile.ZipInfo(arcname + "/", datetime.utcnow().timetuple()[:6])
+        info.external_attr = 0o40775 << 16 | 0x10
+    if not info.is_dir():
+        info.compress_type = zipfile.ZIP_STORED if _is_stored(row) else zipfile.ZIP_DEFLATED
+        # ZipFile.open() ignores the archive's compresslevel for a ZipInfo it is handed; the
+        # attribute is private before Python 3.13 (`compress_level` from there on, with this alias kept).
+        info._compresslevel = ARCHIVE_COMPRESSLEVEL
+    return info
+
+def _write_archive(entries: List[Tuple[str, Path, object]], writer: _QueueWriter):
+    with zipfile.ZipFile(writer, mode="w", allowZip64=True) as archive:
+        for arcname, path, row in entries:
+            info = _zip_info(arcname, path, row)
+            if info is None:
+                continue
+            if info.is_dir():
+                archive.writestr(info, b"")
+                continue
+            try:
+                with open(path, "rb") as source, archive.open(info, "w") as target:
+                    shutil.copyfileobj(source, target, CHUNK_SIZE)
+            except FileNotFoundError:
+                logger.warning("Skipping %s in archive: removed while archiving", path)
+    writer.close()
+
+
+async def _stream(entries: List[Tuple[str, Path, object]]) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        global _active
+        with _active_lock:
+            _active += 1
+        try:
+            _write_archive(entries, _QueueWriter(loop, queue, cancelled))
+        except ArchiveCancelled:
+            pass
+        except Exception:
+            logger.exception("Archive worker failed")
+        finally:
+            with _active_lock:
+                _active -= 1
+            if not cancelled.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop)
+
+    threading.Thread(target=produce, name="archive-writer", daemon=True).start()
+    try:
+        while (chunk := await queue.get()) is not done:
+            yield chunk
+    finally:
+        # Client went away (or the stream finished): stop the worker and unblock a pending put.
+        cancelled.set()
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def archive_folder(db: Session, user: User, folder_id: int) -> StreamingResponse:
+    folder = file_operations._get_folder(db, user, folder_id)
+    rows = db.query(UserFile.filename, UserFile.relative_path, UserFile.is_folder, UserFile.mime_type, UserFile.blob_sha).filter(
+        UserFile.id.in_(file_operations.subtree_ids(user, folder.id))
+    ).order_by(UserFile.relative_path).all()
+
+    # Entries are named relative to the folder's parent, so the archive unpacks into one folder.
+    strip = len(folder.relative_path) - len(folder.filename)
+    entries = [(row.relative_path[strip:], file_operations.content_path(user, row), row) for row in rows]
+
+    if _active >= ARCHIVE_MAX_CONCURRENT:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many archives are being built, please retry",
+            headers={"Retry-After": "5"},
+        )
+    filename = f"{folder.filename}.zip"
+    return StreamingResponse(
+        _stream(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
@@ -5,12 +5,13 @@ Functions for authentication and authorization.
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
 from typing import Optional
+import uuid
 import jwt
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
 
-from database import get_db
+from database import SessionLocal
 from models import User
+from user_cache import CachedUser, user_cache
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_MINUTES
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -21,34 +22,51 @@ def create_token(data: dict, expires_delta: Optional[timedelta] = None, is_refre
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES if is_refresh else ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti keeps tokens issued to the same user within the same second distinct.
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return create_token(data, expires_delta)
 
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
-    return create_token(data, expires_delta, is_refresh=True)
+    return create_token({**data, "type": "refresh"}, expires_delta, is_refresh=True)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, refresh: bool = False) -> str:
+    """Username a token was issued to. Refresh tokens are only accepted where `refresh` is set, and only there."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except jwt.PyJWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+    username: str = payload.get("sub")
+    if username is None or (payload.get("type") == "refresh") != refresh:
+        raise _credentials_exception()
+    return username
+
+def load_user(username: str) -> CachedUser:
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if db_user is None:
+        raise _credentials_exception()
+    return user_cache.put(db_user)
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> CachedUser:
+    return load_user(decode_token(token))
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: CachedUser = Depends(get_current_user)):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
@@ -57,6 +75,6 @@ class RoleChecker:
     def __init__(self, allowed_roles: list):
         self.allowed_roles = allowed_roles
 
-    def __call__(self, user: User = Depends(get_current_active_user)):
+    def __call__(self, user: CachedUser = Depends(get_current_active_user)):
         if user.role not in self.allowed_roles:
             raise HTTPException(status_code=403, detail="Operation not permitted")
\ No newline at end of file
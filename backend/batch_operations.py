@@ -0,0 +1,323 @@
+"""
+Batch uploads, deletes, renames and moves applied in one transaction.
+
+Every item is checked against one snapshot of the rows it touches. Items
+that fail get their own error status and are skipped; the rest are written
+with bulk statements and a single commit. Disk work (hashing uploads into
+temporary files, renaming files stored before the blob store) runs in
+parallel on a short-lived thread pool, before the commit, and is undone if
+the commit fails.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from models import User, UserFile
+from schemas import BatchOperation, BatchItemResult, BatchResult
+from config import BATCH_MAX_ITEMS, BATCH_IO_WORKERS
+import blob_store
+import file_operations
+import quotas
+import reaper
+import search
+import thumbnails
+
+OVERWRITE_COLUMNS = (
+    "updated_at", "size", "sha256", "etag", "mime_type", "thumbnail_key", "thumbnail_status", "thumbnail_queued_at", "blob_sha"
+)
+INSERT_COLUMNS = ("user_id", "filename", "relative_path", "is_folder", "parent_id", "created_at") + OVERWRITE_COLUMNS
+
+
+@dataclass
+class _Upload:
+    index: int
+    upload: UploadFile
+    relative_path: str
+    source: Optional[Path] = None
+    row: Optional[UserFile] = None
+    row_id: Optional[int] = None
+    size: int = 0
+    sha256: str = ""
+    content: Optional[str] = None
+
+@dataclass
+class _Change:
+    index: int
+    op: str
+    row: UserFile
+    name: str
+    parent_id: Optional[int]
+    relative_path: str
+    # Set only for rows stored before the blob store, whose bytes still sit at their path.
+    old_path: Optional[Path] = None
+    new_path: Optional[Path] = None
+
+
+def _valid_name(name: Optional[str]) -> bool:
+    return bool(name) and name not in (".", "..") and "/" not in name and "\\" not in name
+
+def _run_parallel(function, items: list) -> List[Optional[Exception]]:
+    """Apply `function` to every item on the I/O pool; returns the exception (or None) per item."""
+    def guarded(item):
+        try:
+            function(item)
+        except Exception as exc:
+            return exc
+        return None
+
+    if len(items) <= 1 or BATCH_IO_WORKERS <= 1:
+        return [guarded(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(BATCH_IO_WORKERS, len(items))) as pool:
+        return list(pool.map(guarded, items))
+
+def _write_upload(item: _Upload):
+    item.source, item.size, item.sha256 = blob_store.receive(item.upload.file)
+    item.content = search.extract_text(item.source)
+
+def _discard(items: List[_Upload]):
+    for item in items:
+        item.source.unlink(missing_ok=True)
+
+def _rename(change: _Change):
+    change.new_path.parent.mkdir(parents=True, exist_ok=True)
+    change.old_path.rename(change.new_path)
+
+
+def run_batch(db: Session, user: User, uploads: List[UploadFile], folder_id: Optional[int], operations: List[BatchOperation]) -> BatchResult:
+    total = len(uploads) + len(operations)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="The batch is empty")
+    if total > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {BATCH_MAX_ITEMS} items")
+
+    results: List[Optional[BatchItemResult]] = [None] * total
+
+    def fail(index: int, op: str, status: int, detail: str):
+        results[index] = BatchItemResult(index=index, op=op, status=status, detail=detail)
+
+    # One query for every row the batch refers to by id.
+    ids = {operation.id for operation in operations}
+    ids |= {operation.folder for operation in operations if operation.op == "move" and operation.folder}
+    if folder_id:
+        ids.add(folder_id)
+    rows = {row.id: row for row in db.query(UserFile).filter(UserFile.user_id == user.id, UserFile.id.in_(ids))} if ids else {}
+
+    def folder(folder_id: Optional[int]) -> Optional[UserFile]:
+        row = rows.get(folder_id)
+        return row if row is not None and row.is_folder else None
+
+    seen = set()
+    deletes, pending = [], []
+    for position, operation in enumerate(operations):
+        index = len(uploads) + position
+        row = rows.get(operation.id)
+        if operation.id in seen:
+            fail(index, operation.op, 400, "Item appears more than once in the batch")
+        elif row is None:
+            fail(index, operation.op, 404, "File not found")
+        elif operation.op == "delete":
+            deletes.append((index, row.id))
+        elif row.is_folder:
+            fail(index, operation.op, 400, "Folders are renamed and moved with /folders/{id}/move")
+        else:
+            pending.append((index, operation, row))
+        seen.add(operation.id)
+
+    # Everything under a deleted folder goes too; those paths become free for the rest of the batch.
+    deleted = []
+    if deletes:
+        subtree = file_operations.subtree_ids(user, *[row_id for _, row_id in deletes])
+        deleted = db.query(
+            UserFile.id, UserFile.relative_path, UserFile.is_folder, UserFile.thumbnail_key, UserFile.blob_sha, UserFile.size
+        ).filter(UserFile.id.in_(subtree)).all()
+    deleted_ids = {row.id for row in deleted}
+    deleted_folders = {row.relative_path for row in deleted if row.is_folder}
+
+    changes: List[_Change] = []
+    for index, operation, row in pending:
+        if operation.op == "rename":
+            name, parent_id = operation.name, row.parent_id
+            relative_path = str(Path(row.relative_path).with_name(name)) if _valid_name(name) else None
+        else:
+            parent = folder(operation.folder)
+            if operation.folder and parent is None:
+                fail(index, operation.op, 404, "Target folder not found")
+                continue
+            name, parent_id = row.filename, operation.folder
+            relative_path = name if parent is None else str(Path(parent.relative_path) / name)
+        if relative_path is None:
+            fail(index, operation.op, 400, "Invalid file name")
+        elif row.id in deleted_ids or parent_id in deleted_ids:
+            fail(index, operation.op, 409, "Item is deleted by this batch")
+        else:
+            change = _Change(index, operation.op, row, name, parent_id, relative_path)
+            if not row.blob_sha:
+                change.old_path = file_operations.get_absolute_path(user, row.relative_path)
+                change.new_path = file_operations.get_absolute_path(user, relative_path)
+            changes.append(change)
+
+    upload_parent = folder(folder_id)
+    items: List[_Upload] = []
+    for index, upload in enumerate(uploads):
+        if folder_id and upload_parent is None:
+            fail(index, "upload", 404, "Parent folder not found")
+        elif folder_id in deleted_ids:
+            fail(index, "upload", 409, "Parent folder is deleted by this batch")
+        elif not _valid_name(upload.filename):
+            fail(index, "upload", 400, "Invalid file name")
+        else:
+            relative_path = upload.filename if upload_parent is None else str(Path(upload_parent.relative_path) / upload.filename)
+            items.append(_Upload(index, upload, relative_path))
+
+    # Target paths must be free: not taken by a surviving row, and claimed by one item only.
+    targets = {change.relative_path for change in changes} | {item.relative_path for item in items}
+    existing = {}
+    if targets:
+        for row in db.query(UserFile).filter(UserFile.user_id == user.id, UserFile.relative_path.in_(targets)):
+            if row.id not in deleted_ids:
+                existing[row.relative_path] = row
+    claimed = set()
+    accepted_changes, accepted_items = [], []
+    for change in changes:
+        taken = existing.get(change.relative_path)
+        if change.relative_path in claimed or change.relative_path in deleted_folders or (taken is not None and taken.id != change.row.id):
+            fail(change.index, change.op, 400, "An item with this name already exists in the specified location")
+        else:
+            claimed.add(change.relative_path)
+            if taken is None:
+                accepted_changes.append(change)
+            else:
+                results[change.index] = BatchItemResult(index=change.index, op=change.op, status=200, file=file_operations.file_schema(user, change.row))
+    for item in items:
+        item.row = existing.get(item.relative_path)
+        if item.relative_path in claimed:
+            fail(item.index, "upload", 400, "Duplicate name in the batch")
+        elif item.relative_path in deleted_folders or (item.row is not None and item.row.is_folder):
+            fail(item.index, "upload", 400, "A folder with this name already exists in the specified location")
+        else:
+            claimed.add(item.relative_path)
+            accepted_items.append(item)
+
+    # Net growth of the batch, checked against the quota before any bytes are written.
+    freed = sum(row.size or 0 for row in deleted) + sum(item.row.size or 0 for item in accepted_items if item.row)
+    quotas.check(db, user, sum(item.upload.size or 0 for item in accepted_items) - freed)
+
+    # Disk first, so a committed row always has its bytes.
+    for item, error in zip(accepted_items, _run_parallel(_write_upload, accepted_items)):
+        if error is not None:
+            fail(item.index, "upload", 500, "Could not write the file")
+    on_disk = [change for change in accepted_changes if change.old_path is not None]
+    for change, error in zip(on_disk, _run_parallel(_rename, on_disk)):
+        if error is not None:
+            fail(change.index, change.op, 500, "Could not move the file on disk")
+    written = [item for item in accepted_items if results[item.index] is None]
+    moved = [change for change in accepted_changes if results[change.index] is None]
+
+    # Overwritten rows from before the blob store leave their old file and thumbnails behind.
+    reap = []
+    for item in written:
+        if item.row is not None and not item.row.blob_sha:
+            reap.append(file_operations.get_absolute_path(user, item.relative_path))
+            reap.extend(thumbnails.thumbnail_files(user.username, item.row))
+    now = datetime.utcnow()
+    updates = [
+        {"id": change.row.id, "filename": change.name, "parent_id": change.parent_id,
+         "relative_path": change.relative_path, "updated_at": now}
+        for change in moved
+    ]
+    inserts, inserted = [], []
+    for item in written:
+        # A detached draft carries the new values through schedule_thumbnail; rows are written in bulk below.
+        draft = UserFile(
+            id=item.row.id if item.row else None, user_id=user.id, filename=item.upload.filename,
+            relative_path=item.relative_path, is_folder=False, parent_id=folder_id, created_at=now, updated_at=now,
+            size=item.size, sha256=item.sha256, etag=file_operations.make_etag(item.sha256), blob_sha=item.sha256,
+            mime_type=file_operations.guess_mime_type(item.upload.filename, item.upload.content_type),
+            thumbnail_key=item.row.thumbnail_key if item.row else None,
+            thumbnail_status=item.row.thumbnail_status if item.row else None,
+            thumbnail_queued_at=item.row.thumbnail_queued_at if item.row else None,
+        )
+        thumbnails.schedule_thumbnail(user.username, draft, blob_store.blob_path(item.sha256))
+        if item.row is None:
+            inserts.append({column: getattr(draft, column) for column in INSERT_COLUMNS})
+            inserted.append(item)
+        else:
+            updates.append({"id": item.row.id, **{column: getattr(draft, column) for column in OVERWRITE_COLUMNS}})
+
+    grown = sum(item.size for item in written) - sum(item.row.size or 0 for item in written if item.row)
+    grown -= sum(row.size or 0 for row in deleted)
+
+    try:
+        if deleted:
+            search.remove(db, list(deleted_ids))
+            db.query(UserFile).filter(UserFile.id.in_(deleted_ids)).delete(synchronize_session=False)
+            # SQLite may hand a deleted id to a new row; the stale objects must not shadow it.
+            for row_id in deleted_ids & rows.keys():
+                db.expunge(rows[row_id])
+        blob_store.release(db, [row.blob_sha for row in deleted] + [item.row.blob_sha for item in written if item.row])
+        blob_store.acquire(db, [(item.sha256, item.size) for item in written])
+        quotas.charge(db, user, grown, len(inserts) - sum(1 for row in deleted if not row.is_folder))
+        for item in written:
+            blob_store.place(item.source, item.sha256)
+        if updates:
+            db.execute(update(UserFile), updates)
+        if inserts:
+            # A plain executemany; the new ids are read back through the unique (user_id, relative_path) index.
+            db.execute(insert(UserFile.__table__), inserts)
+            new_ids = dict(db.query(UserFile.relative_path, UserFile.id).filter(
+                UserFile.user_id == user.id, UserFile.relative_path.in_([item.relative_path for item in inserted])
+            ))
+            for item in inserted:
+                item.row_id = new_ids[item.relative_path]
+        search.rename(db, [(change.row.id, user.id, change.name, change.relative_path) for change in moved])
+        search.index(db, [
+            (item.row.id if item.row else item.row_id, user.id, item.upload.filename, item.relative_path, item.content)
+            for item in written
+        ])
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        for change in moved:
+            if change.new_path is not None and change.new_path.exists():
+                change.new_path.rename(change.old_path)
+        _discard(written)
+        if isinstance(exc, HTTPException):
+            raise
+        raise HTTPException(status_code=409, detail="The batch conflicted with a concurrent change; nothing was applied")
+
+    _discard(written)
+
+    # Load every written row in one query instead of one refresh per row.
+    for item in written:
+        if item.row is not None:
+            item.row_id = item.row.id
+    touched = [item.row_id for item in written] + [change.row.id for change in moved]
+    loaded = {row.id: row for row in db.query(UserFile).filter(UserFile.id.in_(touched))} if touched else {}
+
+    # A file moved on disk may have taken the path of a deleted one.
+    moved_to = {change.relative_path for change in moved if change.new_path is not None}
+    reap.extend(
+        file_operations.get_absolute_path(user, row.relative_path)
+        for row in deleted if not row.blob_sha and row.relative_path not in moved_to
+    )
+    for row in deleted:
+        reap.extend(thumbnails.thumbnail_files(user.username, row))
+    if reap:
+        reaper.enqueue(*reap)
+
+    for index, row_id in deletes:
+        if row_id in deleted_ids:
+            results[index] = BatchItemResult(index=index, op="delete", status=204)
+    for change in moved:
+        results[change.index] = BatchItemResult(index=change.index, op=change.op, status=200, file=file_operations.file_schema(user, loaded[change.row.id]))
+    for item in written:
+        row = loaded[item.row_id]
+        thumbnails.submit(user.username, row, blob_store.blob_path(item.sha256))
+        results[item.index] = BatchItemResult(index=item.index, op="upload", status=201, file=file_operations.file_schema(user, row))
+
+    return BatchResult(items=results)
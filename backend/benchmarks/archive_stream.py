@@ -0,0 +1,104 @@
+"""
+Streaming `GET /folders/{id}/archive` over a real socket.
+
+    python -m benchmarks.archive_stream --files 100 --size-mb 2
+
+Half the files are random bytes named .mp4 (stored), half are text
+(deflated). Reports throughput and the server process's peak resident
+memory while the archive streams, then opens a second archive, drops the
+connection after the first chunk and checks that the worker stops.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from benchmarks import configure_environment
+from benchmarks.fake_vk import serve_in_thread
+
+
+def resident_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def run(args):
+    configure_environment()
+    import httpx
+    import archive
+    import main
+    from database import run_migrations
+
+    run_migrations()
+    server, url = serve_in_thread(main.app)
+    report = {"files": args.files, "size_mb": args.size_mb}
+    try:
+        with httpx.Client(base_url=url, timeout=None) as client:
+            client.post("/users", data={"username": "bench", "email": "bench@example.com", "password": "bench"})
+            token = client.post("/token", data={"username": "bench", "password": "bench"}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            folder = client.post("/folders", json={"name": "class"}, headers=headers).json()["id"]
+
+            size = args.size_mb * 1024 * 1024
+            line = b"Lesson notes: read the chapter and answer the questions.\n"
+            text = (line * (size // len(line) + 1))[:size]
+            for start in range(0, args.files, 20):
+                files = [
+                    ("files", (f"clip_{i}.mp4", os.urandom(size)) if i % 2 else (f"notes_{i}.txt", text))
+                    for i in range(start, min(start + 20, args.files))
+                ]
+                client.post("/files/batch", files=files, data={"folder": str(folder)}, headers=headers).raise_for_status()
+            report["folder_bytes"] = size * args.files
+
+            baseline = peak = resident_bytes()
+            sampling = True
+
+            def sample():
+                nonlocal peak
+                while sampling:
+                    peak = max(peak, resident_bytes())
+                    time.sleep(0.005)
+
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            received = 0
+            started = time.perf_counter()
+            with client.stream("GET", f"/folders/{folder}/archive", headers=headers) as response:
+                response.raise_for_status()
+                for chunk in response.iter_raw():
+                    received += len(chunk)
+            elapsed = time.perf_counter() - started
+            sampling = False
+            sampler.join()
+            report["archive_bytes"] = received
+            report["seconds"] = round(elapsed, 3)
+            report["mb_per_second"] = round(received / elapsed / 1024 / 1024, 1)
+            report["peak_rss_growth_mb"] = round((peak - baseline) / 1024 / 1024, 1)
+
+        # A fresh connection: one opened before the thumbnail pool forked is inherited by its
+        # workers, and closing it here would then never reach the server.
+        with httpx.Client(base_url=url, timeout=None) as client:
+            with client.stream("GET", f"/folders/{folder}/archive", headers=headers) as response:
+                next(response.iter_raw())
+                report["workers_while_streaming"] = archive._active
+        deadline = time.monotonic() + 10
+        while archive._active and time.monotonic() < deadline:
+            time.sleep(0.05)
+        report["workers_after_disconnect"] = archive._active
+    finally:
+        server.should_exit = True
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size-mb", type=int, default=2)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
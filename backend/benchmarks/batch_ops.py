@@ -0,0 +1,76 @@
+"""
+Uploading and deleting many files one request at a time vs through `POST /files/batch`.
+
+    python -m benchmarks.batch_ops --files 300 --size-kb 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks import configure_environment
+
+
+async def run(args):
+    configure_environment()
+    import httpx
+    from anyio import to_thread
+    import main
+    from config import THREAD_POOL_SIZE
+    from database import run_migrations
+
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    run_migrations()
+    payload = os.urandom(args.size_kb * 1024)
+    report = {"files": args.files, "size_kb": args.size_kb}
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=None) as client:
+        await client.post("/users", data={"username": "bench", "email": "bench@example.com", "password": "bench"})
+        token = (await client.post("/token", data={"username": "bench", "password": "bench"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        started = time.perf_counter()
+        ids = []
+        for i in range(args.files):
+            response = await client.post("/files", files={"file": (f"single_{i}.bin", payload)}, headers=headers)
+            ids.append(response.json()["id"])
+        report["single_upload_s"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        for file_id in ids:
+            await client.delete(f"/files/{file_id}", headers=headers)
+        report["single_delete_s"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        response = await client.post(
+            "/files/batch", headers=headers,
+            files=[("files", (f"batch_{i}.bin", payload)) for i in range(args.files)],
+        )
+        ids = [item["file"]["id"] for item in response.json()["items"]]
+        report["batch_upload_s"] = round(time.perf_counter() - started, 3)
+        report["batch_upload_timing"] = response.headers.get("server-timing")
+
+        started = time.perf_counter()
+        response = await client.post(
+            "/files/batch", headers=headers,
+            data={"operations": json.dumps([{"op": "delete", "id": file_id} for file_id in ids])},
+        )
+        report["batch_delete_s"] = round(time.perf_counter() - started, 3)
+        report["batch_delete_timing"] = response.headers.get("server-timing")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--size-kb", type=int, default=16)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
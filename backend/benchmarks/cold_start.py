@@ -0,0 +1,151 @@
+"""
+Cold start: time from launching the server to its first responses.
+
+    python -m benchmarks.cold_start --runs 5 --workers 4
+
+For each launch mode the server is started against an already migrated
+scratch database and polled until `GET /hello` answers, then one
+authenticated, database-backed request (`GET /files`) is timed. Modes:
+
+  uvicorn             `uvicorn main:app`, one process
+  uvicorn-no-migrate  the same with MIGRATE_ON_STARTUP=false
+  serve               `python serve.py --workers N`, the pre-forking launcher
+  respawn             serve.py with one worker, which is killed once it is
+                      up: the time until its replacement has answered
+
+`import_main_ms` is the time a fresh interpreter spends on `import main`.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from benchmarks import configure_environment, percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+POLL_INTERVAL = 0.005
+START_TIMEOUT = 60
+RESPAWN_AFTER = 1.5
+MODES = ["uvicorn", "uvicorn-no-migrate", "serve", "respawn"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str, headers: dict = None) -> int:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=5) as response:
+            return response.status
+    except OSError:
+        return 0
+
+
+def wait_until_up(server, port: int, started: float):
+    while get(f"http://127.0.0.1:{port}/hello") != 200:
+        if server.poll() is not None or time.perf_counter() - started > START_TIMEOUT:
+            raise RuntimeError(f"{server.args} did not start")
+        time.sleep(POLL_INTERVAL)
+
+
+def launch(command: list, port: int, headers: dict, env: dict = None, respawn: bool = False) -> dict:
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(server, port, started)
+        if respawn:
+            # Past serve.py's respawn backoff, then replace the only worker.
+            time.sleep(RESPAWN_AFTER)
+            children = Path(f"/proc/{server.pid}/task/{server.pid}/children")
+            worker = children.read_text().split()[0]
+            os.kill(int(worker), signal.SIGKILL)
+            started = time.perf_counter()
+            # The parent keeps the socket listening, so requests made now would
+            # simply wait in its backlog for the replacement: wait for that first.
+            while children.read_text().split() in ([], [worker]):
+                time.sleep(POLL_INTERVAL)
+            wait_until_up(server, port, started)
+        first_response = time.perf_counter() - started
+        request_started = time.perf_counter()
+        status = get(f"http://127.0.0.1:{port}/files", headers)
+        return {
+            "first_response_ms": first_response * 1000,
+            "first_db_request_ms": (time.perf_counter() - request_started) * 1000,
+            "status": status,
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def import_time() -> float:
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def summary(samples: list) -> dict:
+    return {
+        "p50": round(percentile(samples, 0.5), 1),
+        "min": round(min(samples), 1),
+        "max": round(max(samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    configure_environment()
+    from auth import create_access_token
+    from benchmarks.seed import seed
+    from database import run_migrations
+
+    run_migrations()
+    account = seed(users=1, depth=1, fanout=2, tokens_per_user=0)["users"][0]
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': account['username'], 'role': 'user'})}"}
+
+    results = {}
+    for mode in args.modes:
+        runs = []
+        for _ in range(args.runs):
+            port = free_port()
+            env = dict(os.environ)
+            if mode.startswith("uvicorn"):
+                command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)]
+                env["MIGRATE_ON_STARTUP"] = "false" if mode == "uvicorn-no-migrate" else "true"
+            else:
+                workers = 1 if mode == "respawn" else args.workers
+                command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+            runs.append(launch(command, port, headers, env, respawn=mode == "respawn"))
+        results[mode] = {
+            "first_response_ms": summary([run["first_response_ms"] for run in runs]),
+            "first_db_request_ms": summary([run["first_db_request_ms"] for run in runs]),
+            "statuses": sorted({run["status"] for run in runs}),
+        }
+        if mode == "serve":
+            results[mode]["workers"] = args.workers
+
+    print(json.dumps({
+        "benchmark": "cold_start",
+        "runs": args.runs,
+        "cpu_count": os.cpu_count(),
+        "import_main_ms": summary([import_time() for _ in range(args.runs)]),
+        "modes": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
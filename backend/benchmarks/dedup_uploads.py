@@ -0,0 +1,87 @@
+"""
+A class uploading the same starter files: bytes and thumbnails kept vs uploaded.
+
+    python -m benchmarks.dedup_uploads --students 30 --files 5 --size-kb 256
+
+Every student uploads the same `--files` images and text files. Reports
+the bytes uploaded, the bytes in the blob store and the thumbnail files
+rendered once the pipeline settles.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from pathlib import Path
+
+from benchmarks import configure_environment
+
+
+def starter_files(count: int, size_kb: int) -> list:
+    from PIL import Image
+
+    files = []
+    for i in range(count):
+        if i % 2:
+            buffer = io.BytesIO()
+            Image.frombytes("RGB", (256, 256), os.urandom(256 * 256 * 3)).save(buffer, "PNG")
+            files.append((f"starter_{i}.png", buffer.getvalue()))
+        else:
+            files.append((f"starter_{i}.txt", os.urandom(size_kb * 512).hex().encode()))
+    return files
+
+
+async def run(args):
+    configure_environment()
+    import httpx
+    import main
+    import thumbnails
+    from config import BLOB_DIR, THUMBNAIL_DIR
+    from database import run_migrations
+
+    run_migrations()
+    thumbnails.start_pipeline()
+    files = starter_files(args.files, args.size_kb)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=None) as client:
+        upload_seconds = 0.0
+        for student in range(args.students):
+            name = f"student{student}"
+            await client.post("/users", data={"username": name, "email": f"{name}@example.com", "password": "bench"})
+            token = (await client.post("/token", data={"username": name, "password": "bench"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            started = time.perf_counter()
+            for filename, content in files:
+                (await client.post("/files", files={"file": (filename, content)}, headers=headers)).raise_for_status()
+            upload_seconds += time.perf_counter() - started
+    thumbnails.stop_pipeline()
+
+    def disk_bytes(directory: str, pattern: str = "*") -> list:
+        return [path.stat().st_size for path in Path(directory).rglob(pattern) if path.is_file()]
+
+    stored = disk_bytes(BLOB_DIR)
+    return {
+        "students": args.students,
+        "uploads": args.students * len(files),
+        "uploaded_bytes": args.students * sum(len(content) for _, content in files),
+        "stored_blobs": len(stored),
+        "stored_bytes": sum(stored),
+        "thumbnail_files": len(disk_bytes(THUMBNAIL_DIR, "*.webp")),
+        "upload_seconds": round(upload_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--size-kb", type=int, default=256)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the VK OAuth and API endpoints used by vk_auth.
+
+    python -m benchmarks.fake_vk --port 9000 --latency-ms 50 --handshake-ms 60 --failure-rate 0.1
+
+Point the backend at it with VK_OAUTH_URL=http://127.0.0.1:9000 and
+VK_API_URL=http://127.0.0.1:9000. Codes starting with "bad" are rejected
+the way VK rejects a spent code. `/stats` reports request and connection
+counts, which shows whether the backend reuses its connections; the
+first request on every new connection is delayed by `--handshake-ms` to
+stand in for the TCP and TLS setup a real VK connection costs.
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, RedirectResponse
+from starlette.routing import Route
+
+
+def create_app(latency: float = 0.0, failure_rate: float = 0.0, users: int = 100, handshake: float = 0.0) -> Starlette:
+    stats = {"requests": 0, "failures": 0, "connections": set()}
+
+    async def simulate(request: Request):
+        stats["requests"] += 1
+        client = tuple(request.scope.get("client") or ())
+        delay = latency
+        if client not in stats["connections"]:
+            stats["connections"].add(client)
+            delay += handshake
+        if delay:
+            await asyncio.sleep(delay)
+        if failure_rate and random.random() < failure_rate:
+            stats["failures"] += 1
+            return JSONResponse({"error": "temporarily_unavailable"}, status_code=503)
+        return None
+
+    def user_id(code: str) -> int:
+        return 1 + zlib.crc32(code.encode()) % users
+
+    async def authorize(request: Request):
+        query = urlencode({"code": f"code-{random.randrange(1 << 30)}"})
+        return RedirectResponse(f"{request.query_params.get('redirect_uri', '/')}?{query}")
+
+    async def access_token(request: Request):
+        failure = await simulate(request)
+        if failure:
+            return failure
+        code = request.query_params.get("code", "")
+        if not code or code.startswith("bad"):
+            return JSONResponse({"error": "invalid_grant", "error_description": "Code is invalid or expired."}, status_code=401)
+        uid = user_id(code)
+        return JSONResponse({"access_token": f"token-{uid}", "expires_in": 86400, "user_id": uid, "email": f"vk{uid}@example.com"})
+
+    async def users_get(request: Request):
+        failure = await simulate(request)
+        if failure:
+            return failure
+        token = request.query_params.get("access_token", "")
+        if not token.startswith("token-"):
+            return JSONResponse({"error": {"error_code": 5, "error_msg": "User authorization failed"}})
+        uid = int(token.split("-", 1)[1])
+        return JSONResponse({"response": [{"id": uid, "first_name": "Test", "last_name": f"User{uid}"}]})
+
+    async def read_stats(request: Request):
+        return JSONResponse({"requests": stats["requests"], "failures": stats["failures"], "connections": len(stats["connections"])})
+
+    app = Starlette(routes=[
+        Route("/authorize", authorize),
+        Route("/access_token", access_token),
+        Route("/method/users.get", users_get),
+        Route("/stats", read_stats),
+    ])
+    app.state.stats = stats
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app: Starlette, port: int = 0):
+    """Run `app` under uvicorn on a daemon thread; returns (server, base_url). Stop with `server.should_exit = True`."""
+    import uvicorn
+
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--handshake-ms", type=float, default=0.0, help="extra delay on a connection's first request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--users", type=int, default=100, help="distinct VK user ids handed out")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.latency_ms / 1000, args.failure_rate, args.users, args.handshake_ms / 1000), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Latency of `GET /files` while uploads and logins run concurrently.
+
+    python -m benchmarks.listing_latency --duration 10 --uploaders 4 --logins 4
+
+All traffic goes through one in-process event loop (httpx ASGI transport),
+so any endpoint that blocks the loop shows up directly in the listing p99.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import time
+
+from benchmarks import configure_environment, percentile
+
+
+def make_image(size) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 64).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def run(args):
+    configure_environment()
+    import httpx
+    from anyio import to_thread
+    import main
+    import thumbnails
+    from config import THREAD_POOL_SIZE
+    from database import create_tables
+
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    create_tables()
+    thumbnails.start_pipeline()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        await client.post("/users", data={"username": "bench", "email": "bench@example.com", "password": "bench"})
+        token = (await client.post("/token", data={"username": "bench", "password": "bench"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        small = make_image((64, 64))
+        for i in range(args.files):
+            await client.post("/files", files={"file": (f"seed_{i}.png", small)}, headers=headers)
+        large = make_image((args.image_size, args.image_size))
+
+        deadline = time.perf_counter() + args.duration
+        latencies = []
+        counters = {"uploads": 0, "logins": 0}
+
+        async def lister():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/files", headers=headers)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+                await asyncio.sleep(0.01)
+
+        async def uploader(worker):
+            n = 0
+            while time.perf_counter() < deadline:
+                await client.post("/files", files={"file": (f"upload_{worker}_{n % 5}.png", large)}, headers=headers)
+                counters["uploads"] += 1
+                n += 1
+
+        async def login():
+            while time.perf_counter() < deadline:
+                await client.post("/token", data={"username": "bench", "password": "bench"})
+                counters["logins"] += 1
+
+        await asyncio.gather(
+            lister(),
+            *(uploader(i) for i in range(args.uploaders)),
+            *(login() for _ in range(args.logins)),
+        )
+
+    thumbnails.stop_pipeline()
+    return {
+        "benchmark": "listing_latency",
+        "duration_s": args.duration,
+        "listings": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        **counters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--files", type=int, default=50, help="files in the listed folder")
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--logins", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=1500)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+
+if __name__ == "__main__":
+    main()
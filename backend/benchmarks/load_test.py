@@ -0,0 +1,323 @@
+"""
+Scripted load scenarios against the whole app, reported as JSON.
+
+    python -m benchmarks.load_test --users 40 --concurrency 16
+    python -m benchmarks.load_test --target uvicorn --output run.json --compare baseline.json
+
+Data comes from benchmarks.seed, in a scratch directory with SQLite unless
+DATABASE_URL points elsewhere via --database-url. Scenarios, run in order:
+
+  login_storm    every student signs in at once, as at the start of a class:
+                 half with their password, half by rotating a saved refresh
+                 token, then each loads the root of the file manager
+  browse         clients walk from the root down to a leaf folder, listing
+                 folders and files on the way, then read or download a file
+                 and run a search
+  bulk_upload    each client creates a folder and uploads a mix of images
+                 and text files into it
+  folder_delete  each student deletes their top-level folders, whole trees
+
+`--target asgi` (the default) drives the app in this process through httpx's
+ASGI transport, lifespan included: no network, but client and server share
+one event loop. `--target uvicorn` starts `uvicorn main:app` on a free local
+port against the same data. Every scenario reports throughput and
+p50/p95/p99 latency overall and per request type; `--compare` adds the
+change against an earlier report.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks import configure_environment, percentile
+from benchmarks.seed import WORDS, add_arguments, make_image, make_text, seed_from_args
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ["login_storm", "browse", "bulk_upload", "folder_delete"]
+REQUEST_TIMEOUT = 120
+
+
+class Recorder:
+    """Times every request of one scenario, by request type."""
+
+    def __init__(self, client):
+        self.client = client
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = Counter()
+
+    async def request(self, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.samples[name].append(time.perf_counter() - started)
+        self.statuses[response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    def report(self, seconds: float) -> dict:
+        everything = [sample for samples in self.samples.values() for sample in samples]
+        return {
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "duration_s": round(seconds, 3),
+            "throughput_rps": round(len(everything) / seconds, 2) if seconds else 0.0,
+            **latency(everything),
+            "by_request": {
+                name: {"requests": len(samples), "errors": self.errors[name], **latency(samples)}
+                for name, samples in sorted(self.samples.items())
+            },
+        }
+
+
+def latency(samples: list) -> dict:
+    return {f"p{int(p * 100)}_ms": round(percentile(samples, p) * 1000, 2) for p in (0.5, 0.95, 0.99)}
+
+
+class Context:
+    def __init__(self, args, accounts: list):
+        from auth import create_access_token
+
+        self.args = args
+        self.accounts = accounts
+        # Scenarios other than the login storm skip bcrypt: their tokens are minted here.
+        self.headers = {
+            account["username"]: {"Authorization": f"Bearer {create_access_token({'sub': account['username'], 'role': 'user'})}"}
+            for account in accounts
+        }
+
+    def rng(self, scenario: str, worker: int) -> random.Random:
+        return random.Random(f"{self.args.seed}-{scenario}-{worker}")
+
+    def account(self, worker: int) -> dict:
+        return self.accounts[worker % len(self.accounts)]
+
+
+async def workers(count: int, job):
+    await asyncio.gather(*(job(worker) for worker in range(count)))
+
+
+async def login_storm(recorder: Recorder, context: Context):
+    async def student(worker):
+        account = context.accounts[worker]
+        for _ in range(context.args.rounds):
+            if worker % 2 == 0:
+                response = await recorder.request("POST /token", "POST", "/token", data={
+                    "username": account["username"], "password": account["password"],
+                })
+            else:
+                refresh_token = account["refresh_tokens"][0]
+                response = await recorder.request("POST /refresh", "POST", "/refresh", headers={"Authorization": f"Bearer {refresh_token}"})
+            if response.status_code != 200:
+                continue
+            tokens = response.json()
+            if worker % 2:
+                account["refresh_tokens"][0] = tokens["refresh_token"]
+            headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+            await recorder.request("GET /users/me", "GET", "/users/me", headers=headers)
+            await recorder.request("GET /folders", "GET", "/folders", headers=headers)
+            await recorder.request("GET /files", "GET", "/files", headers=headers)
+
+    await workers(len(context.accounts), student)
+
+
+async def browse(recorder: Recorder, context: Context):
+    async def client(worker):
+        rng = context.rng("browse", worker)
+        headers = context.headers[context.account(worker)["username"]]
+        for _ in range(context.args.iterations):
+            parent = None
+            while True:
+                params = {} if parent is None else {"parent": parent}
+                folders = (await recorder.request("GET /folders", "GET", "/folders", params=params, headers=headers)).json()
+                params = {} if parent is None else {"folder": parent}
+                files = (await recorder.request("GET /files", "GET", "/files", params=params, headers=headers)).json()
+                if not folders:
+                    break
+                parent = rng.choice(folders)["id"]
+            if files:
+                file = rng.choice(files)
+                if (file["mime_type"] or "").startswith("text/"):
+                    await recorder.request("GET /files/{id}/read", "GET", f"/files/{file['id']}/read", headers=headers)
+                else:
+                    await recorder.request("GET /files/{id}/download", "GET", f"/files/{file['id']}/download", headers=headers)
+            await recorder.request("GET /search", "GET", "/search", params={"q": rng.choice(WORDS)[:4]}, headers=headers)
+
+    await workers(context.args.concurrency, client)
+
+
+async def bulk_upload(recorder: Recorder, context: Context):
+    async def client(worker):
+        rng = context.rng("bulk_upload", worker)
+        headers = context.headers[context.account(worker)["username"]]
+        response = await recorder.request("POST /folders", "POST", "/folders", json={"name": f"upload_{worker}"}, headers=headers)
+        folder = response.json()["id"] if response.status_code == 201 else None
+        for n in range(context.args.uploads):
+            if rng.random() < context.args.image_ratio:
+                name, content = f"photo_{n}.png", make_image(rng, (320, 240))
+            else:
+                name, content = f"notes_{n}.txt", make_text(rng, rng.randint(200, 5000))
+            await recorder.request("POST /files", "POST", "/files", files={"file": (name, content)},
+                                   data={} if folder is None else {"folder": str(folder)}, headers=headers)
+
+    await workers(context.args.concurrency, client)
+
+
+async def folder_delete(recorder: Recorder, context: Context):
+    queue = list(context.accounts)
+
+    async def client(worker):
+        while queue:
+            headers = context.headers[queue.pop()["username"]]
+            folders = (await recorder.request("GET /folders", "GET", "/folders", headers=headers)).json()
+            for folder in folders:
+                await recorder.request("DELETE /folders/{id}", "DELETE", f"/folders/{folder['id']}", headers=headers)
+
+    await workers(context.args.concurrency, client)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def asgi_client():
+    import httpx
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=REQUEST_TIMEOUT) as client:
+            yield client
+
+
+@contextlib.asynccontextmanager
+async def uvicorn_client():
+    import httpx
+
+    port = free_port()
+    # The configuration from configure_environment() is inherited through os.environ.
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=REQUEST_TIMEOUT) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    (await client.get("/hello")).raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("uvicorn did not start")
+                    await asyncio.sleep(0.1)
+            yield client
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Percent change of throughput and latency per scenario; negative latency change is faster."""
+    changes = {}
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            f"{key}_change_pct": round((result[key] - before[key]) / before[key] * 100, 1)
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+            if before.get(key)
+        }
+    return changes
+
+
+async def run(args) -> dict:
+    configure_environment(args.workdir)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    from database import engine, run_migrations
+
+    run_migrations()
+    dataset = seed_from_args(args)
+    context = Context(args, dataset["users"])
+    scenarios = {}
+    client_factory = uvicorn_client if args.target == "uvicorn" else asgi_client
+    async with client_factory() as client:
+        for name in args.scenarios:
+            recorder = Recorder(client)
+            started = time.perf_counter()
+            await globals()[name](recorder, context)
+            scenarios[name] = recorder.report(time.perf_counter() - started)
+
+    return {
+        "benchmark": "load_test",
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "revision": git_revision(),
+        "target": args.target,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": engine.dialect.name,
+        },
+        "parameters": {
+            key: getattr(args, key)
+            for key in ("users", "depth", "fanout", "files_per_folder", "image_ratio", "tokens_per_user",
+                        "seed", "concurrency", "rounds", "iterations", "uploads")
+        },
+        "dataset": {key: value for key, value in dataset.items() if key != "users"},
+        "scenarios": scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients in browse, bulk_upload and folder_delete")
+    parser.add_argument("--rounds", type=int, default=2, help="sign-ins per student in login_storm")
+    parser.add_argument("--iterations", type=int, default=10, help="walks per client in browse")
+    parser.add_argument("--uploads", type=int, default=10, help="files per client in bulk_upload")
+    parser.add_argument("--workdir", help="directory for the database and files (default: a new scratch directory)")
+    parser.add_argument("--database-url", help="use this database instead of SQLite in the workdir")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="an earlier report to compare against")
+    add_arguments(parser)
+    parser.set_defaults(users=40)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.compare:
+        report["compared_to"] = args.compare
+        report["changes"] = compare(report, json.loads(Path(args.compare).read_text()))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Password verifications (logins) per second, per core, through the bcrypt pool.
+
+    python -m benchmarks.login_throughput --duration 5 --workers 1 2 4
+
+`--workers 0` measures verification inline on the calling threads.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from benchmarks import configure_environment
+
+
+def measure(workers: int, clients: int, duration: float, hashed: str) -> dict:
+    import password_utils
+
+    password_utils.start_pool(workers)
+    password_utils.verify_password("warm-up", hashed)
+    completed = [0] * clients
+    rejected = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        from fastapi import HTTPException
+        while time.perf_counter() < deadline:
+            try:
+                password_utils.verify_password("benchmark-password", hashed)
+                completed[index] += 1
+            except HTTPException:
+                # Admission control said 503; back off like a client honouring Retry-After.
+                rejected[index] += 1
+                time.sleep(0.05)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    password_utils.stop_pool()
+
+    cores = min(max(workers, 1), os.cpu_count() or 1)
+    logins_per_second = sum(completed) / elapsed
+    return {
+        "workers": workers,
+        "clients": clients,
+        "logins_per_s": round(logins_per_second, 2),
+        "logins_per_s_per_core": round(logins_per_second / cores, 2),
+        "rejected": sum(rejected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent request threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    configure_environment()
+    import password_utils
+    from config import BCRYPT_ROUNDS
+
+    hashed = password_utils.get_password_hash("benchmark-password")
+    results = [measure(workers, args.clients, args.duration, hashed) for workers in args.workers]
+    print(json.dumps({
+        "benchmark": "login_throughput",
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
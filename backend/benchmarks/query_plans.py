@@ -0,0 +1,185 @@
+"""
+Query-plan regression check for the `user_files` and `users` access patterns.
+
+    python -m benchmarks.query_plans --rows 1000000
+
+Seeds a scratch database, runs the real file_operations functions against
+it and records every statement they issue. Each statement is then run
+through `EXPLAIN QUERY PLAN` (SQLite) or `EXPLAIN` (PostgreSQL, when
+DATABASE_URL points at one) and the script exits non-zero if any of them
+reads `user_files` or `users` with a full table scan.
+"""
+
+import argparse
+import hashlib
+import io
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import configure_environment
+
+FULL_SCAN = re.compile(r"\bSCAN user_files(_\d+)?\b|\bSCAN users\b(?! USING)|Seq Scan on (user_files|users)\b")
+BATCH_SIZE = 10_000
+
+
+def seed(engine, rows: int, users: int, folders: int):
+    """Bulk-insert `rows` user_files rows spread over `users` users, bypassing the ORM."""
+    from models import Blob, User, UserFile
+
+    now = datetime.utcnow()
+    per_user = max(1, rows // users)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"id": u, "username": f"user{u}", "email": f"user{u}@example.com", "hashed_password": "-", "role": "user", "disabled": False}
+            for u in range(1, users + 1)
+        ])
+        # Every user holds the same contents, as when a class uploads the same starter files.
+        connection.execute(Blob.__table__.insert(), [
+            {"sha256": hashlib.sha256(str(i).encode()).hexdigest(), "size": i, "refcount": users, "created_at": now}
+            for i in range(max(0, per_user - folders))
+        ])
+        next_id = 1
+        batch = []
+        for u in range(1, users + 1):
+            folder_ids = list(range(next_id, next_id + folders))
+            for i, folder_id in enumerate(folder_ids):
+                batch.append({
+                    "id": folder_id, "user_id": u, "filename": f"folder{i}", "relative_path": f"folder{i}",
+                    "is_folder": True, "parent_id": None, "created_at": now, "updated_at": now,
+                    # executemany takes its columns from the first row, so file-only columns are spelled out.
+                    "size": None, "mime_type": None, "sha256": None, "blob_sha": None,
+                })
+            next_id += folders
+            for i in range(per_user - folders):
+                folder = i % folders
+                created = now - timedelta(seconds=i)
+                sha256 = hashlib.sha256(str(i).encode()).hexdigest()
+                batch.append({
+                    "id": next_id, "user_id": u, "filename": f"file{i}.txt", "relative_path": f"folder{folder}/file{i}.txt",
+                    "is_folder": False, "parent_id": folder_ids[folder], "created_at": created, "updated_at": created,
+                    "size": i, "mime_type": "text/plain", "sha256": sha256, "blob_sha": sha256,
+                })
+                next_id += 1
+                if len(batch) >= BATCH_SIZE:
+                    connection.execute(UserFile.__table__.insert(), batch)
+                    batch = []
+        if batch:
+            connection.execute(UserFile.__table__.insert(), batch)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+
+def exercise(user, folder_id: int):
+    """Call every file_operations entry point that touches user_files; statements are captured by the caller."""
+    from fastapi import HTTPException
+    import blob_store
+    import file_operations
+    import quotas
+    from database import SessionLocal
+    from schemas import FolderTarget, ListQuery
+
+    listings = [
+        ListQuery(limit=50),
+        ListQuery(limit=50, sort="created", order="desc"),
+        ListQuery(limit=50, prefix="file1"),
+        ListQuery(limit=50, type="text/"),
+    ]
+    db = SessionLocal()
+    try:
+        for params in listings:
+            _, next_cursor = file_operations.file_listing(db, user, folder_id, params)
+            if next_cursor:
+                file_operations.file_listing(db, user, folder_id, params.model_copy(update={"cursor": next_cursor}))
+        file_operations.folder_listing(db, user, None, ListQuery(limit=50))
+        file_operations.get_folder_size(db, user, folder_id)
+
+        folder = file_operations.create_folder(db, user, "plans")
+        relative_path = file_operations.upload_target(db, user, "plans.txt", folder.id)
+        source, size, sha256 = blob_store.receive(io.BytesIO(b"plans"))
+        uploaded = file_operations.store_file(db, user, "plans.txt", folder.id, relative_path, source, size, sha256, "text/plain")
+        file_operations.store_file(db, user, "plans.txt", folder.id, relative_path, source, size, sha256, "text/plain")
+        source.unlink()
+        file_operations.download_file(db, user, uploaded.id)
+        file_operations.move_folder(db, user, folder.id, FolderTarget(parent=folder_id, name="plans-moved"))
+        file_operations.copy_folder(db, user, folder.id, FolderTarget(name="plans-copy"))
+        file_operations.delete_file(db, user, uploaded.id)
+        file_operations.delete_folder(db, user, folder.id)
+        blob_store.collect(db)
+        quotas.get_usage(db, user)
+        page = quotas.top_consumers(db, 3)
+        quotas.top_consumers(db, 3, page.next_cursor)
+        quotas.reconcile(db, 0, 5)
+        try:
+            file_operations.download_file(db, user, -1)
+        except HTTPException:
+            pass
+    finally:
+        db.close()
+
+
+def explain(engine, statement: str, parameters) -> list:
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        connection.close()
+    return [str(row[-1]) if engine.dialect.name == "sqlite" else str(row[0]) for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--folders", type=int, default=100, help="top-level folders per user")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not just failures")
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    from sqlalchemy import event
+    from database import engine, run_migrations
+    from user_cache import CachedUser
+
+    run_migrations()
+    started = time.perf_counter()
+    seed(engine, args.rows, args.users, args.folders)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if re.search(r"\b(users|user_files)\b", statement) and not executemany:
+            captured.append((statement, parameters))
+
+    user = CachedUser(id=1, username="user1", email="user1@example.com", role="user", disabled=False, vk_id=None)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        exercise(user, folder_id=1)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    seen = set()
+    failures = 0
+    for statement, parameters in captured:
+        if statement in seen:
+            continue
+        seen.add(statement)
+        plan = explain(engine, statement, parameters)
+        scans = [line for line in plan if FULL_SCAN.search(line)]
+        if scans:
+            failures += 1
+        if scans or args.verbose:
+            print(("FULL SCAN" if scans else "ok") + ": " + " ".join(statement.split()))
+            for line in plan:
+                print(f"    {line}")
+
+    print(f"{len(seen)} distinct statements, {failures} with a full scan of user_files or users")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
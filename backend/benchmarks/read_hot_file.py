@@ -0,0 +1,77 @@
+"""
+Throughput of `GET /files/{id}/read` when a whole class opens the same file.
+
+    python -m benchmarks.read_hot_file --readers 30 --requests 20 --size-kb 200
+    TEXT_CACHE_MAX_FILE_BYTES=0 python -m benchmarks.read_hot_file   # no content cache
+
+Every reader asks for the same file with `Accept-Encoding: gzip`, like a
+browser would.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks import configure_environment, percentile
+
+
+async def run(args):
+    configure_environment()
+    import httpx
+    from anyio import to_thread
+    import main
+    import text_reader
+    from config import THREAD_POOL_SIZE
+    from database import run_migrations
+
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    run_migrations()
+
+    line = "Задание: прочитайте главу и ответьте на вопросы. Task: read the chapter and answer.\n"
+    content = (line * (args.size_kb * 1024 // len(line.encode()) + 1)).encode()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        await client.post("/users", data={"username": "bench", "email": "bench@example.com", "password": "bench"})
+        token = (await client.post("/token", data={"username": "bench", "password": "bench"})).json()["access_token"]
+        uploaded = await client.post("/files", files={"file": ("task.txt", content)}, headers={"Authorization": f"Bearer {token}"})
+        url = f"/files/{uploaded.json()['id']}/read"
+
+        latencies = []
+        wire_bytes = []
+
+        async def reader():
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = await client.get(url, headers={"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+                wire_bytes.append(int(response.headers["content-length"]))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(reader() for _ in range(args.readers)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "file_bytes": len(content),
+        "response_bytes": wire_bytes[0],
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "cache": text_reader.content_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=20, help="requests per reader")
+    parser.add_argument("--size-kb", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
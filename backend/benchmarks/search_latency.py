@@ -0,0 +1,115 @@
+"""
+`GET /search` latency over a large index.
+
+    python -m benchmarks.search_latency --rows 1000000 --users 1000
+
+Seeds `--rows` files spread over `--users` users, indexes their names,
+paths and (for a third of them) a few dozen words of content, then times
+prefix and multi-word queries for one user, first page and next page.
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from benchmarks import configure_environment, percentile
+
+WORDS = [
+    "lesson", "notes", "homework", "physics", "algebra", "essay", "draft", "final", "report",
+    "chapter", "lab", "quiz", "geometry", "history", "project", "summary", "exam", "answers",
+]
+QUERIES = ["lesson", "ph", "alg not", "chapter 1", "final report", "ess", "quiz answers", "lab"]
+BATCH_SIZE = 20_000
+
+
+def seed(engine, rows: int, users: int):
+    import search
+    from models import User, UserFile
+    from sqlalchemy.orm import Session
+
+    now = datetime.utcnow()
+    rng = random.Random(1)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"id": u, "username": f"user{u}", "email": f"user{u}@example.com", "hashed_password": "-", "role": "user", "disabled": False}
+            for u in range(1, users + 1)
+        ])
+    files, entries = [], []
+    with Session(engine) as db:
+        for file_id in range(1, rows + 1):
+            user_id = file_id % users + 1
+            name = f"{rng.choice(WORDS)}_{file_id}.txt"
+            relative_path = f"{rng.choice(WORDS)}/{name}"
+            content = " ".join(rng.choices(WORDS, k=40)) if file_id % 3 == 0 else None
+            files.append({
+                "id": file_id, "user_id": user_id, "filename": name, "relative_path": relative_path,
+                "is_folder": False, "size": 100, "mime_type": "text/plain", "created_at": now, "updated_at": now,
+            })
+            entries.append((file_id, user_id, name, relative_path, content))
+            if len(files) >= BATCH_SIZE:
+                db.execute(UserFile.__table__.insert(), files)
+                search.index(db, entries)
+                db.commit()
+                files, entries = [], []
+        if files:
+            db.execute(UserFile.__table__.insert(), files)
+            search.index(db, entries)
+            db.commit()
+
+
+def run(args):
+    configure_environment()
+    import search
+    from database import SessionLocal, engine, run_migrations
+    from user_cache import CachedUser
+
+    run_migrations()
+    started = time.perf_counter()
+    seed(engine, args.rows, args.users)
+    seed_seconds = time.perf_counter() - started
+
+    user = CachedUser(id=1, username="user1", email="user1@example.com", role="user", disabled=False, vk_id=None)
+    first, next_page, hits = [], [], 0
+    db = SessionLocal()
+    try:
+        for _ in range(args.rounds):
+            for q in QUERIES:
+                started = time.perf_counter()
+                page = search.search(db, user, q, 20)
+                first.append(time.perf_counter() - started)
+                hits += len(page.items)
+                if page.next_cursor:
+                    started = time.perf_counter()
+                    search.search(db, user, q, 20, page.next_cursor)
+                    next_page.append(time.perf_counter() - started)
+    finally:
+        db.close()
+
+    def summary(samples):
+        return {f"p{int(p * 100)}_ms": round(percentile(samples, p) * 1000, 2) for p in (0.5, 0.95, 0.99)}
+
+    return {
+        "benchmark": "search_latency",
+        "rows": args.rows,
+        "users": args.users,
+        "seed_seconds": round(seed_seconds, 1),
+        "queries": len(first),
+        "hits_per_query": round(hits / max(1, len(first)), 1),
+        "first_page": summary(first),
+        "next_page": summary(next_page),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=25)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Synthetic users, folder trees, files and refresh tokens for benchmarks.
+
+    python -m benchmarks.seed --workdir /tmp/bench --users 50 --depth 3 --fanout 3
+
+Rows are written straight through `models` (no HTTP, one bcrypt hash for
+everyone), bytes go into the blob store and the search index is filled, so
+the result looks like data uploaded through the API: per-user counters,
+blob reference counts and search entries all agree. Everything derives
+from `--seed`, so two runs with the same arguments produce the same tree.
+Without `--workdir` a fresh scratch directory is used; the command prints
+the environment to start uvicorn against it.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks import configure_environment
+
+WORDS = [
+    "lesson", "notes", "homework", "physics", "algebra", "essay", "draft", "final", "report", "chapter",
+    "lab", "quiz", "geometry", "history", "project", "summary", "exam", "answers", "biology", "poem",
+]
+IMAGE_VARIANTS = 8
+IMAGE_SIZE = (96, 96)
+DEFAULT_PASSWORD = "benchmark-password"
+
+
+def make_image(rng: random.Random, size=IMAGE_SIZE) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_text(rng: random.Random, words: int) -> bytes:
+    lines = [" ".join(rng.choices(WORDS, k=12)) for _ in range(max(1, words // 12))]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def seed(users: int = 20, depth: int = 3, fanout: int = 3, files_per_folder: int = 4,
+         image_ratio: float = 0.3, tokens_per_user: int = 2, password: str = DEFAULT_PASSWORD,
+         seed_value: int = 1, prefix: str = "student") -> dict:
+    """Create `users` users, each with a `fanout`-ary folder tree `depth` levels deep.
+
+    Every folder holds `files_per_folder` files, `image_ratio` of them PNGs
+    (a few shared images, so uploads of the same picture dedupe as in real
+    use) and the rest distinct text files. Returns the credentials the
+    scenarios log in with and totals of what was written.
+    """
+    import blob_store
+    import search
+    from sqlalchemy import func, select
+    from auth import create_refresh_token
+    from config import REFRESH_TOKEN_EXPIRE_MINUTES
+    from database import SessionLocal
+    from file_operations import make_etag
+    from models import RefreshToken, User, UserFile
+    from password_utils import get_password_hash
+    from user_operations import hash_token
+
+    rng = random.Random(seed_value)
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    hashed_password = get_password_hash(password)
+    images = [make_image(rng) for _ in range(IMAGE_VARIANTS)]
+
+    written = set()
+
+    def store(content: bytes) -> str:
+        sha256 = hashlib.sha256(content).hexdigest()
+        if sha256 not in written:
+            path = blob_store.blob_path(sha256)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(content)
+            written.add(sha256)
+        return sha256
+
+    db = SessionLocal()
+    try:
+        next_file_id = (db.scalar(select(func.max(UserFile.id))) or 0) + 1
+        first_user = db.scalar(select(func.count(User.id))) or 0
+        accounts, totals = [], Counter()
+        for n in range(first_user, first_user + users):
+            username = f"{prefix}{n:05d}"
+            user = User(username=username, email=f"{username}@example.com", hashed_password=hashed_password,
+                        role="user", disabled=False, used_bytes=0, file_count=0)
+            db.add(user)
+            db.flush()
+
+            rows, entries = [], []
+            # (parent id, parent path, level) of folders still to fill.
+            pending = [(None, "", 0)]
+            while pending:
+                parent_id, parent_path, level = pending.pop()
+                for f in range(files_per_folder):
+                    if rng.random() < image_ratio:
+                        name, content, mime_type = f"{rng.choice(WORDS)}_{f}.png", rng.choice(images), "image/png"
+                    else:
+                        name, mime_type = f"{rng.choice(WORDS)}_{f}.txt", "text/plain"
+                        content = make_text(rng, rng.randint(20, 400))
+                    sha256 = store(content)
+                    relative_path = f"{parent_path}{name}"
+                    rows.append({
+                        "id": next_file_id, "user_id": user.id, "filename": name, "relative_path": relative_path,
+                        "is_folder": False, "parent_id": parent_id, "created_at": now, "updated_at": now,
+                        "size": len(content), "mime_type": mime_type, "sha256": sha256, "etag": make_etag(sha256),
+                        "blob_sha": sha256,
+                    })
+                    entries.append((next_file_id, user.id, name, relative_path, content.decode() if mime_type == "text/plain" else None))
+                    next_file_id += 1
+                    user.used_bytes += len(content)
+                    user.file_count += 1
+                if level == depth:
+                    continue
+                for f in range(fanout):
+                    name = f"{rng.choice(WORDS)}_{level}_{f}"
+                    relative_path = f"{parent_path}{name}"
+                    rows.append({
+                        "id": next_file_id, "user_id": user.id, "filename": name, "relative_path": relative_path,
+                        "is_folder": True, "parent_id": parent_id, "created_at": now, "updated_at": now,
+                        "size": None, "mime_type": None, "sha256": None, "etag": None, "blob_sha": None,
+                    })
+                    entries.append((next_file_id, user.id, name, relative_path, None))
+                    pending.append((next_file_id, f"{relative_path}/", level + 1))
+                    next_file_id += 1
+                    totals["folders"] += 1
+
+            blob_store.acquire(db, [(row["blob_sha"], row["size"]) for row in rows if row["blob_sha"]])
+            # Parents come before their children, so the self-referencing foreign key is satisfied.
+            db.execute(UserFile.__table__.insert(), rows)
+            search.index(db, entries)
+            tokens = []
+            for _ in range(tokens_per_user):
+                token = create_refresh_token({"sub": username, "role": "user"})
+                db.add(RefreshToken(user_id=user.id, token_hash=hash_token(token), created_at=now,
+                                    expires_at=now + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES), device="benchmark"))
+                tokens.append(token)
+            totals["files"] += user.file_count
+            totals["bytes"] += user.used_bytes
+            db.commit()
+            accounts.append({"id": user.id, "username": username, "password": password, "refresh_tokens": tokens})
+    finally:
+        db.close()
+
+    return {
+        "users": accounts,
+        "folders": totals["folders"],
+        "files": totals["files"],
+        "bytes": totals["bytes"],
+        "blobs": len(written),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=3, help="folder levels below the root")
+    parser.add_argument("--fanout", type=int, default=3, help="subfolders per folder")
+    parser.add_argument("--files-per-folder", type=int, default=4)
+    parser.add_argument("--image-ratio", type=float, default=0.3)
+    parser.add_argument("--tokens-per-user", type=int, default=2, help="refresh tokens (signed-in devices) per user")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def seed_from_args(args) -> dict:
+    return seed(users=args.users, depth=args.depth, fanout=args.fanout, files_per_folder=args.files_per_folder,
+                image_ratio=args.image_ratio, tokens_per_user=args.tokens_per_user, seed_value=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", help="directory for the database and files (default: a new scratch directory)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    root = configure_environment(args.workdir)
+    from database import run_migrations
+
+    run_migrations()
+    summary = seed_from_args(args)
+    summary["users"] = len(summary["users"])
+    summary["environment"] = {key: os.environ[key] for key in ("DATABASE_URL", "BASE_FOLDER_DIR", "THUMBNAIL_DIR")}
+    summary["workdir"] = str(root)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
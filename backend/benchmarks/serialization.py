@@ -0,0 +1,188 @@
+"""
+Serialization cost of a `GET /files` listing, per 10k rows.
+
+    python -m benchmarks.serialization --rows 10000 --repeat 7
+
+Lists one folder of `--rows` files, unpaginated, both ways and reports
+the median time of each stage:
+
+  before  ORM objects -> FileSchema per row -> FilePage.items -> FastAPI's
+          response_model validation and encoding -> json.dumps
+  after   selected columns -> dicts (file_operations.file_listing) ->
+          orjson (file_operations.listing_response)
+
+`fetch_ms` is the query and row construction, `build_ms` turns rows into
+items, `encode_ms` is everything from the items to the response body.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import configure_environment
+
+STATUSES = ["ready", "ready", "pending", "failed"]
+
+
+def seed(engine, rows: int) -> int:
+    """One user with one folder of `rows` files, a quarter of them images; returns the folder id."""
+    from models import User, UserFile
+
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"id": 1, "username": "bench", "email": "bench@example.com", "hashed_password": "-", "role": "user", "disabled": False}
+        ])
+        connection.execute(UserFile.__table__.insert(), [{
+            "id": 1, "user_id": 1, "filename": "folder", "relative_path": "folder", "is_folder": True,
+            "parent_id": None, "created_at": now, "updated_at": now,
+        }])
+        batch = []
+        for i in range(rows):
+            image = i % 4 == 0
+            sha256 = f"{i:064x}"
+            created = now - timedelta(seconds=i)
+            status = STATUSES[i // 4 % len(STATUSES)] if image else None
+            batch.append({
+                "id": i + 2, "user_id": 1, "filename": f"file{i}.png" if image else f"file{i}.txt",
+                "relative_path": f"folder/file{i}", "is_folder": False, "parent_id": 1,
+                "created_at": created, "updated_at": created, "size": i,
+                "mime_type": "image/png" if image else "text/plain", "sha256": sha256, "etag": f'"{sha256[:32]}"',
+                "thumbnail_key": sha256[:16] if image else None,
+                "thumbnail_status": status,
+                # Pending rows are still within their render time, so listings leave them alone.
+                "thumbnail_queued_at": now if status == "pending" else None,
+            })
+        connection.execute(UserFile.__table__.insert(), batch)
+    return 1
+
+
+def previous_file_schema(user, file):
+    """file_operations.file_schema as listings used it before the fast path."""
+    import thumbnails
+    from config import BASE_URL
+    from schemas import FileSchema
+
+    def thumbnail_url():
+        if file.thumbnail_status == thumbnails.STATUS_PENDING:
+            return thumbnails.PENDING_ICON_URL
+        if file.thumbnail_status != thumbnails.STATUS_READY:
+            return thumbnails.DEFAULT_ICON_URL
+        return f"{BASE_URL}/api/thumbnails/{thumbnails.thumbnail_name(user.username, file)}"
+
+    def thumbnail_urls():
+        if file.thumbnail_status != thumbnails.STATUS_READY:
+            return {}
+        return {size: f"{BASE_URL}/api/thumbnails/{thumbnails.thumbnail_name(user.username, file, size)}"
+                for size in thumbnails.THUMBNAIL_SIZES}
+
+    return FileSchema(
+        id=file.id,
+        name=file.filename,
+        url=f"{BASE_URL}/api/files/{file.id}/download",
+        size=file.size or 0,
+        mime_type=file.mime_type,
+        etag=file.etag,
+        folder=file.parent_id,
+        thumbnail=thumbnail_url(),
+        thumbnail_status=file.thumbnail_status,
+        thumbnails=thumbnail_urls(),
+    )
+
+
+def response_field():
+    import main
+
+    return next(route for route in main.app.routes if getattr(route, "path", None) == "/files" and "GET" in route.methods).response_field
+
+
+async def before(db, user, folder_id: int, params, field) -> dict:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from models import UserFile
+    from pagination import paginate
+    from schemas import FilePage
+
+    started = time.perf_counter()
+    query = db.query(UserFile).filter(UserFile.user_id == user.id, UserFile.is_folder == False, UserFile.parent_id == folder_id)
+    files, next_cursor = paginate(query, UserFile.filename, UserFile.id, limit=params.limit)
+    fetched = time.perf_counter()
+    items = FilePage(items=[previous_file_schema(user, file) for file in files], next_cursor=next_cursor).items
+    built = time.perf_counter()
+    # What FastAPI does with a sync endpoint's return value.
+    content = await serialize_response(field=field, response_content=items, is_coroutine=False)
+    body = JSONResponse(content).body
+    encoded = time.perf_counter()
+    db.expunge_all()
+    return {"fetch_ms": fetched - started, "build_ms": built - fetched, "encode_ms": encoded - built, "bytes": len(body)}
+
+
+def after(db, user, folder_id: int, params) -> dict:
+    import file_operations
+
+    started = time.perf_counter()
+    files, next_cursor = file_operations._listing(db, user, folder_id, False, params, file_operations.FILE_COLUMNS)
+    fetched = time.perf_counter()
+    items = [file_operations.file_item(user.username, file) for file in files]
+    built = time.perf_counter()
+    body = file_operations.listing_response(items, next_cursor, params).body
+    encoded = time.perf_counter()
+    return {"fetch_ms": fetched - started, "build_ms": built - fetched, "encode_ms": encoded - built, "bytes": len(body)}
+
+
+def summarize(runs: list, rows: int) -> dict:
+    per_10k = 10_000 / rows * 1000
+    result = {key: round(statistics.median(run[key] for run in runs) * per_10k, 1) for key in ("fetch_ms", "build_ms", "encode_ms")}
+    result["total_ms"] = round(sum(result.values()), 1)
+    result["bytes"] = runs[0]["bytes"]
+    return result
+
+
+async def run(args) -> dict:
+    configure_environment()
+    from database import SessionLocal, engine, run_migrations
+    from schemas import ListQuery
+    from user_cache import CachedUser
+
+    run_migrations()
+    folder_id = seed(engine, args.rows)
+    user = CachedUser(id=1, username="bench", email="bench@example.com", role="user", disabled=False, vk_id=None)
+    # Unpaginated, as the client's folder view asks for it: the whole folder in one list.
+    params = ListQuery()
+    field = response_field()
+
+    results = {"before": [], "after": []}
+    db = SessionLocal()
+    try:
+        for _ in range(args.repeat):
+            results["before"].append(await before(db, user, folder_id, params, field))
+            results["after"].append(after(db, user, folder_id, params))
+    finally:
+        db.close()
+
+    summary = {name: summarize(runs, args.rows) for name, runs in results.items()}
+    return {
+        "benchmark": "serialization",
+        "rows": args.rows,
+        "repeat": args.repeat,
+        "per_10k_rows": summary,
+        "speedup": {
+            key: round(summary["before"][key] / summary["after"][key], 1)
+            for key in ("fetch_ms", "build_ms", "encode_ms", "total_ms") if summary["after"][key]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+VK sign-in throughput and latency against the local fake VK server.
+
+    python -m benchmarks.vk_login --duration 10 --clients 8 --latency-ms 20 --handshake-ms 60
+    python -m benchmarks.vk_login --keepalive 0     # a new connection per VK call
+
+Each login is a full `/vk-callback`: code exchange, users.get, user lookup
+and token issue. The report includes how many TCP connections the fake
+server saw, which shows how well the shared client pools connections.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks import configure_environment, percentile
+from benchmarks.fake_vk import create_app, serve_in_thread
+
+
+async def run(args):
+    configure_environment()
+    fake = create_app(args.latency_ms / 1000, args.failure_rate, args.users, args.handshake_ms / 1000)
+    server, url = serve_in_thread(fake)
+    os.environ.update({
+        "VK_OAUTH_URL": url,
+        "VK_API_URL": url,
+        "VK_CLIENT_ID": "bench",
+        "VK_CLIENT_SECRET": "bench",
+        "VK_REDIRECT_URI": "http://testserver/vk-callback",
+        "VK_HTTP_MAX_KEEPALIVE": str(args.keepalive),
+        "BCRYPT_ROUNDS": "4",
+    })
+
+    import httpx
+    import main
+    import vk_auth
+    from database import run_migrations
+
+    run_migrations()
+    vk_auth.start()
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    errors = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            # First sign-in of every VK user creates the account; keep that out of the measurement.
+            for uid in range(args.users):
+                await client.get("/vk-callback", params={"code": f"warm-{uid}"})
+            fake.state.stats.update(requests=0, failures=0, connections=set())
+
+            deadline = time.perf_counter() + args.duration
+
+            async def login(worker):
+                sequence = 0
+                while time.perf_counter() < deadline:
+                    sequence += 1
+                    started = time.perf_counter()
+                    response = await client.get("/vk-callback", params={"code": f"c{worker}-{sequence}"})
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(login(i) for i in range(args.clients)))
+            elapsed = time.perf_counter() - started
+    finally:
+        await vk_auth.stop()
+        server.should_exit = True
+
+    stats = fake.state.stats
+    return {
+        "clients": args.clients,
+        "keepalive": args.keepalive,
+        "vk_latency_ms": args.latency_ms,
+        "vk_handshake_ms": args.handshake_ms,
+        "logins": len(latencies),
+        "logins_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "errors": errors,
+        "vk_requests": stats["requests"],
+        "vk_connections": len(stats["connections"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50, help="distinct VK accounts")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated VK response time")
+    parser.add_argument("--handshake-ms", type=float, default=60.0, help="simulated TCP+TLS setup per new connection")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of VK calls answered with 503")
+    parser.add_argument("--keepalive", type=int, default=20, help="VK_HTTP_MAX_KEEPALIVE for the run")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Content-addressed, reference-counted storage for file bytes.
+
+Bytes are kept once per SHA-256 under BLOB_DIR/ab/cd/<sha256>. user_files
+rows point at a blob and the blobs table counts those references. Uploads
+are hashed into a temporary file while they stream in and only linked into
+the store when the content is new. Dropping a reference just decrements
+the count; a background collector deletes blobs nobody refers to, together
+with their thumbnails. Under serve.py only the worker holding the collector's
+claim runs it.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, delete, exists, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import SessionLocal, IS_SQLITE
+from models import Blob, UserFile
+from config import BLOB_DIR, BLOB_GC_INTERVAL_SECONDS, BLOB_GC_BATCH_SIZE
+import shared_cache
+import thumbnails
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+TEMP_DIR = ".tmp"
+CLAIM_NAME = "blob_gc"
+
+_blobs = Blob.__table__
+_release = update(_blobs).where(_blobs.c.sha256 == bindparam("b_sha256")).values(refcount=_blobs.c.refcount - bindparam("b_count"))
+_task: Optional[asyncio.Task] = None
+_holding = False
+
+
+def blob_path(sha256: str) -> Path:
+    return Path(BLOB_DIR) / sha256[:2] / sha256[2:4] / sha256
+
+def write_stream(source: BinaryIO, destination: Path) -> Tuple[int, str]:
+    """Copy `source` to `destination`, returning the byte count and SHA-256 computed on the way."""
+    digest = hashlib.sha256()
+    size = 0
+    with destination.open("wb") as buffer:
+        while chunk := source.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
+            buffer.write(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+def receive(source: BinaryIO) -> Tuple[Path, int, str]:
+    """Stream `source` into a temporary file inside the store; returns its path, size and SHA-256."""
+    path = Path(BLOB_DIR) / TEMP_DIR / uuid.uuid4().hex
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        size, sha256 = write_stream(source, path)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, size, sha256
+
+def place(source: Path, sha256: str) -> bool:
+    """Make sure the blob exists on disk, linking `source` into the store if the content is new.
+
+    Call after acquire() and before committing: the reference is what keeps
+    the collector away from the blob. `source` is left for the caller to remove.
+    Returns True if the bytes were new.
+    """
+    target = blob_path(sha256)
+    if target.exists():
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        return False
+    except OSError:
+        # No hard links across filesystems (or at all): copy beside the target and rename into place.
+        partial = target.with_name(f"{target.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(source, partial)
+        os.replace(partial, target)
+    return True
+
+def _upsert():
+    insert = sqlite.insert if IS_SQLITE else postgresql.insert
+    statement = insert(_blobs)
+    return statement.on_conflict_do_update(
+        index_elements=[_blobs.c.sha256],
+        set_={"refcount": _blobs.c.refcount + statement.excluded.refcount},
+    )
+
+def acquire(db: Session, references: Iterable[Tuple[str, int]]):
+    """Add one reference per (sha256, size) pair, creating blob rows as needed. The caller commits."""
+    counts, sizes = Counter(), {}
+    for sha256, size in references:
+        counts[sha256] += 1
+        sizes[sha256] = size
+    if counts:
+        now = datetime.utcnow()
+        # Sorted, so concurrent batches lock blob rows in the same order.
+        db.execute(_upsert(), [
+            {"sha256": sha256, "size": sizes[sha256], "refcount": count, "created_at": now}
+            for sha256, count in sorted(counts.items())
+        ])
+
+def release(db: Session, references: Iterable[Optional[str]]):
+    """Drop one reference per sha256 (None entries are skipped). The caller commits."""
+    counts = Counter(sha256 for sha256 in references if sha256)
+    if counts:
+        db.execute(_release, [{"b_sha256": sha256, "b_count": count} for sha256, count in sorted(counts.items())])
+
+def collect(db: Session, limit: int = BLOB_GC_BATCH_SIZE) -> int:
+    """Delete up to `limit` unreferenced blobs with their files and thumbnails; returns how many went."""
+    candidates = select(Blob.sha256).where(Blob.refcount <= 0).limit(limit)
+    referenced = exists().where(UserFile.blob_sha == Blob.sha256)
+    removed = db.execute(
+        delete(Blob).where(Blob.sha256.in_(candidates), Blob.refcount <= 0, ~referenced)
+        .returning(Blob.sha256).execution_options(synchronize_session=False)
+    ).scalars().all()
+    # Files go while the deleted rows are still locked, so an upload of the same
+    # content waits and then links a fresh copy instead of trusting this one.
+    for sha256 in removed:
+        blob_path(sha256).unlink(missing_ok=True)
+        for path in thumbnails.blob_thumbnail_files(sha256):
+            path.unlink(missing_ok=True)
+    db.commit()
+    return len(removed)
+
+def sweep_orphans(db: Session, min_age_seconds: float = 3600) -> int:
+    """Remove store files without a blob row, left by uploads whose transaction failed after linking."""
+    cutoff = time.time() - min_age_seconds
+    removed = 0
+
+    def stale(path: Path) -> bool:
+        stat = path.stat()
+        # A hard link keeps the source's mtime but updates ctime.
+        return max(stat.st_mtime, stat.st_ctime) < cutoff
+
+    for directory in sorted(Path(BLOB_DIR).glob("??/??")):
+        files = {path.name: path for path in directory.iterdir() if path.is_file()}
+        known = set(db.scalars(select(Blob.sha256).where(Blob.sha256.in_(list(files))))) if files else set()
+        for name, path in files.items():
+            if name not in known and stale(path):
+                path.unlink(missing_ok=True)
+                removed += 1
+    temp_dir = Path(BLOB_DIR) / TEMP_DIR
+    if temp_dir.is_dir():
+        for path in temp_dir.iterdir():
+            if stale(path):
+                path.unlink(missing_ok=True)
+                removed += 1
+    return removed
+
+def collect_once() -> int:
+    """Collect batch by batch, committing each batch so locks stay short."""
+    total = 0
+    db = SessionLocal()
+    try:
+        while True:
+            removed = collect(db, BLOB_GC_BATCH_SIZE)
+            total += removed
+            if removed < BLOB_GC_BATCH_SIZE:
+                return total
+    finally:
+        db.close()
+
+async def _run():
+    global _holding
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        _holding = shared_cache.claim(CLAIM_NAME, BLOB_GC_INTERVAL_SECONDS * 3, renew=True)
+        if not _holding:
+            continue
+        try:
+            removed = await run_in_threadpool(collect_once)
+            if removed:
+                logger.info("Collected %d unreferenced blobs", removed)
+        except Exception:
+            logger.exception("Blob collection failed")
+
+def start():
+    global _task
+    if _task is None and BLOB_GC_INTERVAL_SECONDS > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop():
+    global _task, _holding
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        if _holding:
+            shared_cache.release(CLAIM_NAME)
+            _holding = False
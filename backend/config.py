@@ -8,15 +8,85 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 10))
+# Exposes per-request DB timings to every client: for development only.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 REFRESH_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_TOKEN_EXPIRE_MINUTES"))
+TOKEN_SWEEP_INTERVAL_SECONDS = float(os.getenv("TOKEN_SWEEP_INTERVAL_SECONDS", 300))
+TOKEN_SWEEP_BATCH_SIZE = int(os.getenv("TOKEN_SWEEP_BATCH_SIZE", 1000))
 BASE_FOLDER_DIR = os.getenv("BASE_FOLDER_DIR")
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join(BASE_FOLDER_DIR or "", ".uploads"))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24))
+# How long a chunk request keeps an upload to itself without renewing, e.g. after its worker died.
+UPLOAD_WRITE_LEASE_SECONDS = float(os.getenv("UPLOAD_WRITE_LEASE_SECONDS", 30))
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(BASE_FOLDER_DIR or "", ".blobs"))
+BLOB_GC_INTERVAL_SECONDS = float(os.getenv("BLOB_GC_INTERVAL_SECONDS", 60))
+BLOB_GC_BATCH_SIZE = int(os.getenv("BLOB_GC_BATCH_SIZE", 500))
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", 0))
+USAGE_RECONCILE_INTERVAL_SECONDS = float(os.getenv("USAGE_RECONCILE_INTERVAL_SECONDS", 60))
+USAGE_RECONCILE_BATCH_SIZE = int(os.getenv("USAGE_RECONCILE_BATCH_SIZE", 500))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+BATCH_IO_WORKERS = int(os.getenv("BATCH_IO_WORKERS", 8))
+ARCHIVE_MAX_CONCURRENT = int(os.getenv("ARCHIVE_MAX_CONCURRENT", 4))
+ARCHIVE_COMPRESSLEVEL = int(os.getenv("ARCHIVE_COMPRESSLEVEL", 6))
 THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR")
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", os.cpu_count() or 1))
+# A row pending for longer lost its render (worker killed, app restarted) and is queued again.
+THUMBNAIL_PENDING_TIMEOUT_SECONDS = int(os.getenv("THUMBNAIL_PENDING_TIMEOUT_SECONDS", 600))
 BASE_URL = os.getenv("BASE_URL")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "").split(",")
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", 40))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 8 * PASSWORD_HASH_WORKERS or 8))
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TEXT_CACHE_MAX_FILE_BYTES = int(os.getenv("TEXT_CACHE_MAX_FILE_BYTES", 4 * 1024 * 1024))
+READ_MAX_PAGE_BYTES = int(os.getenv("READ_MAX_PAGE_BYTES", 4 * 1024 * 1024))
+SEARCH_CONTENT_MAX_BYTES = int(os.getenv("SEARCH_CONTENT_MAX_BYTES", 256 * 1024))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_FOLDER_DIR or "", ".profiles"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 500))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", os.cpu_count() or 1))
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", 60))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", 5000))
+RECONCILE_GRACE_SECONDS = float(os.getenv("RECONCILE_GRACE_SECONDS", 3600))
+RECONCILE_VERIFY_HOURS = float(os.getenv("RECONCILE_VERIFY_HOURS", 24))
+# Off by default: the reconciler only reports until it is trusted with this storage.
+RECONCILE_REPAIR = os.getenv("RECONCILE_REPAIR", "false").lower() in ("1", "true", "yes")
+# Rows removed plus files deleted in one round; the rest waits for later rounds.
+RECONCILE_MAX_REPAIRS = int(os.getenv("RECONCILE_MAX_REPAIRS", 100))
+RECONCILE_WATCH = os.getenv("RECONCILE_WATCH", "true").lower() in ("1", "true", "yes")
 
 VK_CLIENT_ID = os.getenv("VK_CLIENT_ID")
 VK_CLIENT_SECRET = os.getenv("VK_CLIENT_SECRET")
 VK_REDIRECT_URI = os.getenv("VK_REDIRECT_URI")
+VK_OAUTH_URL = os.getenv("VK_OAUTH_URL", "https://oauth.vk.com").rstrip("/")
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com").rstrip("/")
+VK_API_VERSION = os.getenv("VK_API_VERSION", "5.131")
+VK_HTTP_CONNECT_TIMEOUT = float(os.getenv("VK_HTTP_CONNECT_TIMEOUT", 3))
+VK_HTTP_READ_TIMEOUT = float(os.getenv("VK_HTTP_READ_TIMEOUT", 10))
+VK_HTTP_MAX_CONNECTIONS = int(os.getenv("VK_HTTP_MAX_CONNECTIONS", 20))
+VK_HTTP_MAX_KEEPALIVE = int(os.getenv("VK_HTTP_MAX_KEEPALIVE", 20))
+VK_HTTP_CONCURRENCY = int(os.getenv("VK_HTTP_CONCURRENCY", 20))
+VK_HTTP_RETRIES = int(os.getenv("VK_HTTP_RETRIES", 2))
+VK_HTTP2 = os.getenv("VK_HTTP2", "true").lower() in ("1", "true", "yes")
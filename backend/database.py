@@ -2,18 +2,64 @@
 Database connection settings.
 """
 
-from sqlalchemy import create_engine
+from pathlib import Path
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS
+)
+import query_stats
 
-engine = create_engine(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def engine_options() -> dict:
+    if IS_SQLITE:
+        # Connections are used from the request thread pool; the busy timeout replaces "database is locked" errors with waiting.
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, **engine_options())
+query_stats.instrument(engine)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.close()
+
+# Sessions check out a connection lazily, on their first statement.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+
+def run_migrations():
+    """Upgrade the schema to the latest Alembic revision.
+
+    Databases created by create_tables() before migrations existed have no
+    alembic_version table; they are stamped at the baseline first.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(Path(__file__).with_name("alembic.ini")))
+    config.attributes["configure_logger"] = False
+    tables = inspect(engine).get_table_names()
+    if "users" in tables and "alembic_version" not in tables:
+        command.stamp(config, "0001")
+    command.upgrade(config, "head")
     
 def get_db():
     db = SessionLocal()
@@ -23,5 +69,5 @@ def get_db():
         db.close()
         
 if __name__ == "__main__":
-    create_tables()
-    print("Tables created successfully.")
\ No newline at end of file
+    run_migrations()
+    print("Database schema is up to date.")
\ No newline at end of file
@@ -3,26 +3,95 @@ Functions for working with files and folders.
 """
 
 from fastapi import HTTPException, UploadFile
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from models import User, UserFile
-from schemas import FolderSchema, FileSchema
-from typing import List, Optional
+from schemas import FolderSchema, FileSchema, FolderSize, FolderTarget, ListQuery, ReadQuery
+from typing import List, Optional, Tuple
 from pathlib import Path
 import shutil
+import mimetypes
 from datetime import datetime
-from config import BASE_FOLDER_DIR, THUMBNAIL_DIR, BASE_URL
-from PIL import Image
-from fastapi.responses import FileResponse, StreamingResponse
+from config import BASE_FOLDER_DIR, BASE_URL
+import thumbnails
+import reaper
+import blob_store
+import quotas
+import search
+import http_cache
+import text_reader
+from starlette.datastructures import Headers
+from pagination import paginate
+
+from fastapi.responses import ORJSONResponse
 
 
 def get_absolute_path(user: User, relative_path: str) -> Path:
     return Path(BASE_FOLDER_DIR) / user.username / relative_path
 
-def get_folders(db: Session, user: User, parent_id: Optional[int] = None) -> List[FolderSchema]:
-    query = db.query(UserFile).filter(UserFile.user_id == user.id, UserFile.is_folder == True)
-    query = query.filter(UserFile.parent_id == parent_id if parent_id is not None else UserFile.parent_id == None)
-    folders = query.all()
-    return [FolderSchema(id=folder.id, name=folder.filename, parent=folder.parent_id) for folder in folders]
+def content_path(user: User, file: UserFile) -> Path:
+    """Where a file row's bytes live: its blob, or the user's folder for rows stored before the blob store."""
+    if file.blob_sha:
+        return blob_store.blob_path(file.blob_sha)
+    return get_absolute_path(user, file.relative_path)
+
+SORT_COLUMNS = {
+    "name": UserFile.filename,
+    "created": UserFile.created_at,
+    "updated": UserFile.updated_at,
+    "size": UserFile.size,
+}
+
+# Listings read only what their items show, as plain rows rather than ORM objects.
+FOLDER_COLUMNS = (UserFile.id, UserFile.filename, UserFile.parent_id)
+FILE_COLUMNS = (
+    UserFile.id, UserFile.filename, UserFile.size, UserFile.mime_type, UserFile.etag, UserFile.parent_id,
+    UserFile.sha256, UserFile.blob_sha, UserFile.thumbnail_key, UserFile.thumbnail_status, UserFile.thumbnail_queued_at,
+)
+FILES_URL = f"{BASE_URL}/api/files"
+
+def _listing(db: Session, user: User, parent_id: Optional[int], is_folder: bool, params: ListQuery, columns: tuple):
+    sort_column = SORT_COLUMNS[params.sort]
+    # paginate() reads the next cursor from the sort column of the last row.
+    if not any(column is sort_column for column in columns):
+        columns = (*columns, sort_column)
+    query = db.query(*columns).filter(
+        UserFile.user_id == user.id,
+        UserFile.is_folder == is_folder,
+        UserFile.parent_id == parent_id if parent_id else UserFile.parent_id == None
+    )
+    if params.prefix:
+        query = query.filter(UserFile.filename.startswith(params.prefix, autoescape=True))
+    if params.type and not is_folder:
+        if "/" in params.type:
+            query = query.filter(UserFile.mime_type.startswith(params.type, autoescape=True))
+        else:
+            query = query.filter(UserFile.filename.endswith(f".{params.type.lstrip('.')}", autoescape=True))
+    if params.created_after:
+        query = query.filter(UserFile.created_at >= params.created_after)
+    if params.created_before:
+        query = query.filter(UserFile.created_at < params.created_before)
+    return paginate(
+        query, SORT_COLUMNS[params.sort], UserFile.id,
+        limit=params.limit, cursor=params.cursor, descending=params.order == "desc"
+    )
+
+def listing_response(items: List[dict], next_cursor: Optional[str], params: ListQuery) -> ORJSONResponse:
+    """A listing as a FolderPage/FilePage, or a bare list when unpaginated.
+
+    The items are built from our own columns and already have the schema's
+    shape, so they are encoded as they are instead of being validated again
+    through the endpoint's response_model.
+    """
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor} if params.paginated else items)
+
+def list_folders(db: Session, user: User, parent_id: Optional[int], params: ListQuery) -> ORJSONResponse:
+    return listing_response(*folder_listing(db, user, parent_id, params), params)
+
+def folder_listing(db: Session, user: User, parent_id: Optional[int], params: ListQuery) -> Tuple[List[dict], Optional[str]]:
+    folders, next_cursor = _listing(db, user, parent_id, True, params, FOLDER_COLUMNS)
+    return [{"id": folder.id, "name": folder.filename, "parent": folder.parent_id} for folder in folders], next_cursor
 
 def create_folder(db: Session, user: User, folder_name: str, parent_id: Optional[int] = None) -> FolderSchema:
     parent = None
@@ -37,15 +106,6 @@ def create_folder(db: Session, user: User, folder_name: str, parent_id: Optional
     
     relative_path = folder_name if not parent else str(Path(parent.relative_path) / folder_name)
     
-    existing_folder = db.query(UserFile).filter(
-        UserFile.user_id == user.id,
-        UserFile.relative_path == relative_path,
-        UserFile.is_folder == True
-    ).first()
-
-    if existing_folder:
-        raise HTTPException(status_code=400, detail="A folder with this name already exists in the specified location")
-
     new_folder = UserFile(
         user_id=user.id,
         filename=folder_name,
@@ -57,149 +117,347 @@ def create_folder(db: Session, user: User, folder_name: str, parent_id: Optional
     )
 
     db.add(new_folder)
-    db.commit()
+    try:
+        db.flush()
+        search.index(db, [(new_folder.id, user.id, folder_name, relative_path, None)])
+        db.commit()
+    except IntegrityError:
+        # uq_user_files_user_path enforces unique paths even for concurrent requests.
+        db.rollback()
+        raise HTTPException(status_code=400, detail="A folder with this name already exists in the specified location")
     db.refresh(new_folder)
 
-    absolute_path = get_absolute_path(user, relative_path)
-    absolute_path.mkdir(parents=True, exist_ok=True)
-
     return FolderSchema(id=new_folder.id, name=new_folder.filename, parent=new_folder.parent_id)
 
-def delete_folder(db: Session, user: User, folder_id: int):
+def subtree_ids(user: User, *root_ids: int):
+    """SELECT of the ids of `root_ids` and all of their descendants, as one recursive CTE."""
+    tree = select(UserFile.id).where(UserFile.id.in_(root_ids), UserFile.user_id == user.id).cte("subtree", recursive=True)
+    tree = tree.union_all(select(UserFile.id).where(UserFile.parent_id == tree.c.id))
+    return select(tree.c.id)
+
+def _get_folder(db: Session, user: User, folder_id: int) -> UserFile:
     folder = db.query(UserFile).filter(UserFile.id == folder_id, UserFile.user_id == user.id, UserFile.is_folder == True).first()
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
+    return folder
 
-    delete_recursive(db, folder)
-
-    db.delete(folder)
+def delete_folder(db: Session, user: User, folder_id: int):
+    folder = _get_folder(db, user, folder_id)
+
+    subtree = subtree_ids(user, folder.id)
+    thumbnail_paths, blobs, freed = [], [], 0
+    files = db.query(UserFile.id, UserFile.thumbnail_key, UserFile.blob_sha, UserFile.size).filter(
+        UserFile.id.in_(subtree), UserFile.is_folder == False
+    ).all()
+    for row in files:
+        thumbnail_paths.extend(thumbnails.thumbnail_files(user.username, row))
+        blobs.append(row.blob_sha)
+        freed += row.size or 0
+
+    # The folder on disk only holds rows from before the blob store.
+    absolute_path = get_absolute_path(user, folder.relative_path)
+    search.remove(db, subtree)
+    db.query(UserFile).filter(UserFile.id.in_(subtree)).delete(synchronize_session=False)
+    blob_store.release(db, blobs)
+    quotas.charge(db, user, -freed, -len(files))
     db.commit()
 
-    absolute_path = get_absolute_path(user, folder.relative_path)
-    shutil.rmtree(absolute_path, ignore_errors=True)
+    reaper.enqueue(absolute_path, *thumbnail_paths)
 
-def get_files(db: Session, user: User, folder_id: Optional[int] = None) -> List[FileSchema]:
-    query = db.query(UserFile).filter(UserFile.user_id == user.id, UserFile.is_folder == False)
-    query = query.filter(UserFile.parent_id == folder_id if folder_id else UserFile.parent_id == None)
-    
-    files = query.all()
-    file_schemas = []
-    
-    for file in files:
-        absolute_path = get_absolute_path(user, file.relative_path)
-        thumbnail_path = get_thumbnail_path(absolute_path, user.username)
-        
-        file_schemas.append(FileSchema(
-            id=file.id,
-            name=file.filename,
-            url=f"{BASE_URL}/api/files/{file.id}/download",
-            size=absolute_path.stat().st_size,
-            folder=file.parent_id,
-            thumbnail=thumbnail_path
-        ))
-    
-    return file_schemas
+def _resolve_target(db: Session, user: User, folder: UserFile, target: FolderTarget) -> Tuple[Optional[UserFile], str, str]:
+    parent = _get_folder(db, user, target.parent) if target.parent else None
+    name = target.name or folder.filename
+    relative_path = name if not parent else str(Path(parent.relative_path) / name)
 
-def create_thumbnail(file_path: Path, user_username: str, thumbnail_size=(100, 100)) -> str:
-    user_thumbnail_dir = Path(THUMBNAIL_DIR) / user_username
-    user_thumbnail_dir.mkdir(parents=True, exist_ok=True)
-    
-    thumbnail_path = user_thumbnail_dir / f"th_{file_path.stem}.webp"
-    
-    with Image.open(file_path) as img:
-        img.thumbnail(thumbnail_size)
-        img.save(thumbnail_path, "WEBP")
-    
-    return f"{BASE_URL}/api/thumbnails/{user_username}/{thumbnail_path.name}"
+    exists = db.query(UserFile.id).filter(UserFile.user_id == user.id, UserFile.relative_path == relative_path).first()
+    if exists:
+        raise _target_exists()
+    return parent, name, relative_path
 
-def get_thumbnail_path(file_path: Path, user_username: str) -> str:
-    if file_path.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-        return create_thumbnail(file_path, user_username)
-    else:
-        return f"{BASE_URL}/path/to/default/icon.png"
+def _target_exists() -> HTTPException:
+    return HTTPException(status_code=400, detail="An item with this name already exists in the specified location")
 
-def upload_file(db: Session, user: User, file: UploadFile, folder_id: Optional[int] = None) -> FileSchema:
+def move_folder(db: Session, user: User, folder_id: int, target: FolderTarget) -> FolderSchema:
+    folder = _get_folder(db, user, folder_id)
+    subtree = subtree_ids(user, folder.id)
+    if target.parent and db.query(UserFile.id).filter(UserFile.id == target.parent, UserFile.id.in_(subtree)).first():
+        raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
+
+    parent, name, relative_path = _resolve_target(db, user, folder, target)
+    old_path = get_absolute_path(user, folder.relative_path)
+    new_path = get_absolute_path(user, relative_path)
+    old_prefix = folder.relative_path
+
+    # Every descendant's path shares the folder's prefix, so one UPDATE rewrites the whole subtree.
+    db.query(UserFile).filter(UserFile.id.in_(subtree)).update(
+        {UserFile.relative_path: relative_path + func.substr(UserFile.relative_path, len(old_prefix) + 1)},
+        synchronize_session=False
+    )
+    db.query(UserFile).filter(UserFile.id == folder.id).update(
+        {UserFile.filename: name, UserFile.parent_id: parent.id if parent else None, UserFile.updated_at: datetime.utcnow()},
+        synchronize_session=False
+    )
+    search.rename(db, [
+        (row.id, user.id, row.filename, row.relative_path)
+        for row in db.query(UserFile.id, UserFile.filename, UserFile.relative_path).filter(UserFile.id.in_(subtree))
+    ])
+
+    new_path.parent.mkdir(parents=True, exist_ok=True)
+    if old_path.exists():
+        old_path.rename(new_path)
+    try:
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        if new_path.exists():
+            new_path.rename(old_path)
+        if isinstance(exc, IntegrityError):
+            raise _target_exists()
+        raise
+
+    return FolderSchema(id=folder.id, name=name, parent=parent.id if parent else None)
+
+def copy_folder(db: Session, user: User, folder_id: int, target: FolderTarget) -> FolderSchema:
+    folder = _get_folder(db, user, folder_id)
+    parent, name, relative_path = _resolve_target(db, user, folder, target)
+
+    rows = db.query(UserFile).filter(UserFile.id.in_(subtree_ids(user, folder.id))).all()
+    old_prefix = folder.relative_path
+    now = datetime.utcnow()
+    copies = {}
+    for row in rows:
+        copies[row.id] = UserFile(
+            user_id=user.id,
+            filename=name if row.id == folder.id else row.filename,
+            relative_path=relative_path + row.relative_path[len(old_prefix):],
+            is_folder=row.is_folder,
+            size=row.size,
+            mime_type=row.mime_type,
+            sha256=row.sha256,
+            etag=row.etag,
+            blob_sha=row.blob_sha,
+            created_at=now,
+            updated_at=now
+        )
+    for row in rows:
+        if row.id == folder.id:
+            copies[row.id].parent_id = parent.id if parent else None
+        else:
+            copies[row.id].parent = copies[row.parent_id]
+
+    copied = [row for row in rows if not row.is_folder]
+    quotas.charge(db, user, sum(row.size or 0 for row in copied), len(copied))
+    # Blob rows are copied by reference; only rows from before the blob store are copied on disk.
+    blob_store.acquire(db, [(row.blob_sha, row.size) for row in rows if row.blob_sha])
+    source_path = get_absolute_path(user, folder.relative_path)
+    if source_path.exists():
+        shutil.copytree(source_path, get_absolute_path(user, relative_path), dirs_exist_ok=True)
+    db.add_all(copies.values())
+    try:
+        db.flush()
+        search.copy(db, [(row.id, copies[row.id].id, user.id, copies[row.id].filename, copies[row.id].relative_path) for row in rows])
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        reaper.enqueue(get_absolute_path(user, relative_path))
+        if isinstance(exc, IntegrityError):
+            raise _target_exists()
+        raise
+
+    root = copies[folder.id]
+    return FolderSchema(id=root.id, name=root.filename, parent=root.parent_id)
+
+def get_folder_size(db: Session, user: User, folder_id: int) -> FolderSize:
+    folder = _get_folder(db, user, folder_id)
+    size, files, folders = db.query(
+        func.coalesce(func.sum(UserFile.size), 0),
+        func.count(UserFile.id).filter(UserFile.is_folder == False),
+        func.count(UserFile.id).filter(UserFile.is_folder == True)
+    ).filter(UserFile.id.in_(subtree_ids(user, folder.id)), UserFile.id != folder.id).one()
+    return FolderSize(id=folder.id, size=size, files=files, folders=folders)
+
+def list_files(db: Session, user: User, folder_id: Optional[int], params: ListQuery) -> ORJSONResponse:
+    return listing_response(*file_listing(db, user, folder_id, params), params)
+
+def file_listing(db: Session, user: User, folder_id: Optional[int], params: ListQuery) -> Tuple[List[dict], Optional[str]]:
+    files, next_cursor = _listing(db, user, folder_id, False, params, FILE_COLUMNS)
+
+    # Rows uploaded before the thumbnail cache existed are rendered once, in the background,
+    # and so are rows whose render was lost with its worker.
+    unrendered = [
+        file.id for file in files
+        if file.sha256 and thumbnails.is_image(file.filename) and (not file.thumbnail_key or thumbnails.is_stuck(file))
+    ]
+    if unrendered:
+        scheduled = [
+            file for file in db.query(UserFile).filter(UserFile.id.in_(unrendered))
+            if thumbnails.schedule_thumbnail(user.username, file, None)
+        ]
+        if scheduled:
+            db.commit()
+            for file in scheduled:
+                thumbnails.submit(user.username, file, content_path(user, file))
+            updated = {file.id: file for file in scheduled}
+            files = [updated.get(file.id, file) for file in files]
+
+    return [file_item(user.username, file) for file in files], next_cursor
+
+def file_item(username: str, file: UserFile) -> dict:
+    """The FileSchema fields of a file, from its ORM object or a row of FILE_COLUMNS."""
+    thumbnail, links = thumbnails.thumbnail_links(username, file)
+    return {
+        "id": file.id,
+        "name": file.filename,
+        "url": f"{FILES_URL}/{file.id}/download",
+        "size": file.size or 0,
+        "mime_type": file.mime_type,
+        "etag": file.etag,
+        "folder": file.parent_id,
+        "thumbnail": thumbnail,
+        "thumbnail_status": file.thumbnail_status,
+        "thumbnails": links,
+    }
+
+def file_schema(user: User, file: UserFile) -> FileSchema:
+    return FileSchema(**file_item(user.username, file))
+
+def guess_mime_type(filename: str, fallback: Optional[str] = None) -> str:
+    return mimetypes.guess_type(filename)[0] or fallback or "application/octet-stream"
+
+def make_etag(sha256: str) -> str:
+    return f'"{sha256[:32]}"'
+
+def upload_target(db: Session, user: User, filename: str, folder_id: Optional[int] = None) -> str:
     parent = None
     if folder_id:
         parent = db.query(UserFile).filter(UserFile.id == folder_id, UserFile.user_id == user.id, UserFile.is_folder == True).first()
         if not parent:
             raise HTTPException(status_code=404, detail="Parent folder not found")
 
-    relative_path = file.filename if not parent else str(Path(parent.relative_path) / file.filename)
+    return filename if not parent else str(Path(parent.relative_path) / filename)
 
-    new_file = UserFile(
-        user_id=user.id,
-        filename=file.filename,
-        relative_path=relative_path,
-        is_folder=False,
-        parent_id=folder_id,
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow()
-    )
-
-    db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+def upload_file(db: Session, user: User, file: UploadFile, folder_id: Optional[int] = None) -> FileSchema:
+    relative_path = upload_target(db, user, file.filename, folder_id)
+    quotas.check(db, user, file.size or 0)
 
-    absolute_path = get_absolute_path(user, relative_path)
-    with absolute_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Hashed into a temporary file first; the bytes are only kept if the store does not have them yet.
+    source, size, sha256 = blob_store.receive(file.file)
+    try:
+        return store_file(db, user, file.filename, folder_id, relative_path, source, size, sha256, file.content_type)
+    finally:
+        source.unlink(missing_ok=True)
+
+def store_file(db: Session, user: User, filename: str, folder_id: Optional[int], relative_path: str,
+               source: Path, size: int, sha256: str, content_type: Optional[str] = None,
+               retry: bool = True) -> FileSchema:
+    """Create or update the row for bytes already written to `source`, a file the caller removes.
+
+    The blob is linked into the store before the row is committed, so
+    concurrent listings never see a row without its bytes. If a concurrent
+    upload inserted the same path first, the unique index rejects this
+    insert and the upload is retried once as an update.
+    """
+    new_file = db.query(UserFile).filter(
+        UserFile.user_id == user.id,
+        UserFile.relative_path == relative_path,
+        UserFile.is_folder == False
+    ).first()
 
-    thumbnail_path = get_thumbnail_path(absolute_path, user.username)
+    # Counted before anything else changes, so an upload over the quota leaves nothing behind.
+    previous_size = (new_file.size or 0) if new_file else 0
+    quotas.charge(db, user, size - previous_size, 0 if new_file else 1)
+
+    previous_blob, legacy_path = None, None
+    if new_file:
+        # Re-upload over an existing file: the cached thumbnail is stale.
+        thumbnails.remove_thumbnail(user.username, new_file)
+        new_file.updated_at = datetime.utcnow()
+        previous_blob = new_file.blob_sha
+        if not previous_blob:
+            legacy_path = get_absolute_path(user, relative_path)
+    else:
+        new_file = UserFile(
+            user_id=user.id,
+            filename=filename,
+            relative_path=relative_path,
+            is_folder=False,
+            parent_id=folder_id,
+            created_at=datetime.utcnow(),
+            updated_at=datetime.utcnow()
+        )
+        db.add(new_file)
+
+    new_file.size = size
+    new_file.sha256 = sha256
+    new_file.etag = make_etag(sha256)
+    new_file.mime_type = guess_mime_type(filename, content_type)
+    new_file.blob_sha = sha256
+
+    if previous_blob != sha256:
+        blob_store.release(db, [previous_blob])
+        blob_store.acquire(db, [(sha256, size)])
+    blob_store.place(source, sha256)
+    absolute_path = blob_store.blob_path(sha256)
+    thumbnails.schedule_thumbnail(user.username, new_file, absolute_path)
+    content = search.extract_text(source)
+    try:
+        db.flush()
+        search.index(db, [(new_file.id, user.id, filename, relative_path, content)])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if not retry:
+            raise HTTPException(status_code=400, detail="A folder with this name already exists in the specified location")
+        return store_file(db, user, filename, folder_id, relative_path, source, size, sha256, content_type, retry=False)
+    db.refresh(new_file)
+    if legacy_path:
+        reaper.enqueue(legacy_path)
+    thumbnails.submit(user.username, new_file, absolute_path)
 
-    return FileSchema(
-        id=new_file.id,
-        name=new_file.filename,
-        url=f"{BASE_URL}/api/files/{new_file.id}/download",
-        size=absolute_path.stat().st_size,
-        folder=new_file.parent_id,
-        thumbnail=thumbnail_path
-    )
+    return file_schema(user, new_file)
 
 def delete_file(db: Session, user: User, file_id: int):
     file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == user.id, UserFile.is_folder == False).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    absolute_path = get_absolute_path(user, file.relative_path)
-    thumbnail_path = Path(THUMBNAIL_DIR) / user.username / f"th_{absolute_path.stem}.webp"
+    reap = thumbnails.thumbnail_files(user.username, file)
+    if not file.blob_sha:
+        reap.append(get_absolute_path(user, file.relative_path))
 
+    search.remove(db, [file.id])
     db.delete(file)
+    blob_store.release(db, [file.blob_sha])
+    quotas.charge(db, user, -(file.size or 0), -1)
     db.commit()
 
-    absolute_path.unlink(missing_ok=True)
-    thumbnail_path.unlink(missing_ok=True)
-  
-def delete_recursive(db: Session, item: UserFile):
-    for child in item.children:
-        delete_recursive(db, child)
-        db.delete(child)
-        
-def download_file(db: Session, user: User, file_id: int):
+    reaper.enqueue(*reap)
+
+def download_file(db: Session, user: User, file_id: int, request_headers: Optional[Headers] = None):
     file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == user.id).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    absolute_path = get_absolute_path(user, file.relative_path)
+    if request_headers is not None and http_cache.is_not_modified(request_headers, file.etag, file.updated_at):
+        return http_cache.not_modified_response(file.etag, file.updated_at, http_cache.REVALIDATE_CACHE_CONTROL)
+
+    absolute_path = content_path(user, file)
     if not absolute_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
-    return FileResponse(
+    return http_cache.ChecksumFileResponse(
         path=absolute_path, 
         filename=file.filename, 
-        media_type='application/octet-stream'
+        media_type='application/octet-stream',
+        etag=file.etag,
+        last_modified=file.updated_at
     )
 
-def read_file_content(db: Session, file_id: int):
-    file = db.query(UserFile).filter(UserFile.id == file_id).first()
+def read_file_content(db: Session, user: User, file_id: int, params: ReadQuery = ReadQuery(), accept_encoding: str = ""):
+    file = db.query(UserFile).filter(UserFile.id == file_id, UserFile.user_id == user.id, UserFile.is_folder == False).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    absolute_path=Path(BASE_FOLDER_DIR) / 'admin' / file.relative_path # hardcoded by now
-   
-    try:
-        with open(absolute_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return {"id": file.id, "name": file.filename, "content": content}
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="File is not a text file")
\ No newline at end of file
+    # Copies of one blob share a content cache entry; older rows are cached by file id.
+    absolute_path = content_path(user, file)
+    return text_reader.read_response(file.id, file.filename, absolute_path, params, accept_encoding, cache_id=file.blob_sha)
@@ -0,0 +1,78 @@
+"""
+Conditional GET, range and caching helpers for file and thumbnail responses.
+"""
+
+import os
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from fastapi.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return formatdate(value.timestamp(), usegmt=True)
+
+def is_not_modified(request_headers: Headers, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    """RFC 9110 evaluation of If-None-Match, falling back to If-Modified-Since."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def not_modified_response(etag: Optional[str], last_modified: Optional[datetime], cache_control: str) -> Response:
+    headers = {"cache-control": cache_control}
+    if etag:
+        headers["etag"] = etag
+    if last_modified:
+        headers["last-modified"] = http_date(last_modified)
+    return Response(status_code=304, headers=headers)
+
+
+class ChecksumFileResponse(FileResponse):
+    """FileResponse (with Range/206 support) whose ETag comes from the stored checksum."""
+
+    def __init__(self, path, etag: Optional[str] = None, last_modified: Optional[datetime] = None,
+                 cache_control: str = REVALIDATE_CACHE_CONTROL, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["cache-control"] = cache_control
+        if etag:
+            headers["etag"] = etag
+        if last_modified:
+            headers["last-modified"] = http_date(last_modified)
+        super().__init__(path, headers=headers, **kwargs)
+        self.checksum_etag = etag
+
+    def _should_use_range(self, http_if_range: str, stat_result: os.stat_result) -> bool:
+        # If-Range must be compared with the ETag actually sent, not Starlette's stat-based one.
+        if self.checksum_etag is not None:
+            return http_if_range == self.checksum_etag or http_if_range == self.headers.get("last-modified")
+        return super()._should_use_range(http_if_range, stat_result)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-addressed names: responses never change, so clients may cache forever."""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -2,28 +2,66 @@
 The main FastAPI application file containing all endpoints.
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request
+from pydantic import TypeAdapter, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from database import get_db, create_tables
-from models import User
-from schemas import FileSchema, FolderSchema, FolderCreate, Token, UserCreate, UserOut
+from typing import List, Optional, Union
+from database import get_db, run_migrations
+from schemas import FileSchema, FolderSchema, FolderCreate, Token, UserCreate, UserOut, UserUpdate, ListQuery, FilePage, FolderPage, UserPage, FolderTarget, FolderSize, UploadInit, UploadStatus, ReadQuery, BatchOperation, BatchResult, StorageUsage, StoragePage, SearchPage
 import file_operations
-from auth import get_current_active_user, create_access_token, create_refresh_token, RoleChecker
+import thumbnails
+import password_utils
+import reaper
+import blob_store
+import uploads
+import batch_operations
+import archive
+import token_sweeper
+import quotas
+import reconciler
+import query_stats
+import metrics
+import profiling
+import vk_auth
+import text_reader
+import search
+from auth import get_current_active_user, create_access_token, create_refresh_token, decode_token, load_user, RoleChecker, oauth2_scheme
 import user_operations
-from vk_auth import vk_callback, vk_login
+from user_cache import CachedUser, user_cache
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from config import THUMBNAIL_DIR, CORS_ORIGINS
-from fastapi.responses import FileResponse
+from http_cache import ImmutableStaticFiles
+from config import THUMBNAIL_DIR, CORS_ORIGINS, THREAD_POOL_SIZE, METRICS_ENABLED, MIGRATE_ON_STARTUP
+from anyio import to_thread
 
 async def lifespan(app: FastAPI):
-    create_tables()
+    # Sync endpoints and dependencies (DB sessions, disk I/O, PIL, bcrypt) run on this pool.
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    # serve.py migrates once before starting workers and turns this off for them.
+    if MIGRATE_ON_STARTUP:
+        run_migrations()
+    thumbnails.start_pipeline()
+    password_utils.start_pool()
+    reaper.start()
+    token_sweeper.start()
+    blob_store.start()
+    quotas.start()
+    reconciler.start()
     yield
+    await reconciler.stop()
+    await vk_auth.stop()
+    await quotas.stop()
+    await blob_store.stop()
+    await token_sweeper.stop()
+    reaper.stop()
+    password_utils.stop_pool()
+    thumbnails.stop_pipeline()
+    metrics.stop()
+
+BATCH_OPERATIONS = TypeAdapter(List[BatchOperation])
 
 app = FastAPI(root_path="/api", lifespan=lifespan)
-app.mount("/thumbnails", StaticFiles(directory=THUMBNAIL_DIR), name="thumbnails")
+app.mount("/thumbnails", ImmutableStaticFiles(directory=THUMBNAIL_DIR), name="thumbnails")
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,16 +71,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(query_stats.QueryStatsMiddleware)
+app.add_middleware(profiling.ProfilerMiddleware)
+# Added last, so it is outermost and times everything above.
+app.add_middleware(metrics.MetricsMiddleware)
+
 @app.get("/hello")
 def hello_func():
     return "Hello World"
 
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def read_metrics():
+        return metrics.response()
+
 @app.get("/data")
 def get_data(_: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
     return {"data": "This is important data"}
 
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = user_operations.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
@@ -50,22 +98,35 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(data={"sub": user.username, "role": user.role})
     refresh_token = create_refresh_token(data={"sub": user.username, "role": user.role})
     
-    user_operations.create_refresh_token(db, user.id, refresh_token)
+    user_operations.create_refresh_token(db, user.id, refresh_token, request.headers.get("user-agent"))
     
     return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
 @app.post("/refresh", response_model=Token)
-async def refresh_access_token(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+def refresh_access_token(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    current_user = load_user(decode_token(token, refresh=True))
+    if current_user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+
     access_token = create_access_token(data={"sub": current_user.username, "role": current_user.role})
     refresh_token = create_refresh_token(data={"sub": current_user.username, "role": current_user.role})
 
-    user_operations.delete_refresh_token(db, current_user.id)
-    user_operations.create_refresh_token(db, current_user.id, refresh_token)
+    # Only the presented token is rotated, so sessions on the user's other devices stay valid.
+    if not user_operations.rotate_refresh_token(db, current_user.id, token, refresh_token, request.headers.get("user-agent")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token is invalid or has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user_operations.revoke_refresh_token(db, token)
+
 @app.post("/users", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-async def create_new_user(
+def create_new_user(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
@@ -79,59 +140,156 @@ async def create_new_user(
     return user_operations.create_user(db=db, user=user)
 
 @app.get("/users/me", response_model=UserOut)
-async def read_users_me(current_user: User = Depends(get_current_active_user)):
+async def read_users_me(current_user: CachedUser = Depends(get_current_active_user)):
     return current_user
 
-@app.get("/users", response_model=List[UserOut])
-async def read_users(db: Session = Depends(get_db), _: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
+@app.get("/users", response_model=Union[UserPage, List[UserOut]])
+def read_users(params: ListQuery = Depends(), db: Session = Depends(get_db), _: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
+    if params.paginated:
+        return user_operations.get_users_page(db, params)
     return user_operations.get_users(db)
 
-@app.get("/folders", response_model=List[FolderSchema])
-async def list_folders(parent: Optional[int] = None, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    return file_operations.get_folders(db, current_user, parent)
+@app.patch("/users/{user_id}", response_model=UserOut)
+def update_user(user_id: int, update: UserUpdate, db: Session = Depends(get_db), _: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
+    quota = update.quota_bytes if "quota_bytes" in update.model_fields_set else ...
+    user = user_operations.update_user(db, user_id, role=update.role, disabled=update.disabled, quota_bytes=quota)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@app.get("/users/me/storage", response_model=StorageUsage)
+def read_my_storage(current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return quotas.get_usage(db, current_user)
+
+@app.get("/admin/storage", response_model=StoragePage)
+def read_top_consumers(
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    _: bool = Depends(RoleChecker(allowed_roles=["admin"]))
+):
+    return quotas.top_consumers(db, limit, cursor)
+
+@app.get("/admin/user-cache")
+async def read_user_cache_stats(_: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
+    return user_cache.stats()
+
+@app.get("/admin/content-cache")
+async def read_content_cache_stats(_: bool = Depends(RoleChecker(allowed_roles=["admin"]))):
+    return text_reader.content_cache.stats()
+
+@app.get("/folders", response_model=Union[FolderPage, List[FolderSchema]])
+def list_folders(parent: Optional[int] = None, params: ListQuery = Depends(), current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.list_folders(db, current_user, parent, params)
 
 @app.post("/folders", response_model=FolderSchema, status_code=status.HTTP_201_CREATED)
-async def create_folder(folder: FolderCreate, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+def create_folder(folder: FolderCreate, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
     return file_operations.create_folder(db, current_user, folder.name, folder.parent)
 
 @app.delete("/folders/{folder_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_folder(folder_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+def delete_folder(folder_id: int, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
     file_operations.delete_folder(db, current_user, folder_id)
     return {"status": "success"}
 
-@app.get("/files", response_model=List[FileSchema])
-async def list_files(folder: Optional[int] = None, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    return file_operations.get_files(db, current_user, folder)
+@app.post("/folders/{folder_id}/move", response_model=FolderSchema)
+def move_folder(folder_id: int, target: FolderTarget, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.move_folder(db, current_user, folder_id, target)
+
+@app.post("/folders/{folder_id}/copy", response_model=FolderSchema, status_code=status.HTTP_201_CREATED)
+def copy_folder(folder_id: int, target: FolderTarget, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.copy_folder(db, current_user, folder_id, target)
+
+@app.get("/folders/{folder_id}/size", response_model=FolderSize)
+def folder_size(folder_id: int, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.get_folder_size(db, current_user, folder_id)
+
+@app.get("/folders/{folder_id}/archive")
+def folder_archive(folder_id: int, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return archive.archive_folder(db, current_user, folder_id)
+
+@app.get("/search", response_model=SearchPage)
+def search_files(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    return search.search(db, current_user, q, limit, cursor)
+
+@app.get("/files", response_model=Union[FilePage, List[FileSchema]])
+def list_files(folder: Optional[int] = None, params: ListQuery = Depends(), current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.list_files(db, current_user, folder, params)
 
 @app.post("/files", response_model=FileSchema)
-async def upload_file(
+def upload_file(
     file: UploadFile,
     folder: Optional[int] = Form(None),
-    current_user: User = Depends(get_current_active_user),
+    current_user: CachedUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     return file_operations.upload_file(db, current_user, file, folder)
 
+@app.post("/files/batch", response_model=BatchResult)
+def batch_files(
+    files: List[UploadFile] = File([]),
+    folder: Optional[int] = Form(None),
+    operations: str = Form("[]"),
+    current_user: CachedUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        parsed = BATCH_OPERATIONS.validate_json(operations)
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.errors(include_url=False))
+    return batch_operations.run_batch(db, current_user, files, folder, parsed)
+
+@app.post("/uploads", response_model=UploadStatus, status_code=status.HTTP_201_CREATED)
+def create_upload(init: UploadInit, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return uploads.create_session(db, current_user, init)
+
+@app.get("/uploads/{upload_id}", response_model=UploadStatus)
+def read_upload(upload_id: str, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return uploads.get_status(db, current_user, upload_id)
+
+@app.put("/uploads/{upload_id}", response_model=UploadStatus)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: CachedUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    return await uploads.write_chunk(db, current_user, upload_id, offset, request.stream())
+
+@app.post("/uploads/{upload_id}/complete", response_model=FileSchema)
+def complete_upload(upload_id: str, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return uploads.complete(db, current_user, upload_id)
+
+@app.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+def abort_upload(upload_id: str, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    uploads.abort(db, current_user, upload_id)
+
 @app.delete("/files/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_file(file_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+def delete_file(file_id: int, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
     file_operations.delete_file(db, current_user, file_id)
     return {"status": "success"}
 
 @app.get("/files/{file_id}/download")
-async def download_file(file_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    return file_operations.download_file(db, current_user, file_id)
+def download_file(file_id: int, request: Request, current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.download_file(db, current_user, file_id, request.headers)
 
 @app.get("/files/{file_id}/read")
-async def read_file(file_id: int, db: Session = Depends(get_db)):
-    return file_operations.read_file_content(db, file_id)
+def read_file(file_id: int, request: Request, params: ReadQuery = Depends(), current_user: CachedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    return file_operations.read_file_content(db, current_user, file_id, params, request.headers.get("accept-encoding", ""))
 
 @app.get("/login/vk")
 async def login_vk_route():
-    return vk_login()
+    return vk_auth.vk_login()
 
 @app.get("/vk-callback")
 async def vk_callback_route(code: str, db: Session = Depends(get_db)):
-    return await vk_callback(code, db)
+    return await vk_auth.vk_callback(code, db)
 
 if __name__ == "__main__":
     import uvicorn
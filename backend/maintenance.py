@@ -0,0 +1,184 @@
+"""
+Maintenance commands for existing deployments.
+
+    python maintenance.py backfill-metadata [--verify] [--batch-size N]
+    python maintenance.py migrate-blobs [--batch-size N]
+    python maintenance.py gc-blobs [--orphan-age SECONDS]
+    python maintenance.py reconcile-usage [--batch-size N]
+    python maintenance.py index-search [--batch-size N]
+    python maintenance.py reconcile [--repair [--force]]
+"""
+
+import argparse
+import hashlib
+import logging
+from sqlalchemy.orm import Session, joinedload
+from database import SessionLocal
+from models import UserFile
+import blob_store
+import file_operations
+import quotas
+import reconciler
+import search
+import thumbnails
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_file(path) -> tuple:
+    digest = hashlib.sha256()
+    size = 0
+    with path.open("rb") as f:
+        while chunk := f.read(blob_store.COPY_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+def backfill_file_metadata(db: Session, verify: bool = False, batch_size: int = 500) -> dict:
+    """Fill size, mime_type, sha256 and etag for rows that lack them.
+
+    With `verify` every file row is re-checked against disk and corrected if its
+    size changed. Rows are walked in id order and committed per batch, so the
+    command can be interrupted and re-run.
+    """
+    stats = {"checked": 0, "updated": 0, "missing": 0}
+    last_id = 0
+    while True:
+        query = db.query(UserFile).filter(UserFile.is_folder == False, UserFile.id > last_id)
+        if not verify:
+            query = query.filter(UserFile.sha256 == None)
+        rows = query.order_by(UserFile.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        for row in rows:
+            stats["checked"] += 1
+            path = file_operations.content_path(row.user, row)
+            try:
+                disk_size = path.stat().st_size
+            except FileNotFoundError:
+                logger.warning("File %s is missing on disk: %s", row.id, path)
+                stats["missing"] += 1
+                continue
+            if row.sha256 and row.size == disk_size:
+                continue
+            row.size, row.sha256 = _hash_file(path)
+            row.etag = file_operations.make_etag(row.sha256)
+            row.mime_type = row.mime_type or file_operations.guess_mime_type(row.filename)
+            stats["updated"] += 1
+
+        last_id = rows[-1].id
+        db.commit()
+    return stats
+
+def migrate_to_blobs(db: Session, batch_size: int = 500) -> dict:
+    """Move files still stored under user folders into the blob store.
+
+    Each file is hashed, linked into the store and pointed at its blob; the
+    old copy and its per-user thumbnails are removed after the batch commits.
+    Safe to interrupt and re-run.
+    """
+    stats = {"migrated": 0, "missing": 0}
+    last_id = 0
+    while True:
+        rows = db.query(UserFile).options(joinedload(UserFile.user)).filter(
+            UserFile.is_folder == False, UserFile.blob_sha == None, UserFile.id > last_id
+        ).order_by(UserFile.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        stale = []
+        for row in rows:
+            path = file_operations.get_absolute_path(row.user, row.relative_path)
+            try:
+                size, sha256 = _hash_file(path)
+            except FileNotFoundError:
+                logger.warning("File %s is missing on disk: %s", row.id, path)
+                stats["missing"] += 1
+                continue
+            blob_store.acquire(db, [(sha256, size)])
+            blob_store.place(path, sha256)
+            stale.append(path)
+            stale.extend(thumbnails.thumbnail_files(row.user.username, row))
+            row.size, row.sha256, row.blob_sha = size, sha256, sha256
+            row.etag = file_operations.make_etag(sha256)
+            # Rendered again from the blob, once per content, on the next listing.
+            row.thumbnail_key = row.thumbnail_status = row.thumbnail_queued_at = None
+            stats["migrated"] += 1
+
+        last_id = rows[-1].id
+        db.commit()
+        for path in stale:
+            path.unlink(missing_ok=True)
+    return stats
+
+def index_search(db: Session, batch_size: int = 500) -> dict:
+    """(Re)index every file and folder for search, reading text content from disk.
+
+    Rows are walked in id order and committed per batch, so the command can
+    be interrupted and re-run.
+    """
+    stats = {"indexed": 0, "missing": 0}
+    last_id = 0
+    while True:
+        rows = db.query(UserFile).options(joinedload(UserFile.user)).filter(
+            UserFile.id > last_id
+        ).order_by(UserFile.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        entries = []
+        for row in rows:
+            content = None
+            if not row.is_folder:
+                try:
+                    content = search.extract_text(file_operations.content_path(row.user, row))
+                except FileNotFoundError:
+                    stats["missing"] += 1
+            entries.append((row.id, row.user_id, row.filename, row.relative_path, content))
+        search.index(db, entries)
+        stats["indexed"] += len(entries)
+
+        last_id = rows[-1].id
+        db.commit()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill-metadata", help="fill size/mime/sha256/etag for existing files")
+    backfill.add_argument("--verify", action="store_true", help="re-check every row against disk")
+    backfill.add_argument("--batch-size", type=int, default=500)
+    migrate = commands.add_parser("migrate-blobs", help="move files stored under user folders into the blob store")
+    migrate.add_argument("--batch-size", type=int, default=500)
+    gc = commands.add_parser("gc-blobs", help="collect unreferenced blobs and remove orphaned store files")
+    gc.add_argument("--orphan-age", type=float, default=3600, help="leave store files younger than this alone")
+    usage = commands.add_parser("reconcile-usage", help="recount every user's storage counters from their files")
+    usage.add_argument("--batch-size", type=int, default=500)
+    index = commands.add_parser("index-search", help="index existing files and folders for search")
+    index.add_argument("--batch-size", type=int, default=500)
+    reconcile = commands.add_parser("reconcile", help="check every storage directory against the database and report drift")
+    reconcile.add_argument("--repair", action="store_true", help="also repair what is out of sync")
+    reconcile.add_argument("--force", action="store_true", help="repair even what looks like unmounted storage, without limits")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        if args.command == "backfill-metadata":
+            print(backfill_file_metadata(db, verify=args.verify, batch_size=args.batch_size))
+        elif args.command == "migrate-blobs":
+            print(migrate_to_blobs(db, batch_size=args.batch_size))
+        elif args.command == "gc-blobs":
+            print({"collected": blob_store.collect_once(), "orphans": blob_store.sweep_orphans(db, args.orphan_age)})
+        elif args.command == "reconcile-usage":
+            print({"fixed": quotas.reconcile_all(db, batch_size=args.batch_size)})
+        elif args.command == "index-search":
+            print(index_search(db, batch_size=args.batch_size))
+        elif args.command == "reconcile":
+            print(dict(reconciler.reconcile_all(db, repair=args.repair, force=args.force)))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Prometheus metrics for requests and the work they hand off.
+
+Requests are recorded by a plain ASGI middleware and labelled with the
+route template, so /files/{file_id}/download is one series whatever the
+id. Cache hit counts are read from the caches at scrape time; everything
+else is a counter or histogram updated where the work happens.
+
+Under serve.py with several workers PROMETHEUS_MULTIPROC_DIR is set and
+each worker writes its samples there; a scrape, answered by any worker,
+aggregates all of them. Cache series are the exception: they describe the
+caches of the worker that answered.
+"""
+
+import os
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.responses import Response
+
+# Wide enough for both a cached listing and a large archive.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time from request to the last body byte", ["method", "route"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter("http_requests", "Requests by route and status", ["method", "route", "status"])
+IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum")
+REQUEST_BYTES = Counter("http_request_body_bytes", "Request body bytes received (uploads)", ["route"])
+RESPONSE_BYTES = Counter("http_response_body_bytes", "Response body bytes sent (downloads)", ["route"])
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement time", ["operation"], buckets=QUERY_BUCKETS)
+_query_series = {operation: QUERY_SECONDS.labels(operation) for operation in QUERY_OPERATIONS | {"OTHER"}}
+THUMBNAIL_SECONDS = Histogram("thumbnail_render_seconds", "PIL decode, resize and WebP encode time per image", buckets=LATENCY_BUCKETS)
+THUMBNAIL_FAILURES = Counter("thumbnail_render_failures", "Images that could not be rendered")
+PASSWORD_HASH_SECONDS = Histogram("password_hash_seconds", "bcrypt time including the wait for a pool worker", ["operation"], buckets=LATENCY_BUCKETS)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "Hash jobs turned away with 503 because the pool was full")
+RECONCILE_SECONDS = Histogram("storage_reconcile_round_seconds", "Time per reconciler round", buckets=LATENCY_BUCKETS)
+RECONCILE_DIRECTORIES = Counter("storage_reconcile_directories", "Directories the reconciler listed", ["reason"])
+RECONCILE_FINDINGS = Counter("storage_reconcile_findings", "Files, rows and thumbnails found out of sync with each other", ["kind"])
+
+_caches: Dict[str, Callable[[], dict]] = {}
+# labels() hashes and locks on every call; children are looked up once per route instead.
+_series: Dict[tuple, tuple] = {}
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Expose a cache whose stats() returns hits and misses; read on every scrape."""
+    _caches[name] = stats
+
+class _CacheCollector:
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries held", labels=["cache"])
+        for name, stats in _caches.items():
+            values = stats()
+            hits.add_metric([name], values["hits"])
+            misses.add_metric([name], values["misses"])
+            entries.add_metric([name], values.get("size", values.get("files", 0)))
+        return [hits, misses, entries]
+
+_cache_collector = _CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def observe_query(statement: str, seconds: float):
+    series = _query_series.get(statement.partition(" ")[0].upper()) or _query_series["OTHER"]
+    series.observe(seconds)
+
+def observe_thumbnail(future: Future):
+    """Done-callback for a render job; the worker returns its own elapsed time."""
+    if future.exception() is not None:
+        THUMBNAIL_FAILURES.inc()
+    else:
+        THUMBNAIL_SECONDS.observe(future.result())
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+def _route_series(method: str, route: str, status: int) -> tuple:
+    key = (method, route, status)
+    series = _series.get(key)
+    if series is None:
+        series = _series[key] = (
+            REQUEST_SECONDS.labels(method, route), REQUESTS.labels(method, route, str(status)),
+            REQUEST_BYTES.labels(route), RESPONSE_BYTES.labels(route),
+        )
+    return series
+
+def response() -> Response:
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_cache_collector)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def stop():
+    """Drop this worker's live gauges from the shared samples when it exits."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status, received, sent = 500, 0, 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        IN_PROGRESS.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_PROGRESS.dec()
+            # The router has filled in the matched route by now.
+            seconds, requests, request_bytes, response_bytes = _route_series(scope["method"], route_label(scope), status)
+            seconds.observe(time.perf_counter() - started)
+            requests.inc()
+            if received:
+                request_bytes.inc(received)
+            if sent:
+                response_bytes.inc(sent)
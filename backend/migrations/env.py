@@ -0,0 +1,38 @@
+"""
+Alembic environment: runs migrations against the application's engine.
+"""
+
+from logging.config import fileConfig
+from alembic import context
+from database import Base, engine
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+if context.config.config_file_name is not None and context.config.attributes.get("configure_logger", True):
+    fileConfig(context.config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        # Batch mode lets ALTER-style operations work on SQLite by copying the table.
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,59 @@
+"""Baseline schema, as created by create_tables() before migrations existed
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String()),
+        sa.Column("email", sa.String()),
+        sa.Column("hashed_password", sa.String()),
+        sa.Column("role", sa.String()),
+        sa.Column("disabled", sa.Boolean()),
+        sa.Column("vk_id", sa.String(), nullable=True, unique=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "refresh_tokens",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("token", sa.String()),
+        sa.Column("expires_at", sa.DateTime()),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_refresh_tokens_id", "refresh_tokens", ["id"])
+    op.create_index("ix_refresh_tokens_token", "refresh_tokens", ["token"], unique=True)
+
+    op.create_table(
+        "user_files",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("filename", sa.String()),
+        sa.Column("relative_path", sa.String()),
+        sa.Column("is_folder", sa.Boolean()),
+        sa.Column("parent_id", sa.Integer(), sa.ForeignKey("user_files.id"), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.create_index("ix_user_files_id", "user_files", ["id"])
+
+
+def downgrade():
+    op.drop_table("user_files")
+    op.drop_table("refresh_tokens")
+    op.drop_table("users")
@@ -0,0 +1,112 @@
+"""File metadata and thumbnail columns, hashed refresh-token store, upload sessions
+
+These columns and tables were added to the models before the project had
+migrations: thumbnail_key/thumbnail_status with the thumbnail cache,
+size/mime_type/sha256/etag with file metadata, upload_sessions with
+resumable uploads and the refresh-token columns with the token store.
+create_tables() added them to existing tables back then, so a database from
+that time is stamped at 0001 with some or all of them already in place.
+Every step checks what already exists.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+USER_FILE_COLUMNS = [
+    sa.Column("size", sa.BigInteger(), nullable=True),
+    sa.Column("mime_type", sa.String(), nullable=True),
+    sa.Column("sha256", sa.String(64), nullable=True),
+    sa.Column("etag", sa.String(), nullable=True),
+    sa.Column("thumbnail_key", sa.String(), nullable=True),
+    sa.Column("thumbnail_status", sa.String(), nullable=True),
+]
+
+
+def _columns(table):
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table):
+    return {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    existing = _columns("user_files")
+    with op.batch_alter_table("user_files") as batch:
+        for column in USER_FILE_COLUMNS:
+            if column.name not in existing:
+                batch.add_column(column.copy())
+
+    existing = _columns("refresh_tokens")
+    with op.batch_alter_table("refresh_tokens") as batch:
+        for column in (
+            sa.Column("token_hash", sa.String(64), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.Column("device", sa.String(), nullable=True),
+        ):
+            if column.name not in existing:
+                batch.add_column(column)
+
+    if "token" in existing:
+        # Keep existing sessions valid: store the hash of each plaintext token, then drop the plaintext.
+        bind = op.get_bind()
+        tokens = sa.table("refresh_tokens", sa.column("id"), sa.column("token"), sa.column("token_hash"))
+        for row in bind.execute(sa.select(tokens.c.id, tokens.c.token).where(tokens.c.token != None)).fetchall():
+            bind.execute(
+                tokens.update().where(tokens.c.id == row.id).values(token_hash=hashlib.sha256(row.token.encode()).hexdigest())
+            )
+        indexes = _indexes("refresh_tokens")
+        with op.batch_alter_table("refresh_tokens") as batch:
+            if "ix_refresh_tokens_token" in indexes:
+                batch.drop_index("ix_refresh_tokens_token")
+            batch.drop_column("token")
+
+    indexes = _indexes("refresh_tokens")
+    if "ix_refresh_tokens_token_hash" not in indexes:
+        op.create_index("ix_refresh_tokens_token_hash", "refresh_tokens", ["token_hash"], unique=True)
+    if "ix_refresh_tokens_expires_at" not in indexes:
+        op.create_index("ix_refresh_tokens_expires_at", "refresh_tokens", ["expires_at"])
+
+    if not sa.inspect(op.get_bind()).has_table("upload_sessions"):
+        op.create_table(
+            "upload_sessions",
+            sa.Column("id", sa.String(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+            sa.Column("folder_id", sa.Integer(), sa.ForeignKey("user_files.id", ondelete="CASCADE"), nullable=True),
+            sa.Column("filename", sa.String()),
+            sa.Column("content_type", sa.String(), nullable=True),
+            sa.Column("size", sa.BigInteger(), nullable=True),
+            sa.Column("received", sa.BigInteger()),
+            sa.Column("created_at", sa.DateTime()),
+            sa.Column("expires_at", sa.DateTime()),
+        )
+        op.create_index("ix_upload_sessions_expires_at", "upload_sessions", ["expires_at"])
+
+
+def downgrade():
+    op.drop_table("upload_sessions")
+
+    op.drop_index("ix_refresh_tokens_expires_at", "refresh_tokens")
+    op.drop_index("ix_refresh_tokens_token_hash", "refresh_tokens")
+    # Plaintext tokens cannot be recovered from their hashes; every session has to log in again.
+    op.execute("DELETE FROM refresh_tokens")
+    with op.batch_alter_table("refresh_tokens") as batch:
+        batch.drop_column("device")
+        batch.drop_column("created_at")
+        batch.drop_column("token_hash")
+        batch.add_column(sa.Column("token", sa.String()))
+    op.create_index("ix_refresh_tokens_token", "refresh_tokens", ["token"], unique=True)
+
+    with op.batch_alter_table("user_files") as batch:
+        for column in reversed(USER_FILE_COLUMNS):
+            batch.drop_column(column.name)
@@ -0,0 +1,64 @@
+"""Composite and unique indexes for the user_files access patterns
+
+- (user_id, parent_id, is_folder, filename, id) serves folder listings,
+  including the keyset pagination order.
+- unique (user_id, relative_path) serves path lookups and makes the
+  database, not a racy pre-check, reject duplicate paths.
+- parent_id serves the recursive subtree CTE.
+
+The old upload code could leave several rows with one path. They point
+at the same file on disk, so which of them to keep is for an administrator
+to decide: the upgrade stops and logs every such path with the ids of its
+rows. Delete or fix the extra rows (moving any children of a folder row
+under the one kept) and run it again; this revision changes nothing until
+then.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def _check_duplicate_paths():
+    bind = op.get_bind()
+    files = sa.table("user_files", sa.column("id"), sa.column("user_id"), sa.column("relative_path"))
+    duplicates = bind.execute(
+        sa.select(files.c.user_id, files.c.relative_path)
+        .group_by(files.c.user_id, files.c.relative_path)
+        .having(sa.func.count() > 1)
+        .order_by(files.c.user_id, files.c.relative_path)
+    ).fetchall()
+    for user_id, relative_path in duplicates:
+        ids = bind.scalars(
+            sa.select(files.c.id).where(files.c.user_id == user_id, files.c.relative_path == relative_path).order_by(files.c.id)
+        ).all()
+        logger.error("Duplicate path: user %s, %r, user_files rows %s", user_id, relative_path, ids)
+    if duplicates:
+        raise RuntimeError(
+            f"user_files has {len(duplicates)} duplicated path(s), listed above. "
+            "Keep one row per path, then run the upgrade again."
+        )
+
+
+def upgrade():
+    _check_duplicate_paths()
+    op.create_index("ix_user_files_listing", "user_files", ["user_id", "parent_id", "is_folder", "filename", "id"])
+    op.create_index("uq_user_files_user_path", "user_files", ["user_id", "relative_path"], unique=True)
+    op.create_index("ix_user_files_parent_id", "user_files", ["parent_id"])
+
+
+def downgrade():
+    op.drop_index("ix_user_files_parent_id", "user_files")
+    op.drop_index("uq_user_files_user_path", "user_files")
+    op.drop_index("ix_user_files_listing", "user_files")
@@ -0,0 +1,44 @@
+"""Content-addressed blob store
+
+- blobs holds one row per distinct SHA-256 with the number of user_files
+  rows referring to it; refcount is indexed for the background collector.
+- user_files.blob_sha points a file row at its blob. Existing rows keep
+  NULL and are read from the user's folder until
+  `python maintenance.py migrate-blobs` moves their bytes into the store.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "blobs",
+        sa.Column("sha256", sa.String(64), primary_key=True),
+        sa.Column("size", sa.BigInteger()),
+        sa.Column("refcount", sa.Integer()),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_index("ix_blobs_refcount", "blobs", ["refcount"])
+    with op.batch_alter_table("user_files") as batch:
+        batch.add_column(sa.Column("blob_sha", sa.String(64), nullable=True))
+        batch.create_foreign_key("fk_user_files_blob_sha", "blobs", ["blob_sha"], ["sha256"])
+        batch.create_index("ix_user_files_blob_sha", ["blob_sha"])
+
+
+def downgrade():
+    with op.batch_alter_table("user_files") as batch:
+        batch.drop_index("ix_user_files_blob_sha")
+        batch.drop_constraint("fk_user_files_blob_sha", type_="foreignkey")
+        batch.drop_column("blob_sha")
+    op.drop_index("ix_blobs_refcount", "blobs")
+    op.drop_table("blobs")
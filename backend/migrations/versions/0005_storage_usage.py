@@ -0,0 +1,39 @@
+"""Per-user storage counters and quotas
+
+- users.used_bytes / users.file_count total the user's file rows and are
+  backfilled here; (used_bytes, id) is indexed for the top-consumers listing.
+- users.quota_bytes overrides STORAGE_QUOTA_BYTES per user.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("used_bytes", sa.BigInteger(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("file_count", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("quota_bytes", sa.BigInteger(), nullable=True))
+    op.execute(
+        "UPDATE users SET "
+        "used_bytes = (SELECT COALESCE(SUM(size), 0) FROM user_files WHERE user_files.user_id = users.id AND is_folder = false), "
+        "file_count = (SELECT COUNT(*) FROM user_files WHERE user_files.user_id = users.id AND is_folder = false)"
+    )
+    op.create_index("ix_users_used_bytes", "users", ["used_bytes", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_users_used_bytes", "users")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("quota_bytes")
+        batch.drop_column("file_count")
+        batch.drop_column("used_bytes")
@@ -0,0 +1,42 @@
+"""Full-text search index
+
+file_search holds one entry per user_files row: user-scoped terms for the
+name, the parent path and the text content (see search.py). On SQLite it
+is an FTS5 table keyed by rowid = user_files.id and ranked by bm25 with
+names weighted above paths above content. On PostgreSQL the terms are
+tsvectors behind a GIN index.
+
+Existing rows are indexed by `python maintenance.py index-search`.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("CREATE VIRTUAL TABLE file_search USING fts5(name, path, body, tokenize=\"unicode61 tokenchars '_'\")")
+        op.execute("INSERT INTO file_search(file_search, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0)')")
+        return
+    op.create_table(
+        "file_search",
+        sa.Column("file_id", sa.Integer(), sa.ForeignKey("user_files.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("names", postgresql.TSVECTOR(), nullable=False),
+        sa.Column("body", postgresql.TSVECTOR(), nullable=False),
+    )
+    op.execute("CREATE INDEX ix_file_search_document ON file_search USING gin ((names || body))")
+
+
+def downgrade():
+    op.drop_table("file_search")
@@ -0,0 +1,31 @@
+"""Reconciler checkpoints
+
+scan_checkpoints keeps, per storage directory, the mtime it had when the
+reconciler last listed it, so later passes only list directories that
+changed since (see reconciler.py).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "scan_checkpoints",
+        sa.Column("path", sa.String(), primary_key=True),
+        sa.Column("mtime_ns", sa.BigInteger(), nullable=False),
+        sa.Column("scanned_at", sa.Float(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("scan_checkpoints")
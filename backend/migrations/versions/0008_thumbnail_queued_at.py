@@ -0,0 +1,29 @@
+"""Thumbnail queue time
+
+user_files.thumbnail_queued_at records when a row went pending, so a row
+whose render was lost with its worker is queued again once it is older
+than THUMBNAIL_PENDING_TIMEOUT_SECONDS. Rows pending before this revision
+have none and are queued again on their next listing.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("user_files") as batch:
+        batch.add_column(sa.Column("thumbnail_queued_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("user_files") as batch:
+        batch.drop_column("thumbnail_queued_at")
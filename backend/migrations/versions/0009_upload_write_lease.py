@@ -0,0 +1,30 @@
+"""Upload write lease
+
+upload_sessions.writer and writer_expires_at hold the lease of the request
+appending to an upload, so chunk requests for one upload are serialized
+across worker processes (see uploads.py).
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("upload_sessions") as batch:
+        batch.add_column(sa.Column("writer", sa.String(), nullable=True))
+        batch.add_column(sa.Column("writer_expires_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("upload_sessions") as batch:
+        batch.drop_column("writer_expires_at")
+        batch.drop_column("writer")
@@ -2,7 +2,7 @@
 ORM models for the database.
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, DateTime, Float, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -16,16 +16,28 @@ class User(Base):
     role = Column(String, default="user")
     disabled = Column(Boolean, default=False)
     vk_id = Column(String, unique=True, nullable=True)
+    # Running totals over the user's file rows, adjusted by every write; see quotas.py.
+    used_bytes = Column(BigInteger, default=0)
+    file_count = Column(Integer, default=0)
+    # NULL falls back to STORAGE_QUOTA_BYTES; 0 means no limit.
+    quota_bytes = Column(BigInteger, nullable=True)
 
     refresh_tokens = relationship("RefreshToken", back_populates="user")
     files = relationship("UserFile", back_populates="user")
 
+    __table_args__ = (
+        Index("ix_users_used_bytes", "used_bytes", "id"),
+    )
+
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
     id = Column(Integer, primary_key=True, index=True)
-    token = Column(String, unique=True, index=True)
-    expires_at = Column(DateTime)
+    # SHA-256 of the token; the token itself is never stored.
+    token_hash = Column(String(64), unique=True, index=True)
+    expires_at = Column(DateTime, index=True)
+    created_at = Column(DateTime)
+    device = Column(String, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"))
 
     user = relationship("User", back_populates="refresh_tokens")
@@ -41,7 +53,61 @@ class UserFile(Base):
     parent_id = Column(Integer, ForeignKey("user_files.id"), nullable=True)
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
+    size = Column(BigInteger, nullable=True)
+    mime_type = Column(String, nullable=True)
+    sha256 = Column(String(64), nullable=True)
+    etag = Column(String, nullable=True)
+    thumbnail_key = Column(String, nullable=True)
+    thumbnail_status = Column(String, nullable=True)
+    thumbnail_queued_at = Column(DateTime, nullable=True)
+    # Content-addressed bytes; NULL for rows still stored under the user's folder.
+    blob_sha = Column(String(64), ForeignKey("blobs.sha256"), nullable=True)
 
     user = relationship("User", back_populates="files")
     parent = relationship("UserFile", remote_side=[id], back_populates="children")
-    children = relationship("UserFile", back_populates="parent")
\ No newline at end of file
+    children = relationship("UserFile", back_populates="parent")
+
+    __table_args__ = (
+        Index("ix_user_files_listing", "user_id", "parent_id", "is_folder", "filename", "id"),
+        Index("uq_user_files_user_path", "user_id", "relative_path", unique=True),
+        Index("ix_user_files_parent_id", "parent_id"),
+        Index("ix_user_files_blob_sha", "blob_sha"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger)
+    # Number of user_files rows pointing here; blobs at zero are collected in the background.
+    refcount = Column(Integer, default=0)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_blobs_refcount", "refcount"),
+    )
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    folder_id = Column(Integer, ForeignKey("user_files.id", ondelete="CASCADE"), nullable=True)
+    filename = Column(String)
+    content_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    received = Column(BigInteger, default=0)
+    created_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+    # Write lease of the request currently appending to the part file, see uploads.py.
+    writer = Column(String, nullable=True)
+    writer_expires_at = Column(DateTime, nullable=True)
+
+class ScanCheckpoint(Base):
+    __tablename__ = "scan_checkpoints"
+
+    # "<root>:<directory relative to it>", see reconciler.py.
+    path = Column(String, primary_key=True)
+    # The directory's mtime when it was last listed; it changes whenever an entry is added or removed.
+    mtime_ns = Column(BigInteger)
+    scanned_at = Column(Float)
@@ -0,0 +1,82 @@
+"""
+Keyset (cursor) pagination helpers for listing endpoints.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Query
+
+# Integer sort values and ids are bound as SQLite's signed 64-bit integers.
+MAX_INT = 2 ** 63 - 1
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"dt": sort_value.isoformat()}
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _valid(value, value_type: type) -> bool:
+    if value_type is int:
+        return type(value) is int and -MAX_INT - 1 <= value <= MAX_INT
+    return isinstance(value, value_type)
+
+def decode_cursor(cursor: str, value_type: Optional[type] = None) -> Tuple[object, int]:
+    """The (sort value, id) position in `cursor`; 400 unless the sort value is None or a `value_type`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        if not isinstance(position, list) or len(position) != 2:
+            raise ValueError(cursor)
+        sort_value, row_id = position
+        if isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value["dt"])
+        if not _valid(row_id, int) or sort_value is not None and value_type and not _valid(sort_value, value_type):
+            raise ValueError(cursor)
+        return sort_value, row_id
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _after(sort_column, id_column, sort_value, row_id: int, descending: bool):
+    """Rows past (sort_value, row_id) in the listing's order.
+
+    A row-value comparison with NULL is NULL, so rows without a sort value
+    are handled apart: they come first in ascending order and last in
+    descending order. paginate() orders them that way explicitly, since
+    PostgreSQL's default is the opposite.
+    """
+    if sort_value is None:
+        nulls_after = id_column < row_id if descending else id_column > row_id
+        null_rows = and_(sort_column == None, nulls_after)
+        return null_rows if descending else or_(null_rows, sort_column != None)
+    key, position = tuple_(sort_column, id_column), tuple_(sort_value, row_id)
+    return or_(key < position, sort_column == None) if descending else key > position
+
+def paginate(query: Query, sort_column, id_column, limit: Optional[int] = None,
+             cursor: Optional[str] = None, descending: bool = False) -> Tuple[list, Optional[str]]:
+    """Order `query` by (sort_column, id_column) and return one page plus the cursor of the next one.
+
+    With `limit=None` every remaining row is returned and the next cursor is always None.
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor, sort_column.type.python_type)
+        query = query.filter(_after(sort_column, id_column, sort_value, row_id, descending))
+
+    if descending:
+        query = query.order_by(sort_column.desc().nulls_last(), id_column.desc().nulls_last())
+    else:
+        query = query.order_by(sort_column.asc().nulls_first(), id_column.asc().nulls_first())
+
+    if limit is None:
+        return query.all(), None
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
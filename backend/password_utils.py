@@ -1,13 +1,73 @@
 """
 Utilities for hashing and validating passwords.
+
+bcrypt runs in a dedicated process pool so a burst of logins neither blocks
+the request threads on the GIL nor queues up without bound: once
+PASSWORD_HASH_QUEUE_LIMIT jobs are in flight new ones are rejected with 503.
 """
 
-from passlib.context import CryptContext
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT
+import metrics
+
+_context = None
+_executor: Optional[ProcessPoolExecutor] = None
+_admission = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE_LIMIT)
+
+
+def pwd_context():
+    """The passlib context, built on first use: importing passlib is a noticeable part of startup."""
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+        _context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return _context
+
+def _hash(password: str) -> str:
+    return pwd_context().hash(password)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context().verify_and_update(plain_password, hashed_password)
+
+def _run(fn, *args):
+    with metrics.PASSWORD_HASH_SECONDS.labels(fn.__name__.strip("_")).time():
+        return _submit(fn, *args)
+
+def _submit(fn, *args):
+    if _executor is None:
+        return fn(*args)
+    if not _admission.acquire(blocking=False):
+        metrics.PASSWORD_HASH_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Too many concurrent sign-ins, please retry",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _admission.release()
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return _run(_hash, password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Return (valid, new_hash); new_hash is set when the stored hash uses outdated settings."""
+    return _run(_verify_and_update, plain_password, hashed_password)
+
+def start_pool(workers: int = PASSWORD_HASH_WORKERS):
+    global _executor
+    if _executor is None and workers > 0:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+
+def stop_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
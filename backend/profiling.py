@@ -0,0 +1,130 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is
+picked at random with probability PROFILE_SAMPLE_RATE. While any profiled
+request is in flight, one daemon thread samples the stacks of every busy
+thread in the process (the event loop and the pool threads running sync
+endpoints) every PROFILE_INTERVAL_MS. Stacks are process-wide, so requests
+running alongside show up too. A profile is written to PROFILE_DIR in the
+collapsed format read by flamegraph.pl and speedscope when its request took
+at least PROFILE_SLOW_MS, or always when the header asked for it. With both
+triggers off nothing is sampled.
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Set
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from config import PROFILE_DIR, PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS, PROFILE_INTERVAL_MS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = "x-profile"
+# Leaf frames in these modules mean the thread is parked, not working.
+IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "socket.py")
+
+_active: Set["Profile"] = set()
+_lock = threading.Lock()
+_sampler: Optional[threading.Thread] = None
+_names = {}
+
+
+class Profile:
+    def __init__(self, forced: bool):
+        self.forced = forced
+        self.stacks = Counter()
+        self.samples = 0
+
+def _frame_name(code) -> str:
+    name = _names.get(code)
+    if name is None:
+        name = _names[code] = f"{Path(code.co_filename).stem}:{code.co_name}:{code.co_firstlineno}".replace(" ", "_").replace(";", "_")
+    return name
+
+def _collapse(frame) -> Optional[str]:
+    if frame.f_code.co_filename.endswith(IDLE_MODULES):
+        return None
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _sample():
+    global _sampler
+    me = threading.get_ident()
+    while True:
+        with _lock:
+            if not _active:
+                _sampler = None
+                return
+            profiles = list(_active)
+        stacks = [stack for ident, frame in sys._current_frames().items() if ident != me and (stack := _collapse(frame))]
+        for profile in profiles:
+            profile.samples += 1
+            profile.stacks.update(stacks)
+        time.sleep(PROFILE_INTERVAL_MS / 1000)
+
+def begin(forced: bool) -> Profile:
+    global _sampler
+    profile = Profile(forced)
+    with _lock:
+        _active.add(profile)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample, name="profiler", daemon=True)
+            _sampler.start()
+    return profile
+
+def end(profile: Profile):
+    with _lock:
+        _active.discard(profile)
+
+def write(profile: Profile, method: str, route: str, seconds: float) -> Path:
+    label = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    path = Path(PROFILE_DIR) / f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{label}-{int(seconds * 1000)}ms-{uuid.uuid4().hex[:6]}.folded"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+def wanted(headers: Headers) -> Optional[bool]:
+    """None if the request is not profiled, otherwise whether the header forced it."""
+    if PROFILE_TOKEN and headers.get(HEADER) == PROFILE_TOKEN:
+        return True
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return False
+    return None
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        forced = wanted(Headers(scope=scope))
+        if forced is None:
+            return await self.app(scope, receive, send)
+
+        profile = begin(forced)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            end(profile)
+            seconds = time.perf_counter() - started
+            if profile.stacks and (profile.forced or seconds * 1000 >= PROFILE_SLOW_MS):
+                route = metrics.route_label(scope)
+                path = await run_in_threadpool(write, profile, scope["method"], route, seconds)
+                logger.info("Profiled %s %s (%.0f ms, %d samples): %s", scope["method"], route, seconds * 1000, profile.samples, path)
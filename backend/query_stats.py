@@ -0,0 +1,93 @@
+"""
+Per-request SQL instrumentation: statement counts, DB time, slow queries and N+1 hints.
+"""
+
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from config import SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD, SERVER_TIMING
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self):
+        """Statements executed at least N_PLUS_ONE_THRESHOLD times, most frequent first."""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= N_PLUS_ONE_THRESHOLD]
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def begin() -> QueryStats:
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+def current() -> Optional[QueryStats]:
+    return _current.get()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    metrics.observe_query(statement, elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+def instrument(engine: Engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def report(stats: QueryStats, method: str, path: str):
+    for statement, n in stats.repeated():
+        logger.warning("Possible N+1 in %s %s: statement executed %d times: %s", method, path, n, statement)
+    logger.debug("%s %s: %d queries, %.1f ms in DB", method, path, stats.count, stats.seconds * 1000)
+
+def server_timing(stats: QueryStats) -> str:
+    return f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'
+
+
+class QueryStatsMiddleware:
+    """
+    Plain ASGI rather than @app.middleware("http"): BaseHTTPMiddleware never
+    passes a client disconnect on to a streamed response, so its generator
+    would keep running after the client is gone.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = begin()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                report(stats, scope["method"], scope["path"])
+                if SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", server_timing(stats))
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
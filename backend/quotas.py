@@ -0,0 +1,160 @@
+"""
+Per-user storage accounting and quotas.
+
+users.used_bytes and users.file_count are adjusted by one UPDATE in the same
+transaction as the user_files rows they describe. Growth is conditional on
+the quota in that UPDATE, so concurrent uploads cannot overshoot it together.
+A background job recounts a slice of users per run from user_files and
+fixes any drift (crashes between disk and DB, manual edits, migrations).
+Under serve.py one worker runs it at a time, and the position in the pass
+is kept in the shared cache so a worker taking over carries on from there.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import User, UserFile
+from schemas import StorageUsage, StoragePage
+from pagination import paginate
+from config import STORAGE_QUOTA_BYTES, USAGE_RECONCILE_INTERVAL_SECONDS, USAGE_RECONCILE_BATCH_SIZE
+import shared_cache
+
+logger = logging.getLogger(__name__)
+
+CLAIM_NAME = "usage_reconcile"
+CHECKPOINT_KEY = "usage_reconcile:checkpoint"
+
+_task: Optional[asyncio.Task] = None
+_holding = False
+# Last user id recounted by the background job; it starts over after the last user.
+_checkpoint = 0
+
+
+def _limit():
+    return func.coalesce(User.quota_bytes, STORAGE_QUOTA_BYTES)
+
+def quota_exceeded() -> HTTPException:
+    return HTTPException(status_code=413, detail="Storage quota exceeded")
+
+def check(db: Session, user: User, incoming: int):
+    """Fail fast, before any bytes are written, if `incoming` more bytes would not fit."""
+    used, limit = db.query(User.used_bytes, _limit()).filter(User.id == user.id).one()
+    if limit > 0 and used + incoming > limit:
+        raise quota_exceeded()
+
+def charge(db: Session, user: User, size_delta: int, count_delta: int = 0):
+    """Adjust the user's counters inside the caller's transaction; growth past the quota raises 413."""
+    if not size_delta and not count_delta:
+        return
+    statement = update(User).where(User.id == user.id)
+    if size_delta > 0:
+        statement = statement.where(or_(_limit() <= 0, User.used_bytes + size_delta <= _limit()))
+    result = db.execute(statement.values(
+        used_bytes=User.used_bytes + size_delta, file_count=User.file_count + count_delta
+    ).execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        raise quota_exceeded()
+
+def _usage(user: User) -> StorageUsage:
+    limit = user.quota_bytes if user.quota_bytes is not None else STORAGE_QUOTA_BYTES
+    return StorageUsage(
+        id=user.id,
+        username=user.username,
+        used_bytes=user.used_bytes or 0,
+        file_count=user.file_count or 0,
+        quota_bytes=limit if limit > 0 else None,
+    )
+
+def get_usage(db: Session, user: User) -> StorageUsage:
+    return _usage(db.query(User).filter(User.id == user.id).one())
+
+def top_consumers(db: Session, limit: int, cursor: Optional[str] = None) -> StoragePage:
+    """Largest users first, read straight off the (used_bytes, id) index."""
+    users, next_cursor = paginate(db.query(User), User.used_bytes, User.id, limit=limit, cursor=cursor, descending=True)
+    return StoragePage(items=[_usage(user) for user in users], next_cursor=next_cursor)
+
+def reconcile(db: Session, after_id: int = 0, limit: int = USAGE_RECONCILE_BATCH_SIZE) -> Tuple[Optional[int], int]:
+    """Recount the next `limit` users after `after_id` and fix the ones that drifted.
+
+    Returns the last user id visited (None past the end) and how many were fixed.
+    """
+    ids = db.scalars(select(User.id).where(User.id > after_id).order_by(User.id).limit(limit)).all()
+    if not ids:
+        return None, 0
+    files = (UserFile.user_id == User.id, UserFile.is_folder == False)
+    used = select(func.coalesce(func.sum(UserFile.size), 0)).where(*files).scalar_subquery()
+    count = select(func.count(UserFile.id)).where(*files).scalar_subquery()
+    # One statement per batch: the recount and the fix see the same rows.
+    fixed = db.execute(
+        update(User).where(User.id.in_(ids), or_(User.used_bytes != used, User.file_count != count))
+        .values(used_bytes=used, file_count=count).execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return ids[-1], fixed
+
+def reconcile_all(db: Session, batch_size: int = USAGE_RECONCILE_BATCH_SIZE) -> int:
+    fixed, last_id = 0, 0
+    while last_id is not None:
+        last_id, batch_fixed = reconcile(db, last_id, batch_size)
+        fixed += batch_fixed
+    return fixed
+
+def _load_checkpoint() -> int:
+    if shared_cache.store is None:
+        return _checkpoint
+    value = shared_cache.store.get(CHECKPOINT_KEY)
+    return int(value) if value else 0
+
+def _save_checkpoint(last_id: int):
+    global _checkpoint
+    _checkpoint = last_id
+    if shared_cache.store is not None:
+        # Forgotten if nobody runs the job for a while; the pass then starts over.
+        shared_cache.store.set(CHECKPOINT_KEY, str(last_id).encode(), USAGE_RECONCILE_INTERVAL_SECONDS * 10)
+
+def reconcile_once() -> int:
+    """Recount one batch after the checkpoint, so a full pass is spread over many runs."""
+    db = SessionLocal()
+    try:
+        last_id, fixed = reconcile(db, _load_checkpoint(), USAGE_RECONCILE_BATCH_SIZE)
+        _save_checkpoint(last_id or 0)
+        return fixed
+    finally:
+        db.close()
+
+async def _run():
+    global _holding
+    while True:
+        await asyncio.sleep(USAGE_RECONCILE_INTERVAL_SECONDS)
+        _holding = shared_cache.claim(CLAIM_NAME, USAGE_RECONCILE_INTERVAL_SECONDS * 3, renew=True)
+        if not _holding:
+            continue
+        try:
+            fixed = await run_in_threadpool(reconcile_once)
+            if fixed:
+                logger.warning("Corrected storage counters for %d users", fixed)
+        except Exception:
+            logger.exception("Storage usage reconcile failed")
+
+def start():
+    global _task
+    if _task is None and USAGE_RECONCILE_INTERVAL_SECONDS > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop():
+    global _task, _holding
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        if _holding:
+            shared_cache.release(CLAIM_NAME)
+            _holding = False
@@ -0,0 +1,62 @@
+"""
+Background removal of files and directories whose database rows are already gone.
+
+Every process drains only the paths it queued itself, so unlike the sweeps
+it needs no claim under serve.py: a worker that skipped its queue would
+leave those paths behind for good.
+"""
+
+import logging
+import queue
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_queue: "queue.Queue[Optional[Path]]" = queue.Queue()
+_thread: Optional[threading.Thread] = None
+
+
+def _remove(path: Path):
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        else:
+            path.unlink(missing_ok=True)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logger.warning("Could not remove %s: %s", path, exc)
+
+def _run():
+    while True:
+        path = _queue.get()
+        try:
+            if path is None:
+                return
+            _remove(path)
+        finally:
+            _queue.task_done()
+
+def enqueue(*paths: Path):
+    """Schedule `paths` for removal; removed inline when the reaper is not running."""
+    for path in paths:
+        if _thread is None:
+            _remove(path)
+        else:
+            _queue.put(path)
+
+def start():
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_run, name="reaper", daemon=True)
+        _thread.start()
+
+def stop():
+    global _thread
+    if _thread is not None:
+        _queue.put(None)
+        _thread.join()
+        _thread = None
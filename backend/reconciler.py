@@ -0,0 +1,688 @@
+"""
+Keeps user_files, the blob store and the thumbnail cache in sync with the disk.
+
+Finds three kinds of drift and, with RECONCILE_REPAIR, repairs them:
+
+- missing files: rows whose bytes are gone. The row is removed as a delete
+  would remove it (search entry, blob reference, storage counters).
+- orphan files: blobs without a blob row, temporary upload files and files
+  under a user's folder that no row stores there. They are deleted.
+- orphan thumbnails: thumbnails of blobs or rows that no longer exist.
+  They are deleted too.
+
+Files younger than RECONCILE_GRACE_SECONDS are left alone, since an upload
+in progress has written its bytes before committing its row. A row is only
+removed once the directory that lost its file has not changed for as long
+(moving a folder renames it on disk before committing the rows), after
+reading the row and checking its path once more.
+
+Storage that is not mounted looks exactly like every file going missing,
+so repairs are held back:
+
+- No round runs while a storage root is missing or empty but the database
+  has files there, or the database has no blobs but the store has some.
+- Rows of a blob shard or user directory that is missing or empty are only
+  reported.
+- A round stops repairing after RECONCILE_MAX_REPAIRS repairs, or once it
+  would remove half of all file rows; what is left waits for later rounds.
+
+`python maintenance.py reconcile --repair --force` lifts these limits.
+
+Two sources feed the checks, so the work follows what changed rather than
+how much is stored:
+
+- While a process runs the reconciler, a watcher (inotify through
+  watchfiles) reports every entry added to or removed from the storage
+  directories. The next round checks just those entries.
+- A walk over the storage directories covers the changes the watcher never
+  saw: those made while nothing was running, or when there is no watcher.
+  Each round it visits RECONCILE_BATCH_SIZE directories, starting where
+  the previous round stopped. A directory is only listed if its mtime
+  moved since the checkpoint stored in scan_checkpoints (creating or
+  removing an entry changes it). The walk also lists a directory if it has
+  not been checked for RECONCILE_VERIFY_HOURS, which catches rows deleted
+  without their files. Leaf directories are not listed to find
+  subdirectories.
+
+Only one process on a host runs it: the workers started by serve.py share a
+claim. `python maintenance.py reconcile` checks everything in one pass.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+from pathlib import Path
+from stat import S_ISDIR
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Blob, ScanCheckpoint, User, UserFile
+from config import (
+    BASE_FOLDER_DIR, BLOB_DIR, THUMBNAIL_DIR, UPLOAD_TMP_DIR, PROFILE_DIR,
+    RECONCILE_INTERVAL_SECONDS, RECONCILE_BATCH_SIZE, RECONCILE_GRACE_SECONDS, RECONCILE_VERIFY_HOURS,
+    RECONCILE_REPAIR, RECONCILE_MAX_REPAIRS, RECONCILE_WATCH,
+)
+import blob_store
+import file_operations
+import metrics
+import quotas
+import reaper
+import search
+import shared_cache
+import thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Walked in this order; blob shards sit two levels down and thumbnail directories one.
+ROOTS = {"blobs": BLOB_DIR, "thumbnails": THUMBNAIL_DIR, "files": BASE_FOLDER_DIR}
+RESOLVED_ROOTS = {root: Path(path).resolve() for root, path in ROOTS.items() if path}
+MAX_DEPTH = {"blobs": 2, "thumbnails": 1, "files": None}
+# Directories under a root that belong to something else.
+EXCLUDED = {Path(path).resolve() for path in (BLOB_DIR, THUMBNAIL_DIR, UPLOAD_TMP_DIR, PROFILE_DIR) if path}
+HEX_PAIR = re.compile(r"[0-9a-f]{2}")
+BLOB_THUMBNAIL = re.compile(r"([0-9a-f]{64})_[a-z]+\.webp")
+ROW_THUMBNAIL = re.compile(r"(\d+)_([0-9a-f]+)_[a-z]+\.webp")
+LOOKUP_CHUNK = 500
+CLAIM_NAME = "reconciler"
+
+Directory = Tuple[str, Tuple[str, ...]]
+
+_task: Optional[asyncio.Task] = None
+_watcher: Optional[asyncio.Task] = None
+_watcher_started = 0.0
+_holding = False
+# Where the walk stopped: (root, parts) of the last directory visited, or None to start over.
+_cursor: Optional[Directory] = None
+# Entries the watcher reported, per directory, with the time each may be checked.
+_pending: Dict[Directory, Dict[str, float]] = defaultdict(dict)
+_pending_lock = threading.Lock()
+
+
+def _key(directory: Directory) -> str:
+    root, parts = directory
+    return f"{root}:{'/'.join(parts)}"
+
+def _path(directory: Directory) -> Path:
+    root, parts = directory
+    return Path(ROOTS[root]).joinpath(*parts)
+
+def _skipped(directory: Directory, name: str) -> bool:
+    """Subdirectories the walk and the watcher leave out."""
+    root, parts = directory
+    if root == "files" and not parts and name.startswith("."):
+        return True
+    return (_path(directory) / name).resolve() in EXCLUDED
+
+def _changed_at(stat: os.stat_result) -> float:
+    # A hard link into the blob store keeps the source's mtime but updates ctime.
+    return max(stat.st_mtime, stat.st_ctime)
+
+def _quiet_since(path: Path) -> float:
+    """When a directory above `path`, up to its storage root, last changed.
+
+    Moving a folder changes only the moved directory and its parents, not
+    the files in it. Under the user folders every directory up to the user's
+    counts; elsewhere the nearest existing one.
+    """
+    files_root = Path(BASE_FOLDER_DIR) if BASE_FOLDER_DIR else None
+    legacy = files_root is not None and files_root in path.parents and not any(
+        parent.resolve() in EXCLUDED for parent in path.parents if files_root in parent.parents
+    )
+    changed_at = 0.0
+    for parent in path.parents:
+        if parent == files_root:
+            break
+        try:
+            changed_at = max(changed_at, _changed_at(os.stat(parent)))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if not legacy:
+            break
+    return changed_at
+
+def _empty(path: Path) -> bool:
+    try:
+        with os.scandir(path) as scan:
+            return next(scan, None) is None
+    except (FileNotFoundError, NotADirectoryError):
+        return True
+
+def _stored(root: str) -> bool:
+    """Whether a storage root holds any blob shard or user folder."""
+    try:
+        with os.scandir(ROOTS[root]) as scan:
+            if root == "blobs":
+                return any(HEX_PAIR.fullmatch(entry.name) for entry in scan)
+            return any(entry.is_dir() and not _skipped((root, ()), entry.name) for entry in scan)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+def _offline(db: Session) -> Optional[str]:
+    """Why the storage looks unmounted, or the database looks like the wrong one, if it does."""
+    legacy = db.query(UserFile.id).filter(UserFile.blob_sha == None, UserFile.is_folder == False).first() is not None
+    blobs = db.query(Blob.sha256).first() is not None
+    if BLOB_DIR and blobs and not _stored("blobs"):
+        return f"{BLOB_DIR} is missing or empty but the database has blobs"
+    if BLOB_DIR and not blobs and _stored("blobs"):
+        return f"the database has no blobs but {BLOB_DIR} holds some"
+    if BASE_FOLDER_DIR and legacy and not _stored("files"):
+        return f"{BASE_FOLDER_DIR} is missing or empty but the database has files stored there"
+    if BASE_FOLDER_DIR and db.query(User.id).first() is None and _stored("files"):
+        return f"the database has no users but {BASE_FOLDER_DIR} holds user folders"
+    return None
+
+def _list(directory: Directory, names: Optional[Set[str]]) -> Dict[str, Tuple[bool, float]]:
+    """Entries of the directory as name -> (is_dir, changed_at); only `names` when given."""
+    entries = {}
+    path = _path(directory)
+    if names is not None:
+        for name in names:
+            try:
+                stat = os.stat(path / name, follow_symlinks=False)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            is_dir = S_ISDIR(stat.st_mode)
+            if not (is_dir and _skipped(directory, name)):
+                entries[name] = (is_dir, _changed_at(stat))
+        return entries
+    try:
+        with os.scandir(path) as scan:
+            for entry in scan:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and _skipped(directory, entry.name):
+                    continue
+                try:
+                    entries[entry.name] = (is_dir, _changed_at(entry.stat(follow_symlinks=False)))
+                except FileNotFoundError:
+                    continue
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return entries
+
+def _chunks(items: list, size: int = LOOKUP_CHUNK) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _prefix_range(column, prefix: str) -> list:
+    """Conditions for values of `column` that start with `prefix` (one index range)."""
+    if not prefix:
+        return []
+    return [column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+
+
+class Round:
+    """One round's findings, its repair budget, and the entries to look at again later."""
+
+    def __init__(self, now: float, repair: bool, force: bool = False):
+        self.now = now
+        self.repair = repair
+        self.force = force
+        self.stale_before = now - RECONCILE_GRACE_SECONDS
+        self.counts = Counter()
+        self.retry: Dict[Directory, Dict[str, float]] = defaultdict(dict)
+        self.repaired = 0
+        self.dropped = 0
+        self.halted = False
+        self._file_rows: Optional[int] = None
+        self._quiet: Dict[Directory, float] = {}
+
+    def stale(self, directory: Directory, name: str, changed_at: float) -> bool:
+        if directory[0] == "files" and directory[1]:
+            # A file in a folder being moved is not an orphan, only ahead of its rows.
+            changed_at = max(changed_at, self._moved_at(directory))
+        if changed_at < self.stale_before:
+            return True
+        self.retry[directory][name] = changed_at + RECONCILE_GRACE_SECONDS
+        return False
+
+    def _moved_at(self, directory: Directory) -> float:
+        if directory not in self._quiet:
+            self._quiet[directory] = _quiet_since(_path(directory) / "-")
+        return self._quiet[directory]
+
+    def found(self, kind: str, count: int = 1):
+        if count:
+            self.counts[kind] += count
+            metrics.RECONCILE_FINDINGS.labels(kind).inc(count)
+
+    def halt(self, reason: str):
+        if not self.halted:
+            logger.error("Storage reconcile stopped repairing for this round: %s", reason)
+            self.found("halted")
+            self.halted = True
+
+    def allowed(self, count: int) -> int:
+        """How many of `count` repairs may be made; the others are left for a later round."""
+        if not self.repair or self.halted:
+            return 0
+        if self.force:
+            return count
+        allowed = min(count, RECONCILE_MAX_REPAIRS - self.repaired)
+        if allowed < count:
+            self.halt(f"RECONCILE_MAX_REPAIRS ({RECONCILE_MAX_REPAIRS}) reached")
+        self.repaired += allowed
+        return allowed
+
+    def allowed_rows(self, db: Session, count: int) -> int:
+        if self.repair and not self.force:
+            if self._file_rows is None:
+                self._file_rows = db.query(func.count(UserFile.id)).filter(UserFile.is_folder == False).scalar()
+            self.dropped += count
+            if self.dropped * 2 > self._file_rows:
+                self.halt(f"{self.dropped} of {self._file_rows} file rows have no bytes on disk")
+        return self.allowed(count)
+
+    def later(self, directory: Directory, name: str):
+        if self.repair:
+            self.retry[directory][name] = self.now
+
+    def remove(self, kind: str, directory: Directory, names: List[str]):
+        self.found(kind, len(names))
+        allowed = self.allowed(len(names))
+        for index, name in enumerate(names):
+            logger.warning("%s: %s", kind.replace("_", " ").capitalize(), _path(directory) / name)
+            if index >= allowed:
+                self.later(directory, name)
+        if allowed:
+            reaper.enqueue(*(_path(directory) / name for name in names[:allowed]))
+
+
+def _drop_rows(db: Session, missing: Dict[int, Tuple[Directory, str]], state: Round):
+    """Remove file rows whose bytes are gone, as delete_file would.
+
+    `missing` maps row ids to the directory entry their bytes were expected
+    at, where they are looked for again later if they cannot be removed yet.
+    """
+    rows, users = [], {}
+    for chunk in _chunks(sorted(missing)):
+        # Read again: a folder move or an upload may have committed since the directory was listed.
+        for row in db.query(UserFile).filter(UserFile.id.in_(chunk)).populate_existing():
+            if row.user_id not in users:
+                users[row.user_id] = db.get(User, row.user_id)
+            path = file_operations.content_path(users[row.user_id], row)
+            if not path.exists() and state.stale(*missing[row.id], _quiet_since(path)):
+                rows.append(row)
+
+    state.found("missing_files", len(rows))
+    allowed = state.allowed_rows(db, len(rows)) if rows else 0
+    for index, row in enumerate(rows):
+        logger.warning("File %d (%s) of user %d has no bytes on disk%s",
+                       row.id, row.relative_path, row.user_id, "; removing the row" if index < allowed else "")
+        if index >= allowed:
+            state.later(*missing[row.id])
+    if not allowed:
+        return
+    reap = []
+    by_user = defaultdict(list)
+    for row in rows[:allowed]:
+        by_user[row.user_id].append(row)
+    for user_id, user_rows in by_user.items():
+        user = users[user_id]
+        for row in user_rows:
+            reap.extend(thumbnails.thumbnail_files(user.username, row))
+        ids = [row.id for row in user_rows]
+        search.remove(db, ids)
+        db.query(UserFile).filter(UserFile.id.in_(ids)).delete(synchronize_session=False)
+        blob_store.release(db, [row.blob_sha for row in user_rows])
+        quotas.charge(db, user, -sum(row.size or 0 for row in user_rows), -len(user_rows))
+    db.commit()
+    reaper.enqueue(*reap)
+
+def _hold(state: Round, path: Path, rows: int) -> bool:
+    """Report the rows of a directory that is missing or empty as a whole; True if they are left as they are."""
+    if state.force:
+        return False
+    state.found("unavailable_directories")
+    logger.error("%s is missing or empty but %d file rows expect their bytes in it; not repairing them "
+                 "(`python maintenance.py reconcile --repair --force` removes them)", path, rows)
+    return True
+
+def _lost_blobs(db: Session, shas: List[str], state: Round):
+    missing = {}
+    for chunk in _chunks(shas):
+        for row_id, sha256 in db.query(UserFile.id, UserFile.blob_sha).filter(UserFile.blob_sha.in_(chunk)):
+            missing[row_id] = (("blobs", (sha256[:2], sha256[2:4])), sha256)
+    _drop_rows(db, missing, state)
+
+
+def _check_blobs(db: Session, directory: Directory, entries: dict, names: Optional[Set[str]], state: Round):
+    _, parts = directory
+    if parts == (blob_store.TEMP_DIR,):
+        # Uploads stream into these; whatever is left once they are old was abandoned.
+        state.remove("orphan_files", directory, [
+            name for name, (is_dir, changed_at) in entries.items()
+            if not is_dir and state.stale(directory, name, changed_at)
+        ])
+        return
+    if not all(HEX_PAIR.fullmatch(part) for part in parts):
+        return
+    prefix = "".join(parts)
+    if len(parts) < 2:
+        # Shard directories: a vanished one takes its blobs with it.
+        absent = [name for name in (names or ()) if HEX_PAIR.fullmatch(name) and name not in entries]
+        if names is None:
+            query = select(Blob.sha256).where(*_prefix_range(Blob.sha256, prefix))
+            absent = {sha256[len(prefix):len(prefix) + 2] for sha256 in db.scalars(query)} - set(entries)
+        for name in sorted(absent):
+            shas = list(db.scalars(select(Blob.sha256).where(*_prefix_range(Blob.sha256, prefix + name))))
+            if shas and not _hold(state, _path(directory) / name, len(shas)):
+                _lost_blobs(db, shas, state)
+        return
+
+    if names is None:
+        known = set(db.scalars(select(Blob.sha256).where(*_prefix_range(Blob.sha256, prefix))))
+    else:
+        known = set(db.scalars(select(Blob.sha256).where(Blob.sha256.in_(list(names)))))
+    # Blob files, and copies being renamed into place, with no blob row.
+    state.remove("orphan_files", directory, [
+        name for name, (is_dir, changed_at) in entries.items()
+        if not is_dir and name not in known and state.stale(directory, name, changed_at)
+    ])
+    lost = sorted(known - set(entries))
+    if lost and not (_empty(_path(directory)) and _hold(state, _path(directory), len(lost))):
+        _lost_blobs(db, lost, state)
+
+def _check_files(db: Session, directory: Directory, entries: dict, names: Optional[Set[str]], state: Round):
+    """Folders under BASE_FOLDER_DIR/<username> hold the bytes of rows from before the blob store."""
+    _, parts = directory
+    legacy = [UserFile.blob_sha == None, UserFile.is_folder == False]
+    if not parts:
+        # A user's whole folder may be gone.
+        absent = [name for name in (names or ()) if name not in entries]
+        if names is None:
+            users = db.scalars(select(User.username).where(User.id.in_(select(UserFile.user_id).where(*legacy))))
+            absent = set(users) - set(entries)
+        for username in sorted(absent):
+            rows = db.query(UserFile.id).join(User, UserFile.user_id == User.id).filter(User.username == username, *legacy).all()
+            if rows and not _hold(state, _path(directory) / username, len(rows)):
+                _drop_rows(db, {row.id: (directory, username) for row in rows}, state)
+        return
+
+    user = db.query(User).filter(User.username == parts[0]).first()
+    if user is None:
+        return
+    base = "/".join(parts[1:])
+    prefix = f"{base}/" if base else ""
+    rows = db.query(UserFile.id, UserFile.relative_path).filter(
+        UserFile.user_id == user.id, *legacy, *_prefix_range(UserFile.relative_path, prefix)
+    ).all()
+    expected, missing = set(), {}
+    for row in rows:
+        name, _, rest = row.relative_path[len(prefix):].partition("/")
+        if names is not None and name not in names:
+            continue
+        if not rest:
+            expected.add(name)
+            if name not in entries or entries[name][0]:
+                missing[row.id] = (directory, name)
+        elif name not in entries or not entries[name][0]:
+            # Deeper rows are checked with their own directory, unless it is gone.
+            missing[row.id] = (directory, name)
+    state.remove("orphan_files", directory, [
+        name for name, (is_dir, changed_at) in entries.items()
+        if not is_dir and name not in expected and state.stale(directory, name, changed_at)
+    ])
+    # A user's folder as a whole: the same as a vanished blob shard.
+    if missing and not (len(parts) == 1 and _empty(_path(directory)) and _hold(state, _path(directory), len(missing))):
+        _drop_rows(db, missing, state)
+
+def _check_thumbnails(db: Session, directory: Directory, entries: dict, names: Optional[Set[str]], state: Round):
+    _, parts = directory
+    if len(parts) != 1:
+        return
+    candidates = {}
+    if parts[0] == thumbnails.BLOB_THUMBNAIL_DIR:
+        for name, (is_dir, changed_at) in entries.items():
+            match = BLOB_THUMBNAIL.fullmatch(name)
+            if not is_dir and match and state.stale(directory, name, changed_at):
+                candidates[name] = match.group(1)
+        owners = set()
+        for chunk in _chunks(sorted(set(candidates.values()))):
+            owners.update(db.scalars(select(Blob.sha256).where(Blob.sha256.in_(chunk))))
+    else:
+        user = db.query(User).filter(User.username == parts[0]).first()
+        if user is None:
+            return
+        for name, (is_dir, changed_at) in entries.items():
+            match = ROW_THUMBNAIL.fullmatch(name)
+            if not is_dir and match and state.stale(directory, name, changed_at):
+                candidates[name] = (int(match.group(1)), match.group(2))
+        owners = set()
+        for chunk in _chunks(sorted({file_id for file_id, _ in candidates.values()})):
+            owners.update(db.execute(select(UserFile.id, UserFile.thumbnail_key).where(
+                UserFile.id.in_(chunk), UserFile.user_id == user.id, UserFile.blob_sha == None
+            )).tuples())
+    state.remove("orphan_thumbnails", directory, [name for name, owner in candidates.items() if owner not in owners])
+
+CHECKS = {"blobs": _check_blobs, "files": _check_files, "thumbnails": _check_thumbnails}
+
+def check(db: Session, directory: Directory, state: Round, names: Optional[Set[str]] = None) -> dict:
+    """Compare one directory, or just `names` in it, with the rows that should be there; returns its entries."""
+    entries = _list(directory, names)
+    CHECKS[directory[0]](db, directory, entries, names, state)
+    return entries
+
+
+def _walk(root: str, parts: Tuple[str, ...], after: Optional[Tuple[str, ...]]) -> Iterator[Tuple[Directory, os.stat_result]]:
+    """Directories under `root` in sorted depth-first order, from the first one after `after`."""
+    directory = (root, parts)
+    try:
+        stat = os.stat(_path(directory))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    if after is None or parts > after:
+        yield directory, stat
+    depth = MAX_DEPTH[root]
+    # Two links (itself and its entry in the parent) means no subdirectories on most filesystems.
+    if (depth is not None and len(parts) >= depth) or stat.st_nlink == 2:
+        return
+    try:
+        with os.scandir(_path(directory)) as scan:
+            children = sorted(entry.name for entry in scan if entry.is_dir(follow_symlinks=False) and not _skipped(directory, entry.name))
+    except FileNotFoundError:
+        return
+    for name in children:
+        child = parts + (name,)
+        # Every directory below `child` sorts before `after`: none of them is left to visit.
+        if after is not None and child < after[:len(child)]:
+            continue
+        yield from _walk(root, child, after)
+
+def walk(start: Optional[Directory] = None) -> Iterator[Tuple[Directory, os.stat_result]]:
+    roots = [root for root, path in ROOTS.items() if path]
+    for index, root in enumerate(roots):
+        if start is not None and index < roots.index(start[0]):
+            continue
+        yield from _walk(root, (), start[1] if start is not None and root == start[0] else None)
+
+def _due(checkpoint: Optional[ScanCheckpoint], stat: os.stat_result, now: float) -> Optional[str]:
+    if checkpoint is None:
+        return "new"
+    if now - checkpoint.scanned_at > RECONCILE_VERIFY_HOURS * 3600:
+        return "verify"
+    # While the watcher runs it reports every change made after it started.
+    watched = _watcher is not None and not _watcher.done() and checkpoint.scanned_at > _watcher_started
+    if stat.st_mtime_ns != checkpoint.mtime_ns and not watched:
+        return "changed"
+    return None
+
+def scan(db: Session, state: Round, directories: Iterable[Tuple[Directory, os.stat_result]],
+         limit: Optional[int] = None, force: bool = False) -> Optional[Directory]:
+    """Check the directories that are due (all of them with `force`); returns the last one visited."""
+    last, visited = None, 0
+    directories = iter(directories)
+    while limit is None or visited < limit:
+        batch = list(islice(directories, LOOKUP_CHUNK if limit is None else min(LOOKUP_CHUNK, limit - visited)))
+        if not batch:
+            return None
+        keys = [_key(directory) for directory, _ in batch]
+        checkpoints = {row.path: row for row in db.query(ScanCheckpoint).filter(ScanCheckpoint.path.in_(keys))}
+        for directory, stat in batch:
+            reason = "full" if force else _due(checkpoints.get(_key(directory)), stat, state.now)
+            if reason:
+                metrics.RECONCILE_DIRECTORIES.labels(reason).inc()
+                state.counts["directories"] += 1
+                check(db, directory, state)
+                db.merge(ScanCheckpoint(path=_key(directory), mtime_ns=stat.st_mtime_ns, scanned_at=state.now))
+                db.commit()
+        visited += len(batch)
+        last = batch[-1][0]
+    return last
+
+
+def _take_pending(now: float) -> Dict[Directory, Set[str]]:
+    due = {}
+    with _pending_lock:
+        for directory, names in list(_pending.items()):
+            ready = {name for name, at in names.items() if at <= now}
+            if ready:
+                due[directory] = ready
+                for name in ready:
+                    del names[name]
+            if not names:
+                del _pending[directory]
+    return due
+
+def _add_pending(entries: Dict[Directory, Dict[str, float]]):
+    with _pending_lock:
+        for directory, names in entries.items():
+            for name, at in names.items():
+                _pending[directory][name] = max(at, _pending[directory].get(name, 0))
+
+def _unavailable(db: Session, state: Round) -> bool:
+    reason = None if state.force else _offline(db)
+    if reason:
+        logger.error("Storage reconcile skipped: %s", reason)
+        state.found("storage_unavailable")
+    return reason is not None
+
+def reconcile_round(db: Session, limit: int = RECONCILE_BATCH_SIZE, repair: bool = RECONCILE_REPAIR) -> Counter:
+    """Check what the watcher reported, then walk on from the last round's position."""
+    global _cursor
+    state = Round(time.time(), repair)
+    if _unavailable(db, state):
+        return state.counts
+    with metrics.RECONCILE_SECONDS.time():
+        for directory, names in _take_pending(state.now).items():
+            metrics.RECONCILE_DIRECTORIES.labels("watched").inc()
+            root, parts = directory
+            for name, (is_dir, _) in check(db, directory, state, names).items():
+                # A new directory can fill up before the watcher watches it; the walk lists it as it has no checkpoint.
+                if is_dir:
+                    scan(db, state, _walk(root, parts + (name,), None))
+        _cursor = scan(db, state, walk(_cursor), limit)
+    _add_pending(state.retry)
+    return state.counts
+
+def reconcile_all(db: Session, repair: bool = RECONCILE_REPAIR, force: bool = False) -> Counter:
+    """Check every directory now, whatever the checkpoints say; `force` lifts the limits on repairs."""
+    state = Round(time.time(), repair, force)
+    if not _unavailable(db, state):
+        scan(db, state, walk(), force=True)
+    return state.counts
+
+
+def _directory_of(path: str) -> Optional[Tuple[Directory, str]]:
+    """The storage directory holding `path` and the entry's name, if the reconciler looks after it."""
+    path = Path(path)
+    # The deepest root first: the blob store usually lives inside BASE_FOLDER_DIR.
+    for root, base in sorted(RESOLVED_ROOTS.items(), key=lambda item: -len(item[1].parts)):
+        try:
+            parts = path.relative_to(base).parts
+        except ValueError:
+            continue
+        depth = MAX_DEPTH[root]
+        if not parts or (depth is not None and len(parts) > depth + 1):
+            return None
+        # Temporary upload files come and go all the time; the walk sweeps the ones left behind.
+        if root == "blobs" and parts[0] == blob_store.TEMP_DIR:
+            return None
+        if any(_skipped((root, parts[:index]), parts[index]) for index in range(len(parts) - 1)):
+            return None
+        return (root, parts[:-1]), parts[-1]
+    return None
+
+async def _watch():
+    roots = [str(path) for path in RESOLVED_ROOTS.values() if path.is_dir()]
+    try:
+        from watchfiles import awatch
+
+        async for changes in awatch(*roots, debounce=1000, recursive=True):
+            now = time.time()
+            reported = defaultdict(dict)
+            for _, path in changes:
+                located = _directory_of(path)
+                if located:
+                    reported[located[0]][located[1]] = now
+            _add_pending(reported)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # The walk still finds everything, only later.
+        logger.exception("Storage watcher stopped")
+
+def _start_watcher():
+    global _watcher, _watcher_started
+    if _watcher is None and RECONCILE_WATCH:
+        _watcher_started = time.time()
+        _watcher = asyncio.create_task(_watch())
+
+async def _stop_watcher():
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+        _watcher = None
+
+def reconcile_once() -> Counter:
+    db = SessionLocal()
+    try:
+        return reconcile_round(db)
+    finally:
+        db.close()
+
+async def _run():
+    global _holding
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        # Held across rounds by whichever worker got it first, for as long as that worker keeps running them.
+        _holding = shared_cache.claim(CLAIM_NAME, RECONCILE_INTERVAL_SECONDS * 3, renew=True)
+        if not _holding:
+            await _stop_watcher()
+            continue
+        _start_watcher()
+        try:
+            counts = await run_in_threadpool(reconcile_once)
+            if set(counts) - {"directories"}:
+                logger.warning("Storage reconcile: %s", dict(counts))
+        except Exception:
+            logger.exception("Storage reconcile failed")
+
+def start():
+    global _task
+    if _task is None and RECONCILE_INTERVAL_SECONDS > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop():
+    global _task, _holding
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        await _stop_watcher()
+        if _holding:
+            shared_cache.release(CLAIM_NAME)
+            _holding = False
@@ -2,8 +2,8 @@
 Pydantic models for data validation.
 """
 
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field
+from typing import Annotated, Optional, List, Dict, Literal, Union
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -17,6 +17,12 @@ class UserCreate(BaseModel):
     password: str
     role: str = "user"
 
+class UserUpdate(BaseModel):
+    role: Optional[str] = None
+    disabled: Optional[bool] = None
+    # An explicit null returns the user to the default quota; 0 lifts the limit.
+    quota_bytes: Optional[int] = Field(None, ge=0)
+
 class UserOut(UserBase):
     id: int
     disabled: bool
@@ -33,10 +39,41 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class ListQuery(BaseModel):
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    cursor: Optional[str] = None
+    sort: Literal["name", "created", "updated", "size"] = "name"
+    order: Literal["asc", "desc"] = "asc"
+    prefix: Optional[str] = None
+    type: Optional[str] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+    @property
+    def paginated(self) -> bool:
+        return self.limit is not None or self.cursor is not None
+
+class ReadQuery(BaseModel):
+    """Either a byte range (offset/length) or a line range (line/lines); defaults to the first page."""
+    offset: Optional[int] = Field(None, ge=0)
+    length: Optional[int] = Field(None, ge=1)
+    line: Optional[int] = Field(None, ge=0)
+    lines: Optional[int] = Field(None, ge=1, le=10000)
+
 class FolderCreate(BaseModel):
     name: str
     parent: Optional[int] = None
 
+class FolderTarget(BaseModel):
+    parent: Optional[int] = None
+    name: Optional[str] = None
+
+class FolderSize(BaseModel):
+    id: int
+    size: int
+    files: int
+    folders: int
+
 class FolderSchema(BaseModel):
     id: int
     name: str
@@ -50,8 +87,88 @@ class FileSchema(BaseModel):
     name: str
     url: str
     size: int
+    mime_type: Optional[str] = None
+    etag: Optional[str] = None
     folder: Optional[int] = None
     thumbnail: str
+    thumbnail_status: Optional[str] = None
+    thumbnails: Dict[str, str] = {}
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class FolderPage(BaseModel):
+    items: List[FolderSchema]
+    next_cursor: Optional[str] = None
+
+class FilePage(BaseModel):
+    items: List[FileSchema]
+    next_cursor: Optional[str] = None
+
+class UserPage(BaseModel):
+    items: List[UserOut]
+    next_cursor: Optional[str] = None
+
+class StorageUsage(BaseModel):
+    id: int
+    username: str
+    used_bytes: int
+    file_count: int
+    quota_bytes: Optional[int] = None
+
+class StoragePage(BaseModel):
+    items: List[StorageUsage]
+    next_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    id: int
+    name: str
+    path: str
+    is_folder: bool
+    folder: Optional[int] = None
+    size: Optional[int] = None
+    mime_type: Optional[str] = None
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
+
+class UploadInit(BaseModel):
+    filename: str
+    folder: Optional[int] = None
+    size: Optional[int] = Field(None, ge=0)
+    content_type: Optional[str] = None
+
+class UploadStatus(BaseModel):
+    id: str
+    filename: str
+    folder: Optional[int] = None
+    size: Optional[int] = None
+    received: int
+    expires_at: datetime
+
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+class BatchRename(BaseModel):
+    op: Literal["rename"]
+    id: int
+    name: str = Field(..., min_length=1)
+
+class BatchMove(BaseModel):
+    op: Literal["move"]
+    id: int
+    folder: Optional[int] = None
+
+BatchOperation = Annotated[Union[BatchDelete, BatchRename, BatchMove], Field(discriminator="op")]
+
+class BatchItemResult(BaseModel):
+    index: int
+    op: str
+    status: int
+    detail: Optional[str] = None
+    file: Optional[FileSchema] = None
+
+class BatchResult(BaseModel):
+    items: List[BatchItemResult]
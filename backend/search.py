@@ -0,0 +1,163 @@
+"""
+Full-text search over file names, paths and text content.
+
+Text is split into words here, not by the database, and every word is
+indexed as "<user_id>_<word>". Each user's files therefore have their own
+posting lists: a query, prefix matching included, only ever reads the
+caller's entries however many files other users have. SQLite keeps them
+in an FTS5 table ranked with bm25; PostgreSQL in tsvectors under a GIN
+index ranked with ts_rank. Names weigh more than paths, paths more than
+content. Every write path in file_operations and batch_operations updates
+the index in its own transaction, so it is never rebuilt.
+"""
+
+import re
+import unicodedata
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import column, delete, table, text
+from sqlalchemy.orm import Session
+from database import IS_SQLITE
+from models import User
+from schemas import SearchHit, SearchPage
+from pagination import encode_cursor, decode_cursor
+from text_reader import SNIFF_BYTES, looks_binary
+from config import SEARCH_CONTENT_MAX_BYTES
+
+WORD = re.compile(r"[^\W_]+")
+MAX_WORD_LENGTH = 64
+MAX_QUERY_WORDS = 8
+
+_key = "rowid" if IS_SQLITE else "file_id"
+_file_search = table("file_search", column(_key))
+
+if IS_SQLITE:
+    _insert = text("INSERT INTO file_search(rowid, name, path, body) VALUES (:id, :name, :path, :body)")
+    _rename = text("UPDATE file_search SET name = :name, path = :path WHERE rowid = :id")
+    _copy = text(
+        "INSERT INTO file_search(rowid, name, path, body) "
+        "SELECT :id, :name, :path, body FROM file_search WHERE rowid = :source_id"
+    )
+    # bm25 weights come from the table's rank option: name 10, path 4, body 1.
+    _search = text(
+        "SELECT f.id, f.filename, f.relative_path, f.is_folder, f.parent_id, f.size, f.mime_type, file_search.rank AS rank "
+        "FROM file_search JOIN user_files f ON f.id = file_search.rowid "
+        "WHERE file_search MATCH :query AND f.user_id = :user_id "
+        "AND (:after_rank IS NULL OR file_search.rank > :after_rank OR (file_search.rank = :after_rank AND file_search.rowid > :after_id)) "
+        "ORDER BY file_search.rank, file_search.rowid LIMIT :limit"
+    )
+else:
+    _names = "setweight(array_to_tsvector(CAST(:name AS text[])), 'A') || setweight(array_to_tsvector(CAST(:path AS text[])), 'B')"
+    _insert = text(
+        f"INSERT INTO file_search(file_id, user_id, names, body) "
+        f"VALUES (:id, :user_id, {_names}, array_to_tsvector(CAST(:body AS text[])))"
+    )
+    _rename = text(f"UPDATE file_search SET names = {_names} WHERE file_id = :id")
+    _copy = text(
+        f"INSERT INTO file_search(file_id, user_id, names, body) "
+        f"SELECT :id, user_id, {_names}, body FROM file_search WHERE file_id = :source_id"
+    )
+    # The cast keeps the cursor's rank exact: ts_rank returns a float4.
+    _search = text(
+        "SELECT f.id, f.filename, f.relative_path, f.is_folder, f.parent_id, f.size, f.mime_type, hits.rank "
+        "FROM (SELECT file_id, CAST(ts_rank(names || body, query) AS float8) AS rank "
+        "      FROM file_search, CAST(:query AS tsquery) query "
+        "      WHERE user_id = :user_id AND names || body @@ query) hits "
+        "JOIN user_files f ON f.id = hits.file_id "
+        "WHERE CAST(:after_rank AS float8) IS NULL OR hits.rank < :after_rank OR (hits.rank = :after_rank AND hits.file_id > :after_id) "
+        "ORDER BY hits.rank DESC, hits.file_id LIMIT :limit"
+    )
+
+
+def words(value: Optional[str]) -> List[str]:
+    """Lower-cased words with diacritics removed, as both the index and queries see them."""
+    if not value:
+        return []
+    value = value.lower()
+    if not value.isascii():
+        value = "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c))
+    return [word for word in WORD.findall(value) if len(word) <= MAX_WORD_LENGTH]
+
+def _terms(user_id: int, value: Optional[str]) -> List[str]:
+    prefix = f"{user_id}_"
+    return [prefix + word for word in words(value)]
+
+def _document(file_id: int, user_id: int, filename: str, relative_path: str, content: Optional[str] = None) -> dict:
+    terms = {
+        "id": file_id,
+        "user_id": user_id,
+        "name": _terms(user_id, filename),
+        "path": _terms(user_id, str(Path(relative_path).parent)),
+        "body": _terms(user_id, content),
+    }
+    if IS_SQLITE:
+        # FTS5 splits on spaces; "_" is declared a token character, so each term stays whole.
+        for column_name in ("name", "path", "body"):
+            terms[column_name] = " ".join(terms[column_name])
+    return terms
+
+def extract_text(path: Path) -> Optional[str]:
+    """The first SEARCH_CONTENT_MAX_BYTES of a file read_file_content would serve as text, else None."""
+    with path.open("rb") as f:
+        head = f.read(SNIFF_BYTES)
+        if looks_binary(head):
+            return None
+        head += f.read(max(0, SEARCH_CONTENT_MAX_BYTES - len(head)))
+    # The limit may cut a character in half.
+    return head.decode("utf-8", errors="ignore")
+
+def index(db: Session, entries: Iterable[Tuple[int, int, str, str, Optional[str]]]):
+    """(Re)index (file_id, user_id, filename, relative_path, content) rows. The caller commits."""
+    documents = [_document(*entry) for entry in entries]
+    if documents:
+        remove(db, [document["id"] for document in documents])
+        db.execute(_insert, documents)
+
+def remove(db: Session, file_ids):
+    """Drop the entries of a list of ids or a SELECT of them. The caller commits."""
+    if isinstance(file_ids, list) and not file_ids:
+        return
+    db.execute(delete(_file_search).where(_file_search.c[_key].in_(file_ids)))
+
+def rename(db: Session, entries: Iterable[Tuple[int, int, str, str]]):
+    """Re-index the name and path of (file_id, user_id, filename, relative_path) rows, keeping their content."""
+    documents = [_document(*entry) for entry in entries]
+    if documents:
+        db.execute(_rename, documents)
+
+def copy(db: Session, entries: Iterable[Tuple[int, int, int, str, str]]):
+    """Index (source_id, file_id, user_id, filename, relative_path) copies with their source's content."""
+    documents = [{**_document(*entry), "source_id": source_id} for source_id, *entry in entries]
+    if documents:
+        db.execute(_copy, documents)
+
+def _query(user_id: int, q: str) -> str:
+    terms = _terms(user_id, q)[:MAX_QUERY_WORDS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="The query has no searchable words")
+    # Every word must match, each as a prefix so results follow the user's typing.
+    if IS_SQLITE:
+        return " AND ".join(f'"{term}"*' for term in terms)
+    return " & ".join(f"'{term}':*" for term in terms)
+
+def search(db: Session, user: User, q: str, limit: int, cursor: Optional[str] = None) -> SearchPage:
+    after_rank, after_id = decode_cursor(cursor) if cursor else (None, None)
+    rows = db.execute(_search, {
+        "query": _query(user.id, q),
+        "user_id": user.id,
+        "after_rank": after_rank,
+        "after_id": after_id,
+        "limit": limit + 1,
+    }).all()
+    next_cursor = encode_cursor(rows[limit - 1].rank, rows[limit - 1].id) if len(rows) > limit else None
+    return SearchPage(
+        items=[
+            SearchHit(
+                id=row.id, name=row.filename, path=row.relative_path, is_folder=bool(row.is_folder),
+                folder=row.parent_id, size=row.size, mime_type=row.mime_type,
+            )
+            for row in rows[:limit]
+        ],
+        next_cursor=next_cursor,
+    )
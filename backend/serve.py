@@ -0,0 +1,165 @@
+"""
+Production launcher: migrate once, then serve from N pre-forked workers.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The schema is upgraded here, once, before any worker exists, and the
+workers start with MIGRATE_ON_STARTUP off, so restarts and scale-ups never
+have workers racing each other through Alembic. Pass --no-migrate when
+migrations run as a separate deploy step (`python database.py`).
+
+The app is imported in this process and the workers are forked from it
+with the listening socket already bound: a new worker shares the imported
+code copy-on-write and only runs the app's lifespan before it serves.
+Caches are shared between workers through a SQLite file on tmpfs
+(SHARED_CACHE_PATH, a file in /dev/shm by default) and Prometheus samples
+go to PROMETHEUS_MULTIPROC_DIR, so /metrics covers every worker. A worker
+that dies is replaced; SIGTERM or SIGINT stops them all gracefully.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+# Before anything imports config: this process migrates, the workers must not.
+os.environ["MIGRATE_ON_STARTUP"] = "false"
+
+logger = logging.getLogger("uvicorn.error")
+
+# A worker dying sooner than this after its start is replaced only after this long.
+RESPAWN_BACKOFF_SECONDS = 1
+STOP_TIMEOUT_SECONDS = 30
+
+
+def default_shared_cache_path(port: int) -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"file-storage-cache-{port}.sqlite")
+
+def prepare_metrics_dir() -> tuple:
+    """Point prometheus_client at an empty directory; returns it and whether it should be removed at exit."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        directory = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+        return directory, True
+    os.makedirs(directory, exist_ok=True)
+    # Samples left by a previous run would be added to this one's.
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.unlink(os.path.join(directory, name))
+    return directory, False
+
+def run_worker(config, sock):
+    import uvicorn
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+        signal.signal(signum, signal.SIG_DFL)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    import config as settings
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.WEB_WORKERS)
+    parser.add_argument("--no-migrate", action="store_true", help="the schema is upgraded by a separate step")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    metrics_dir, remove_metrics_dir = prepare_metrics_dir() if args.workers > 1 else (None, False)
+
+    import uvicorn
+    import database
+    import shared_cache
+
+    started = time.perf_counter()
+    if not args.no_migrate:
+        database.run_migrations()
+    cache_path = settings.SHARED_CACHE_PATH
+    if args.workers > 1 and not cache_path:
+        cache_path = default_shared_cache_path(args.port)
+    if cache_path:
+        # Entries written before this launch may predate changes made while it was down.
+        shared_cache.configure(cache_path, clear=True)
+    import main as app_module
+
+    config = uvicorn.Config(app_module.app, host=args.host, port=args.port, log_level=args.log_level)
+    sock = config.bind_socket()
+    # Connections opened by the migrations belong to this process; each worker opens its own.
+    database.engine.dispose()
+    logger.info("Loaded the app in %.0f ms, starting %d workers", (time.perf_counter() - started) * 1000, args.workers)
+
+    workers = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(config, sock)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def signal_workers(signum):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            logger.info("Stopping %d workers", len(workers))
+            signal_workers(signal.SIGTERM)
+            signal.alarm(STOP_TIMEOUT_SECONDS)
+
+    def kill(signum, frame):
+        logger.warning("Workers did not stop within %d s, killing them", STOP_TIMEOUT_SECONDS)
+        signal_workers(signal.SIGKILL)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGALRM, kill)
+    for _ in range(args.workers):
+        spawn()
+
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started_at = workers.pop(pid, None)
+            if started_at is None or stopping:
+                continue
+            logger.warning("Worker %d exited with code %d, starting a new one", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started_at < RESPAWN_BACKOFF_SECONDS:
+                time.sleep(RESPAWN_BACKOFF_SECONDS)
+            if not stopping:
+                spawn()
+    finally:
+        sock.close()
+        if remove_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        if cache_path and not settings.SHARED_CACHE_PATH:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(cache_path + suffix)
+                except FileNotFoundError:
+                    pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Key-value cache shared by the worker processes on one host.
+
+Workers started by serve.py are separate processes, so plain in-process
+caches would each start cold and keep missing entries another worker has
+just filled, and an invalidation in one worker would not reach the others.
+This store is a SQLite file on tmpfs: a read is a primary-key lookup with no
+network hop, a write is visible to every worker at once, and nothing extra
+has to be installed or run. Entries expire after their TTL, and once the
+file holds more than SHARED_CACHE_MAX_BYTES the oldest are dropped.
+
+Values are bytes; callers encode them. It is a cache: every caller can
+recompute what it misses, so SQLite errors are logged and read as misses.
+Without SHARED_CACHE_PATH (and unless serve.py configures one) nothing is
+shared and callers keep their in-process caches.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from config import SHARED_CACHE_PATH, SHARED_CACHE_MAX_BYTES
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_SECONDS = 1
+# The total size is checked once per this many writes from a process.
+TRIM_EVERY = 256
+# Trimming goes below the limit so it does not run again on the next write.
+TRIM_TARGET = 0.9
+
+
+class SharedCache:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        # A connection must not cross a fork: the child opens its own.
+        if getattr(local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # tmpfs does not survive a reboot anyway.
+            connection.execute("PRAGMA synchronous=OFF")
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def create(self, clear: bool = False):
+        """Create the store if needed; its own connection is closed again, so none is inherited by a fork."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        try:
+            os.chmod(self.path, 0o600)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            if clear:
+                connection.execute("DELETE FROM entries")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("Shared cache read failed: %s", exc)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        # REPLACE gives the row a new rowid, so rowid order is write order for trimming.
+        self._write("INSERT OR REPLACE INTO entries (key, value, size, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, value, len(key) + len(value), time.time() + ttl))
+
+    def add(self, key: str, value: bytes, ttl: float, renew: bool = False) -> bool:
+        """Store `value` only if `key` is absent or expired; True if this call stored it.
+
+        With `renew` an entry that already holds the same value is replaced too, extending it.
+        """
+        now = time.time()
+        condition = "entries.expires_at <= ?" + (" OR entries.value = excluded.value" if renew else "")
+        try:
+            cursor = self._connection().execute(
+                "INSERT INTO entries (key, value, size, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, expires_at = excluded.expires_at "
+                "WHERE " + condition,
+                (key, value, len(key) + len(value), now + ttl, now),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("Shared cache write failed: %s", exc)
+            # Better two workers doing the same work than none.
+            return True
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._write("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str):
+        self._write("DELETE FROM entries WHERE key >= ? AND key < ?", _prefix_range(prefix))
+
+    def count_prefix(self, prefix: str) -> int:
+        """Live entries whose key starts with `prefix`, across all workers."""
+        try:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM entries WHERE key >= ? AND key < ? AND expires_at > ?", (*_prefix_range(prefix), time.time())
+            ).fetchone()[0]
+        except sqlite3.Error as exc:
+            logger.warning("Shared cache read failed: %s", exc)
+            return 0
+
+    def clear(self):
+        self._write("DELETE FROM entries", ())
+
+    def _write(self, statement: str, parameters: tuple):
+        try:
+            self._connection().execute(statement, parameters)
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                self.trim()
+        except sqlite3.Error as exc:
+            logger.warning("Shared cache write failed: %s", exc)
+
+    def trim(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest writes first, up to the row where the running total covers the excess.
+        connection.execute(
+            "DELETE FROM entries WHERE rowid <= ("
+            "  SELECT rowid FROM (SELECT rowid, SUM(size) OVER (ORDER BY rowid) AS freed FROM entries)"
+            "  WHERE freed >= ? ORDER BY rowid LIMIT 1)",
+            (total - int(self.max_bytes * TRIM_TARGET),),
+        )
+
+    def stats(self) -> dict:
+        """This process's hits and misses; entries and bytes are those of the whole store."""
+        try:
+            entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        return {"size": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+def _prefix_range(prefix: str) -> tuple:
+    # Keys from `prefix` up to, but not including, the prefix with its last character incremented.
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+store: Optional[SharedCache] = None
+
+
+def configure(path: str, max_bytes: int = SHARED_CACHE_MAX_BYTES, clear: bool = False) -> SharedCache:
+    """Share caches through the store at `path`, creating it if needed. Call before workers start."""
+    global store
+    store = SharedCache(path, max_bytes)
+    store.create(clear)
+    metrics.register_cache("shared", store.stats)
+    return store
+
+def claim(name: str, ttl: float, renew: bool = False) -> bool:
+    """Take a host-wide claim on `name` for at most `ttl` seconds; always granted when nothing is shared.
+
+    With `renew` a claim this process already holds is extended instead of refused.
+    """
+    if store is None:
+        return True
+    return store.add(f"claim:{name}", str(os.getpid()).encode(), ttl, renew)
+
+def release(name: str):
+    if store is not None:
+        store.delete(f"claim:{name}")
+
+
+if SHARED_CACHE_PATH:
+    configure(SHARED_CACHE_PATH)
@@ -0,0 +1,66 @@
+"""
+Keyset pagination across rows whose sort value is NULL.
+
+    cd backend && python -m pytest tests
+"""
+
+import pytest
+from sqlalchemy import BigInteger, Column, Integer, create_engine, event
+from sqlalchemy.orm import Session, declarative_base
+
+from pagination import paginate
+
+Base = declarative_base()
+
+
+class Row(Base):
+    __tablename__ = "rows"
+
+    id = Column(Integer, primary_key=True)
+    size = Column(BigInteger, nullable=True)
+
+
+SIZES = [None, 5, None, 1, 5, None, 3, 1, None]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(Row(id=i, size=size) for i, size in enumerate(SIZES, start=1))
+        session.commit()
+        yield session
+
+
+def all_pages(db, limit, descending):
+    seen, cursor = [], None
+    while True:
+        rows, cursor = paginate(db.query(Row), Row.size, Row.id, limit=limit, cursor=cursor, descending=descending)
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            return seen
+        assert len(seen) <= len(SIZES), "paging does not terminate"
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_ascending_pages_nulls_first(db, limit):
+    nulls = [i for i, size in enumerate(SIZES, start=1) if size is None]
+    sized = sorted((size, i) for i, size in enumerate(SIZES, start=1) if size is not None)
+    assert all_pages(db, limit, descending=False) == nulls + [i for _, i in sized]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_descending_pages_nulls_last(db, limit):
+    nulls = [i for i, size in enumerate(SIZES, start=1) if size is None]
+    sized = sorted(((size, i) for i, size in enumerate(SIZES, start=1) if size is not None), reverse=True)
+    assert all_pages(db, limit, descending=True) == [i for _, i in sized] + nulls[::-1]
+
+
+@pytest.mark.parametrize("descending, nulls", [(False, "NULLS FIRST"), (True, "NULLS LAST")])
+def test_null_order_is_explicit(db, descending, nulls):
+    # PostgreSQL sorts NULLs the other way round by default, so the ORDER BY must say where they go.
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    paginate(db.query(Row), Row.size, Row.id, limit=2, descending=descending)
+    assert statements[-1].split("ORDER BY")[1].count(nulls) == 2
@@ -0,0 +1,303 @@
+"""
+Paged reads of text files with a shared LRU cache of hot file contents.
+
+Files up to TEXT_CACHE_MAX_FILE_BYTES are read once per version (blob or
+file id, mtime, size) and kept in memory together with their line index and the
+encoded response bodies already sent; larger files are paged straight out
+of an mmap. Responses are gzip-compressed, or brotli-compressed when the
+optional `brotli` package is installed and the client accepts it. With a
+shared cache configured, encoded pages are also stored there, so a page
+one worker has built is served by the others without reading the file.
+"""
+
+import codecs
+import gzip
+import json
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import Response
+from config import TEXT_CACHE_MAX_BYTES, TEXT_CACHE_MAX_FILE_BYTES, READ_MAX_PAGE_BYTES
+from schemas import ReadQuery
+import metrics
+import shared_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SNIFF_BYTES = 8192
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+MAX_BODIES_PER_FILE = 8
+SCAN_CHUNK_BYTES = 256 * 1024
+SHARED_PREFIX = "text:"
+# Keys include the file version, so this only bounds how long unused pages linger.
+SHARED_TTL_SECONDS = 3600
+
+
+def looks_binary(prefix: bytes) -> bool:
+    if b"\0" in prefix:
+        return True
+    try:
+        # Not final: the prefix may end in the middle of a multi-byte character.
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+class TextFile:
+    """One version of a file's bytes plus the derived state paging needs.
+
+    Lines are only scanned as far as a request asks for. A cached file keeps
+    every line offset found so far; an mmapped one, which lives for a single
+    request, only remembers where its scan stopped.
+    """
+
+    def __init__(self, data, size: int, index_lines: bool = True):
+        self.data = data
+        self.size = size
+        self.binary = looks_binary(bytes(data[:SNIFF_BYTES]))
+        self.bodies = OrderedDict()
+        self._line_starts = array("Q", [0]) if index_lines else None
+        self._scanned = (0, 0)
+        self._scan_lock = threading.Lock()
+
+    def line_offset(self, line: int) -> int:
+        """Offset at which `line` (0-based) starts, or the file size past the last line."""
+        with self._scan_lock:
+            starts = self._line_starts
+            if starts is not None:
+                if line < len(starts):
+                    return starts[line]
+                found, position = len(starts) - 1, starts[-1]
+            else:
+                found, position = self._scanned if self._scanned[0] <= line else (0, 0)
+                found, position = self._skip_chunks(found, position, line)
+            find = self.data.find
+            while found < line:
+                newline = find(b"\n", position)
+                if newline == -1:
+                    break
+                found, position = found + 1, newline + 1
+                if starts is not None:
+                    starts.append(position)
+            if starts is None:
+                self._scanned = (found, position)
+            return position if found == line else self.size
+
+    def _skip_chunks(self, found: int, position: int, line: int):
+        """Move (line, offset) on by whole chunks that end before `line`, counting their newlines in C."""
+        scan = position
+        while True:
+            chunk = self.data[scan:scan + SCAN_CHUNK_BYTES]
+            newlines = chunk.count(b"\n")
+            if not chunk or found + newlines >= line:
+                return found, position
+            if newlines:
+                found, position = found + newlines, scan + chunk.rfind(b"\n") + 1
+            scan += len(chunk)
+
+    @property
+    def cost(self) -> int:
+        index = len(self._line_starts) * 8 if self._line_starts is not None else 0
+        return self.size + index + sum(len(body) for _, body in self.bodies.values())
+
+
+class ContentCache:
+    def __init__(self, max_bytes: int, max_file_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[TextFile]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: TextFile):
+        with self._lock:
+            stale = self._versions.get(key[0])
+            if stale is not None and stale != key:
+                self._entries.pop(stale, None)
+            self._versions[key[0]] = key
+            self._entries[key] = entry
+            self._trim()
+
+    def add_body(self, entry: TextFile, body_key, encoding: Optional[str], body: bytes):
+        with self._lock:
+            entry.bodies[body_key] = (encoding, body)
+            while len(entry.bodies) > MAX_BODIES_PER_FILE:
+                entry.bodies.popitem(last=False)
+            self._trim()
+
+    def _trim(self):
+        total = sum(entry.cost for entry in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            if self._versions.get(key[0]) == key:
+                del self._versions[key[0]]
+            total -= entry.cost
+
+    def load(self, key, path: Path) -> TextFile:
+        """Cached version of `path`, reading it at most once even when many requests miss together."""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            lock = self._loading.setdefault(key, threading.Lock())
+        with lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = TextFile(path.read_bytes(), key[2])
+                self.put(key, entry)
+        with self._lock:
+            self._loading.pop(key, None)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": sum(entry.cost for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+content_cache = ContentCache(TEXT_CACHE_MAX_BYTES, TEXT_CACHE_MAX_FILE_BYTES)
+metrics.register_cache("content", content_cache.stats)
+
+
+def version(cache_id, path: Path) -> tuple:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found on disk")
+    return (cache_id, stat.st_mtime_ns, stat.st_size)
+
+@contextmanager
+def open_text(key: tuple, path: Path):
+    """The file version `key` (see version()) from the cache, or mmapped when too large to cache."""
+    if key[2] <= content_cache.max_file_bytes:
+        yield content_cache.load(key, path), True
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield TextFile(data, key[2], index_lines=False), False
+
+
+def _is_continuation(data, position: int) -> bool:
+    return data[position] & 0xC0 == 0x80
+
+def _page(text: TextFile, start: int, end: int) -> dict:
+    """Slice [start, end) moved onto UTF-8 character boundaries and capped at READ_MAX_PAGE_BYTES."""
+    start = min(start, text.size)
+    while start < text.size and _is_continuation(text.data, start):
+        start += 1
+    end = min(end, start + READ_MAX_PAGE_BYTES, text.size)
+    while start < end < text.size and _is_continuation(text.data, end):
+        end -= 1
+    return {
+        "content": text.data[start:end].decode("utf-8", "replace"),
+        "offset": start,
+        "length": end - start,
+        "size": text.size,
+        "next_offset": end if end < text.size else None,
+    }
+
+def read_page(text: TextFile, params: ReadQuery) -> dict:
+    by_line = params.line is not None or params.lines is not None
+    if by_line and (params.offset is not None or params.length is not None):
+        raise HTTPException(status_code=400, detail="Page by offset/length or by line/lines, not both")
+    if not by_line:
+        offset = params.offset or 0
+        return _page(text, offset, offset + (params.length or READ_MAX_PAGE_BYTES))
+
+    line = params.line or 0
+    last = line + (params.lines or 1)
+    start = text.line_offset(line)
+    end = text.line_offset(last)
+    page = _page(text, start, end)
+    complete = page["offset"] + page["length"] == end
+    page["line"] = line
+    # A page cut short by READ_MAX_PAGE_BYTES continues by offset, not by line.
+    page["next_line"] = last if complete and end < text.size else None
+    return page
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, quality = part.strip().partition(";")
+        if quality.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def _encode(payload: dict, encoding: Optional[str]) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    if encoding == "br":
+        return brotli.compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return body
+
+def _response(encoding: Optional[str], body: bytes) -> Response:
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def read_response(file_id: int, name: str, path: Path, params: ReadQuery, accept_encoding: str = "", cache_id=None) -> Response:
+    key = version(cache_id or file_id, path)
+    accepted = negotiate_encoding(accept_encoding)
+    body_key = (file_id, name, params.offset, params.length, params.line, params.lines, accepted)
+    shared_key = f"{SHARED_PREFIX}{key!r}{body_key!r}" if shared_cache.store is not None else None
+    if shared_key:
+        value = shared_cache.store.get(shared_key)
+        if value is not None:
+            encoding, _, body = value.partition(b"\n")
+            return _response(encoding.decode() or None, body)
+
+    with open_text(key, path) as (text, cached):
+        if text.binary:
+            raise HTTPException(status_code=400, detail="File is not a text file")
+
+        encoding, body = text.bodies.get(body_key, (None, None))
+        if body is None:
+            payload = {"id": file_id, "name": name, **read_page(text, params)}
+            encoding = accepted if len(payload["content"]) >= MIN_COMPRESS_BYTES else None
+            body = _encode(payload, encoding)
+            if cached:
+                content_cache.add_body(text, body_key, encoding, body)
+        if shared_key:
+            shared_cache.store.set(shared_key, (encoding or "").encode() + b"\n" + body, SHARED_TTL_SECONDS)
+
+    return _response(encoding, body)
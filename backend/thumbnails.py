@@ -0,0 +1,194 @@
+"""
+Thumbnail cache for image files and the background pipeline that renders it.
+"""
+
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from database import SessionLocal
+from models import UserFile
+from config import THUMBNAIL_DIR, THUMBNAIL_WORKERS, THUMBNAIL_PENDING_TIMEOUT_SECONDS, BASE_URL
+import metrics
+import shared_cache
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+# Rendered largest first so each size is downscaled from the previous one.
+THUMBNAIL_SIZES = {
+    "preview": (800, 800),
+    "retina": (200, 200),
+    "icon": (100, 100),
+}
+DEFAULT_ICON_URL = f"{BASE_URL}/path/to/default/icon.png"
+PENDING_ICON_URL = f"{BASE_URL}/path/to/pending/icon.png"
+THUMBNAILS_URL = f"{BASE_URL}/api/thumbnails"
+
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# Thumbnails of content-addressed rows are shared by every row with the same blob.
+BLOB_THUMBNAIL_DIR = "blobs"
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Renders in flight per blob, so concurrent uploads of one image render it once.
+# Across workers the same is done with a shared claim that outlives a stuck render by this much.
+_rendering: Dict[str, Future] = {}
+RENDER_CLAIM_SECONDS = 300
+
+
+def is_image(filename: str) -> bool:
+    return Path(filename).suffix.lower() in IMAGE_EXTENSIONS
+
+def content_key(file_path: Path) -> str:
+    stat = file_path.stat()
+    return hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+def _location(username: str, file: UserFile) -> Tuple[str, str]:
+    """Directory under THUMBNAIL_DIR and file name prefix of a row's thumbnails."""
+    if file.blob_sha:
+        return BLOB_THUMBNAIL_DIR, file.blob_sha
+    return username, f"{file.id}_{file.thumbnail_key}"
+
+def thumbnail_name(username: str, file: UserFile, size: str = "icon") -> str:
+    directory, prefix = _location(username, file)
+    return f"{directory}/{prefix}_{size}.webp"
+
+def thumbnail_files(username: str, file: UserFile) -> List[Path]:
+    """Thumbnails owned by this row alone; shared blob thumbnails are removed with the blob."""
+    if not file.thumbnail_key or file.blob_sha:
+        return []
+    return [Path(THUMBNAIL_DIR) / thumbnail_name(username, file, size) for size in THUMBNAIL_SIZES]
+
+def blob_thumbnail_files(sha256: str) -> List[Path]:
+    return [Path(THUMBNAIL_DIR) / BLOB_THUMBNAIL_DIR / f"{sha256}_{size}.webp" for size in THUMBNAIL_SIZES]
+
+def thumbnail_links(username: str, file: UserFile) -> Tuple[str, Dict[str, str]]:
+    """The icon URL of a row and the URL of every size; `file` may also be a row of selected columns."""
+    if file.thumbnail_status != STATUS_READY:
+        return (PENDING_ICON_URL if file.thumbnail_status == STATUS_PENDING else DEFAULT_ICON_URL), {}
+    directory, prefix = _location(username, file)
+    base = f"{THUMBNAILS_URL}/{directory}/{prefix}_"
+    return base + "icon.webp", {size: f"{base}{size}.webp" for size in THUMBNAIL_SIZES}
+
+def render_thumbnails(source: str, destination_dir: str, prefix: str) -> float:
+    """Render every size in THUMBNAIL_SIZES and return the seconds it took. Runs inside a pool worker process."""
+    # Imported here: PIL is only needed by the render workers, not to start the app.
+    from PIL import Image
+
+    started = time.perf_counter()
+    Path(destination_dir).mkdir(parents=True, exist_ok=True)
+    with Image.open(source) as img:
+        img.load()
+        for size_name, size in THUMBNAIL_SIZES.items():
+            img.thumbnail(size)
+            img.save(Path(destination_dir) / f"{prefix}_{size_name}.webp", "WEBP")
+    return time.perf_counter() - started
+
+def is_stuck(file: UserFile) -> bool:
+    """Pending for longer than any render takes, or since before queue times were kept; `file` may be a row of selected columns."""
+    if file.thumbnail_status != STATUS_PENDING:
+        return False
+    return file.thumbnail_queued_at is None or \
+        file.thumbnail_queued_at < datetime.utcnow() - timedelta(seconds=THUMBNAIL_PENDING_TIMEOUT_SECONDS)
+
+def schedule_thumbnail(username: str, file: UserFile, file_path: Optional[Path]) -> bool:
+    """Mark `file` as pending and hand it to the pipeline once the caller commits.
+
+    Returns True if the row changed; the caller is responsible for committing.
+    If the cached thumbnails already match the file content nothing is scheduled,
+    unless the row is stuck pending because its render was lost.
+    The key comes from the stored SHA-256; `file_path` is only stat-ed for rows without one.
+    """
+    if not is_image(file.filename):
+        return False
+
+    key = file.sha256[:16] if file.sha256 else content_key(file_path)
+    if key == file.thumbnail_key and file.thumbnail_status in (STATUS_PENDING, STATUS_READY) and not is_stuck(file):
+        return False
+
+    remove_thumbnail(username, file)
+    file.thumbnail_key = key
+    # Another row with the same blob may have rendered it already.
+    rendered = file.blob_sha and all(path.exists() for path in blob_thumbnail_files(file.blob_sha))
+    file.thumbnail_status = STATUS_READY if rendered else STATUS_PENDING
+    file.thumbnail_queued_at = None if rendered else datetime.utcnow()
+    return True
+
+def submit(username: str, file: UserFile, file_path: Path):
+    """Start rendering a committed pending row; rendered inline when the pipeline is not running."""
+    if file.thumbnail_status != STATUS_PENDING:
+        return
+
+    directory, prefix = _location(username, file)
+    future = _rendering.get(prefix) if file.blob_sha else None
+    if future is None:
+        if file.blob_sha and not shared_cache.claim(f"thumbnail:{prefix}", RENDER_CLAIM_SECONDS):
+            # Another worker is rendering this blob; when done it marks every pending row of the blob.
+            return
+        future = _render(file_path, directory, prefix)
+        if file.blob_sha:
+            # Released before _finish runs, so a row committed while the claim was held is always updated.
+            future.add_done_callback(lambda _: shared_cache.release(f"thumbnail:{prefix}"))
+            if not future.done():
+                _rendering[prefix] = future
+                future.add_done_callback(lambda _: _rendering.pop(prefix, None))
+
+    file_id, blob_sha, key = file.id, file.blob_sha, file.thumbnail_key
+    future.add_done_callback(lambda done: _finish(file_id, blob_sha, key, done))
+
+def _render(file_path: Path, directory: str, prefix: str) -> Future:
+    args = (str(file_path), str(Path(THUMBNAIL_DIR) / directory), prefix)
+    if _executor is not None:
+        future = _executor.submit(render_thumbnails, *args)
+    else:
+        future = Future()
+        try:
+            future.set_result(render_thumbnails(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+    future.add_done_callback(metrics.observe_thumbnail)
+    return future
+
+def _finish(file_id: int, blob_sha: Optional[str], key: str, future: Future):
+    status = STATUS_READY
+    if future.exception() is not None:
+        logger.warning("Thumbnail rendering failed for file %s: %s", file_id, future.exception())
+        status = STATUS_FAILED
+
+    db = SessionLocal()
+    try:
+        # The row may have been re-uploaded or deleted while the job was running.
+        rows = [UserFile.id == file_id]
+        if blob_sha:
+            # Rows of the same blob that were not given their own render, possibly by another worker.
+            rows = [UserFile.blob_sha == blob_sha, UserFile.thumbnail_status == STATUS_PENDING]
+        db.query(UserFile).filter(*rows, UserFile.thumbnail_key == key).update(
+            {UserFile.thumbnail_status: status}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def remove_thumbnail(username: str, file: UserFile):
+    for path in thumbnail_files(username, file):
+        path.unlink(missing_ok=True)
+    file.thumbnail_key = None
+    file.thumbnail_status = None
+    file.thumbnail_queued_at = None
+
+def start_pipeline():
+    global _executor
+    if _executor is None and THUMBNAIL_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+
+def stop_pipeline():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
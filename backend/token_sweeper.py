@@ -0,0 +1,67 @@
+"""
+Periodic background purge of expired refresh tokens.
+
+Under serve.py the workers share a claim, so only one of them sweeps.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from database import SessionLocal
+from config import TOKEN_SWEEP_INTERVAL_SECONDS, TOKEN_SWEEP_BATCH_SIZE
+import shared_cache
+import user_operations
+
+logger = logging.getLogger(__name__)
+
+CLAIM_NAME = "token_sweeper"
+
+_task: Optional[asyncio.Task] = None
+_holding = False
+
+
+def sweep_once() -> int:
+    """Purge expired tokens batch by batch, committing each batch so locks stay short."""
+    total = 0
+    db = SessionLocal()
+    try:
+        while True:
+            deleted = user_operations.purge_expired_refresh_tokens(db, TOKEN_SWEEP_BATCH_SIZE)
+            total += deleted
+            if deleted < TOKEN_SWEEP_BATCH_SIZE:
+                return total
+    finally:
+        db.close()
+
+async def _run():
+    global _holding
+    while True:
+        await asyncio.sleep(TOKEN_SWEEP_INTERVAL_SECONDS)
+        _holding = shared_cache.claim(CLAIM_NAME, TOKEN_SWEEP_INTERVAL_SECONDS * 3, renew=True)
+        if not _holding:
+            continue
+        try:
+            purged = await run_in_threadpool(sweep_once)
+            if purged:
+                logger.info("Purged %d expired refresh tokens", purged)
+        except Exception:
+            logger.exception("Refresh token sweep failed")
+
+def start():
+    global _task
+    if _task is None and TOKEN_SWEEP_INTERVAL_SECONDS > 0:
+        _task = asyncio.create_task(_run())
+
+async def stop():
+    global _task, _holding
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        if _holding:
+            shared_cache.release(CLAIM_NAME)
+            _holding = False
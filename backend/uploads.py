@@ -0,0 +1,241 @@
+"""
+Chunked, resumable uploads.
+
+A client opens a session, PUTs consecutive byte ranges at the offset the
+server reports, and finalizes it. Chunks are streamed from the request body
+into a part file next to the user data (so finalizing links it into the
+blob store instead of copying it) and hashed on the way. After a dropped connection the client asks for
+the session and resumes from `received`.
+
+Chunk requests for one upload may reach different worker processes, so
+they are serialized through the session row: a request takes a write
+lease with a conditional UPDATE at the offset it writes from, renews it
+while the body streams and hands it back together with the new
+`received`. A lease left by a dead worker expires after
+UPLOAD_WRITE_LEASE_SECONDS. Bytes below `received` are never rewritten,
+which keeps a process's running digest valid whenever its byte count
+still matches.
+"""
+
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+from models import User, UploadSession
+from schemas import UploadInit, UploadStatus, FileSchema
+from config import UPLOAD_TMP_DIR, UPLOAD_SESSION_TTL_HOURS, UPLOAD_WRITE_LEASE_SECONDS
+import blob_store
+import file_operations
+import quotas
+import reaper
+
+# Running SHA-256 per session, valid only while its byte count matches `received`.
+_digests: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+
+
+def part_path(upload_id: str) -> Path:
+    return Path(UPLOAD_TMP_DIR) / f"{upload_id}.part"
+
+def _status(session: UploadSession) -> UploadStatus:
+    return UploadStatus(
+        id=session.id,
+        filename=session.filename,
+        folder=session.folder_id,
+        size=session.size,
+        received=session.received,
+        expires_at=session.expires_at
+    )
+
+def create_session(db: Session, user: User, init: UploadInit) -> UploadStatus:
+    purge_expired_sessions(db)
+    file_operations.upload_target(db, user, init.filename, init.folder)
+    quotas.check(db, user, init.size or 0)
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        folder_id=init.folder,
+        filename=init.filename,
+        size=init.size,
+        content_type=init.content_type,
+        received=0,
+        created_at=datetime.utcnow(),
+        expires_at=datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    )
+    part_path(session.id).parent.mkdir(parents=True, exist_ok=True)
+    part_path(session.id).touch()
+    db.add(session)
+    db.commit()
+    return _status(session)
+
+def get_session(db: Session, user: User, upload_id: str) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id, UploadSession.user_id == user.id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def get_status(db: Session, user: User, upload_id: str) -> UploadStatus:
+    return _status(get_session(db, user, upload_id))
+
+def _acquire(db: Session, session: UploadSession, offset: int) -> str:
+    """Take the write lease of `session` at `offset` and return its token; 409 while another request holds it."""
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    if offset == session.received:
+        taken = db.query(UploadSession).filter(
+            UploadSession.id == session.id,
+            UploadSession.received == offset,
+            or_(UploadSession.writer == None, UploadSession.writer_expires_at < now)
+        ).update(
+            {UploadSession.writer: token, UploadSession.writer_expires_at: now + timedelta(seconds=UPLOAD_WRITE_LEASE_SECONDS)},
+            synchronize_session=False
+        )
+        db.commit()
+        if taken:
+            return token
+    if offset != session.received:
+        raise HTTPException(
+            status_code=409,
+            detail="Offset does not match the bytes received so far",
+            headers={"Upload-Offset": str(session.received)}
+        )
+    raise HTTPException(
+        status_code=409,
+        detail="Another request is writing to this upload",
+        headers={"Upload-Offset": str(session.received), "Retry-After": str(int(UPLOAD_WRITE_LEASE_SECONDS))}
+    )
+
+def _renew(db: Session, upload_id: str, token: str) -> bool:
+    renewed = db.query(UploadSession).filter(UploadSession.id == upload_id, UploadSession.writer == token).update(
+        {UploadSession.writer_expires_at: datetime.utcnow() + timedelta(seconds=UPLOAD_WRITE_LEASE_SECONDS)},
+        synchronize_session=False
+    )
+    db.commit()
+    return bool(renewed)
+
+def _release(db: Session, upload_id: str, token: str, received: int) -> bool:
+    """Record `received` and give the lease back; False if it was lost to another request."""
+    released = db.query(UploadSession).filter(UploadSession.id == upload_id, UploadSession.writer == token).update(
+        {UploadSession.received: received, UploadSession.writer: None, UploadSession.writer_expires_at: None},
+        synchronize_session=False
+    )
+    db.commit()
+    return bool(released)
+
+def _digest_for(session: UploadSession):
+    cached = _digests.get(session.id)
+    if cached and cached[0] == session.received:
+        return cached[1]
+    # Resumed in another process or after a restart: re-hash what is already on disk.
+    digest = hashlib.sha256()
+    remaining = session.received
+    with part_path(session.id).open("rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(blob_store.COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+def _open_at(upload_id: str, offset: int):
+    path = part_path(upload_id)
+    if path.stat().st_nlink > 1:
+        # A complete() that failed after linking the part into the blob store: never write through to a blob.
+        partial = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(path, partial)
+        os.replace(partial, path)
+    f = path.open("r+b")
+    # Drop any tail written past the last recorded offset by an interrupted request.
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+def _write(f, digest, chunk: bytes):
+    f.write(chunk)
+    digest.update(chunk)
+
+async def write_chunk(db: Session, user: User, upload_id: str, offset: int, body: AsyncIterator[bytes]) -> UploadStatus:
+    session = await run_in_threadpool(get_session, db, user, upload_id)
+    size = session.size
+    token = await run_in_threadpool(_acquire, db, session, offset)
+    received, digest = offset, None
+    try:
+        # Without a declared size, an upload is stopped once what it already sent no longer fits.
+        await run_in_threadpool(quotas.check, db, user, size or offset)
+
+        digest = await run_in_threadpool(_digest_for, session)
+        f = await run_in_threadpool(_open_at, upload_id, offset)
+        renewed = time.monotonic()
+        try:
+            async for chunk in body:
+                if size is not None and received + len(chunk) > size:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload size")
+                # Checked before writing, so a request that stalled past its lease never writes after the next one.
+                if time.monotonic() - renewed > UPLOAD_WRITE_LEASE_SECONDS / 3:
+                    if not await run_in_threadpool(_renew, db, upload_id, token):
+                        raise HTTPException(status_code=409, detail="Another request took over this upload")
+                    renewed = time.monotonic()
+                await run_in_threadpool(_write, f, digest, chunk)
+                received += len(chunk)
+        except ClientDisconnect:
+            pass
+        finally:
+            await run_in_threadpool(f.close)
+    finally:
+        if await run_in_threadpool(_release, db, upload_id, token, received) and digest is not None:
+            _digests[upload_id] = (received, digest)
+
+    return await run_in_threadpool(_status, session)
+
+def complete(db: Session, user: User, upload_id: str) -> FileSchema:
+    session = get_session(db, user, upload_id)
+    if session.size is not None and session.received != session.size:
+        raise HTTPException(status_code=409, detail="Upload is incomplete", headers={"Upload-Offset": str(session.received)})
+
+    filename, folder_id, size, content_type = session.filename, session.folder_id, session.received, session.content_type
+    # Held while the file is stored, so no chunk request appends to the part file meanwhile.
+    token = _acquire(db, session, size)
+    try:
+        sha256 = _digest_for(session).hexdigest()
+        relative_path = file_operations.upload_target(db, user, filename, folder_id)
+        stored = file_operations.store_file(db, user, filename, folder_id, relative_path, part_path(upload_id), size, sha256, content_type)
+    except BaseException:
+        # The session stays, with its part file, so the client can complete it again.
+        db.rollback()
+        _release(db, upload_id, token, size)
+        raise
+
+    # Removed in its own commit once the file is stored: store_file rolls back on its retry path.
+    db.query(UploadSession).filter(UploadSession.id == upload_id).delete(synchronize_session=False)
+    db.commit()
+    _digests.pop(upload_id, None)
+    reaper.enqueue(part_path(upload_id))
+    return stored
+
+def abort(db: Session, user: User, upload_id: str):
+    session = get_session(db, user, upload_id)
+    db.delete(session)
+    db.commit()
+    _digests.pop(upload_id, None)
+    reaper.enqueue(part_path(upload_id))
+
+def purge_expired_sessions(db: Session, limit: int = 100):
+    expired = db.query(UploadSession.id).filter(UploadSession.expires_at < datetime.utcnow()).limit(limit).all()
+    if not expired:
+        return
+    ids = [row.id for row in expired]
+    db.query(UploadSession).filter(UploadSession.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    for upload_id in ids:
+        _digests.pop(upload_id, None)
+        reaper.enqueue(part_path(upload_id))
@@ -0,0 +1,109 @@
+"""
+TTL/LRU cache of user records used by authentication.
+
+Entries live in this process, or in the shared cache when one is configured,
+so that every worker sees a user cached by another and an invalidation
+(role change, disabling) takes effect in all of them at once.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional
+from models import User
+from config import USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS
+import metrics
+import shared_cache
+
+SHARED_PREFIX = "user:"
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    username: str
+    email: str
+    role: str
+    disabled: bool
+    vk_id: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            disabled=bool(user.disabled),
+            vk_id=user.vk_id,
+        )
+
+
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[CachedUser]:
+        if shared_cache.store is not None and self.maxsize > 0:
+            value = shared_cache.store.get(SHARED_PREFIX + username)
+            with self._lock:
+                if value is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+            return CachedUser(**json.loads(value))
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(username, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: User) -> CachedUser:
+        cached = CachedUser.from_user(user)
+        if self.maxsize <= 0:
+            return cached
+        if shared_cache.store is not None:
+            shared_cache.store.set(SHARED_PREFIX + cached.username, json.dumps(asdict(cached)).encode(), self.ttl)
+            return cached
+        with self._lock:
+            self._entries[cached.username] = (time.monotonic() + self.ttl, cached)
+            self._entries.move_to_end(cached.username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, username: str):
+        if shared_cache.store is not None:
+            shared_cache.store.delete(SHARED_PREFIX + username)
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        if shared_cache.store is not None:
+            shared_cache.store.delete_prefix(SHARED_PREFIX)
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """This process's hits and misses; with a shared cache, size counts the users cached by every worker."""
+        if shared_cache.store is not None and self.maxsize > 0:
+            size = shared_cache.store.count_prefix(SHARED_PREFIX)
+        else:
+            with self._lock:
+                size = len(self._entries)
+        return {"size": size, "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+metrics.register_cache("user", user_cache.stats)
@@ -2,18 +2,29 @@
 Functions for working with users.
 """
 
+import hashlib
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from models import User, RefreshToken
-from schemas import UserCreate
-from password_utils import get_password_hash, verify_password
+from schemas import UserCreate, ListQuery, UserPage
+from pagination import paginate
+from config import REFRESH_TOKEN_EXPIRE_MINUTES
+from password_utils import get_password_hash, verify_and_update_password
+from user_cache import user_cache
 from datetime import datetime, timedelta
+from typing import Optional
 
 def authenticate_user(db: Session, username: str, password: str):
     user = get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = verify_and_update_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Stored hash predates the current cost factor; upgrade it transparently.
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
 def get_user(db: Session, user_id: int):
@@ -22,8 +33,25 @@ def get_user(db: Session, user_id: int):
 def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
+USER_SORT_COLUMNS = {
+    "name": User.username,
+    "created": User.id,
+    "updated": User.id,
+    "size": User.used_bytes,
+}
+
 def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(User).offset(skip).limit(limit).all()
+    return db.query(User).order_by(User.id).offset(skip).limit(limit).all()
+
+def get_users_page(db: Session, params: ListQuery) -> UserPage:
+    query = db.query(User)
+    if params.prefix:
+        query = query.filter(User.username.startswith(params.prefix, autoescape=True))
+    users, next_cursor = paginate(
+        query, USER_SORT_COLUMNS[params.sort], User.id,
+        limit=params.limit, cursor=params.cursor, descending=params.order == "desc"
+    )
+    return UserPage(items=users, next_cursor=next_cursor)
 
 def create_user(db: Session, user: UserCreate):
     hashed_password = get_password_hash(user.password)
@@ -31,25 +59,73 @@ def create_user(db: Session, user: UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    user_cache.invalidate(db_user.username)
     return db_user
 
-def create_refresh_token(db: Session, user_id: int, token: str):
-    db_token = RefreshToken(user_id=user_id, token=token, expires_at=datetime.utcnow() + timedelta(days=30))
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _new_refresh_token(user_id: int, token: str, device: Optional[str] = None) -> RefreshToken:
+    now = datetime.utcnow()
+    return RefreshToken(
+        user_id=user_id,
+        token_hash=hash_token(token),
+        created_at=now,
+        expires_at=now + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES),
+        device=device[:255] if device else None
+    )
+
+def create_refresh_token(db: Session, user_id: int, token: str, device: Optional[str] = None):
+    db_token = _new_refresh_token(user_id, token, device)
     db.add(db_token)
     db.commit()
-    db.refresh(db_token)
     return db_token
 
-def delete_refresh_token(db: Session, user_id: int):
-    db.query(RefreshToken).filter(RefreshToken.user_id == user_id).delete()
+def rotate_refresh_token(db: Session, user_id: int, old_token: str, new_token: str, device: Optional[str] = None) -> bool:
+    """Replace one device's refresh token in a single transaction; False if the old one is unknown or expired."""
+    deleted = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_token(old_token),
+        RefreshToken.user_id == user_id,
+        RefreshToken.expires_at > datetime.utcnow()
+    ).delete(synchronize_session=False)
+    if not deleted:
+        db.rollback()
+        return False
+    db.add(_new_refresh_token(user_id, new_token, device))
+    db.commit()
+    return True
+
+def revoke_refresh_token(db: Session, token: str):
+    db.query(RefreshToken).filter(RefreshToken.token_hash == hash_token(token)).delete(synchronize_session=False)
     db.commit()
 
+def purge_expired_refresh_tokens(db: Session, batch_size: int = 1000) -> int:
+    """Delete at most `batch_size` expired tokens using the expires_at index; returns the number removed."""
+    expired = select(RefreshToken.id).where(RefreshToken.expires_at <= datetime.utcnow()).limit(batch_size)
+    deleted = db.query(RefreshToken).filter(RefreshToken.id.in_(expired)).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
 def update_user_vk_id(db: Session, user_id: int, vk_id: str):
     user = get_user(db, user_id)
     if user:
         user.vk_id = vk_id
         db.commit()
         db.refresh(user)
+        user_cache.invalidate(user.username)
     return user
 
-
+def update_user(db: Session, user_id: int, role: Optional[str] = None, disabled: Optional[bool] = None, quota_bytes=...):
+    """`quota_bytes` is left alone unless passed; None means the default quota."""
+    user = get_user(db, user_id)
+    if user:
+        if role is not None:
+            user.role = role
+        if disabled is not None:
+            user.disabled = disabled
+        if quota_bytes is not ...:
+            user.quota_bytes = quota_bytes
+        db.commit()
+        db.refresh(user)
+        user_cache.invalidate(user.username)
+    return user
@@ -2,50 +2,158 @@
 Implementation of authorization via VK.
 """
 
-import httpx
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlencode
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from config import VK_CLIENT_ID, VK_CLIENT_SECRET, VK_REDIRECT_URI
+from config import (
+    VK_CLIENT_ID, VK_CLIENT_SECRET, VK_REDIRECT_URI, VK_OAUTH_URL, VK_API_URL, VK_API_VERSION,
+    VK_HTTP_CONNECT_TIMEOUT, VK_HTTP_READ_TIMEOUT, VK_HTTP_MAX_CONNECTIONS, VK_HTTP_MAX_KEEPALIVE,
+    VK_HTTP_CONCURRENCY, VK_HTTP_RETRIES, VK_HTTP2,
+)
 from user_operations import get_user_by_username, create_user, update_user_vk_id
+from user_operations import create_refresh_token as store_refresh_token
 from schemas import UserCreate
 from auth import create_access_token, create_refresh_token
 
-async def vk_login():
-    return {
-        "url": f"https://oauth.vk.com/authorize?client_id={VK_CLIENT_ID}&display=page&redirect_uri={VK_REDIRECT_URI}&scope=email&response_type=code&v=5.131"
-    }
+if TYPE_CHECKING:
+    import httpx
 
-async def vk_callback(code: str, db: Session):
-    async with httpx.AsyncClient() as client:
-        token_response = await client.get(
-            f"https://oauth.vk.com/access_token?client_id={VK_CLIENT_ID}&client_secret={VK_CLIENT_SECRET}&redirect_uri={VK_REDIRECT_URI}&code={code}"
-        )
-        token_data = token_response.json()
-        
-        if "access_token" not in token_data:
-            raise HTTPException(status_code=400, detail="Failed to get access token")
-        
-        vk_access_token = token_data["access_token"]
-        vk_user_id = token_data["user_id"]
-        email = token_data.get("email")
-        
-        user_response = await client.get(
-            f"https://api.vk.com/method/users.get?user_ids={vk_user_id}&fields=first_name,last_name&access_token={vk_access_token}&v=5.131"
+logger = logging.getLogger(__name__)
+
+AUTHORIZE_URL = f"{VK_OAUTH_URL}/authorize?" + urlencode({
+    "client_id": VK_CLIENT_ID or "",
+    "display": "page",
+    "redirect_uri": VK_REDIRECT_URI or "",
+    "scope": "email",
+    "response_type": "code",
+    "v": VK_API_VERSION,
+})
+
+RETRY_BACKOFF_SECONDS = 0.2
+
+_client: Optional["httpx.AsyncClient"] = None
+_limit: Optional[asyncio.Semaphore] = None
+
+
+def start():
+    """Open the shared client; connections to VK are pooled and kept alive across logins.
+
+    Called on the first VK request rather than at startup, so httpx is only
+    imported by workers that actually talk to VK.
+    """
+    import httpx
+
+    global _client, _limit
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=VK_HTTP2,
+            timeout=httpx.Timeout(VK_HTTP_READ_TIMEOUT, connect=VK_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=VK_HTTP_MAX_CONNECTIONS, max_keepalive_connections=VK_HTTP_MAX_KEEPALIVE),
         )
-        user_data = user_response.json()["response"][0]
-        
-        username = f"vk_{vk_user_id}"
+        _limit = asyncio.Semaphore(VK_HTTP_CONCURRENCY)
+
+async def stop():
+    global _client, _limit
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _limit = None
+
+async def _get(url: str, params: dict, idempotent: bool) -> dict:
+    """GET a VK endpoint as JSON with bounded retries; VK outages surface as 502/504."""
+    import httpx
+
+    if _client is None:
+        start()
+    # Failures where the request never reached VK; safe to retry even for the single-use code exchange.
+    not_sent_errors = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    attempt = 0
+    while True:
+        try:
+            async with _limit:
+                response = await _client.get(url, params=params)
+            # VK reports OAuth errors (e.g. a spent code) as 4xx with a JSON body; the caller handles those.
+            if response.status_code < 500:
+                return response.json()
+            if not idempotent or attempt >= VK_HTTP_RETRIES:
+                raise _unavailable(RuntimeError(f"HTTP {response.status_code} from {url}"))
+        except not_sent_errors as exc:
+            if attempt >= VK_HTTP_RETRIES:
+                raise _unavailable(exc)
+        except httpx.HTTPError as exc:
+            if not idempotent or attempt >= VK_HTTP_RETRIES:
+                raise _unavailable(exc)
+        except ValueError as exc:
+            raise _unavailable(exc)
+        attempt += 1
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+def _unavailable(exc: Exception) -> HTTPException:
+    import httpx
+
+    logger.warning("VK request failed: %r", exc)
+    if isinstance(exc, httpx.TimeoutException):
+        return HTTPException(status_code=504, detail="VK did not respond in time")
+    return HTTPException(status_code=502, detail="VK is unavailable")
+
+def _get_or_create_user(db: Session, username: str, email: Optional[str], vk_user_id: str):
+    user = get_user_by_username(db, username)
+    if user:
+        return user
+    try:
+        user = create_user(db, UserCreate(
+            username=username,
+            email=email or f"{username}@example.com",
+            password="",
+            role="user"
+        ))
+    except IntegrityError:
+        # A concurrent first sign-in of the same VK account created the user first.
+        db.rollback()
         user = get_user_by_username(db, username)
         if not user:
-            user = create_user(db, UserCreate(
-                username=username,
-                email=email or f"{username}@example.com",
-                password="",
-                role="user"
-            ))
-            update_user_vk_id(db, user.id, str(vk_user_id))
-        
-        access_token = create_access_token(data={"sub": username, "role": user.role})
-        refresh_token = create_refresh_token(data={"sub": username, "role": user.role})
-        
-        return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
\ No newline at end of file
+            raise HTTPException(status_code=400, detail="Email already registered")
+        return user
+    return update_user_vk_id(db, user.id, vk_user_id)
+
+def vk_login():
+    return {"url": AUTHORIZE_URL}
+
+async def vk_callback(code: str, db: Session):
+    # The code is single-use, so the exchange is only retried when it provably never reached VK.
+    token_data = await _get(f"{VK_OAUTH_URL}/access_token", {
+        "client_id": VK_CLIENT_ID,
+        "client_secret": VK_CLIENT_SECRET,
+        "redirect_uri": VK_REDIRECT_URI,
+        "code": code,
+    }, idempotent=False)
+
+    if "access_token" not in token_data:
+        raise HTTPException(status_code=400, detail="Failed to get access token")
+
+    vk_access_token = token_data["access_token"]
+    vk_user_id = token_data["user_id"]
+    email = token_data.get("email")
+
+    user_data = await _get(f"{VK_API_URL}/method/users.get", {
+        "user_ids": vk_user_id,
+        "fields": "first_name,last_name",
+        "access_token": vk_access_token,
+        "v": VK_API_VERSION,
+    }, idempotent=True)
+    if not user_data.get("response"):
+        raise HTTPException(status_code=400, detail="Failed to get VK user profile")
+
+    username = f"vk_{vk_user_id}"
+    user = await run_in_threadpool(_get_or_create_user, db, username, email, str(vk_user_id))
+
+    access_token = create_access_token(data={"sub": username, "role": user.role})
+    refresh_token = create_refresh_token(data={"sub": username, "role": user.role})
+    await run_in_threadpool(store_refresh_token, db, user.id, refresh_token)
+
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}